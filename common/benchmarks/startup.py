@@ -0,0 +1,151 @@
+# Cold start: how long `import main` takes in a fresh interpreter, and how
+# long from spawning `uvicorn main:app` until /health/live answers 200.
+# Importing main must not connect to anything, so both run against whatever
+# DATABASE_URL says (a migrated temporary SQLite file by default) without
+# Redis, Consul or the other service being up.
+#
+# Run from the service's directory:
+#   PYTHONPATH=../common python -m benchmarks.startup --runs 5 --output startup.json \
+#       --baseline benchmarks/baselines/startup.json
+# Exits with 1 if the median of either time regressed against the baseline
+# by more than --threshold. --importtime prints the slowest imports.
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+READY_TIMEOUT = 60.0
+METRICS = ("import_ms", "first_request_ms")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(env):
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], env=env, check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1]) * 1000
+
+
+def slowest_imports(env, count: int):
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], env=env, check=True,
+                            capture_output=True, text=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Only imports made by main and the service's own modules directly.
+        if name.startswith("   ") and not name.startswith("    "):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def measure_first_request(env):
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health/live"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < READY_TIMEOUT:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {server.returncode} before serving")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"{url} did not answer within {READY_TIMEOUT}s")
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def summarize(values):
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+
+def compare(results, baseline, threshold: float):
+    regressions = []
+    for key in METRICS:
+        current, base = results[key]["median"], baseline[key]["median"]
+        if base and current > base * (1 + threshold):
+            regressions.append(f"{key}: median {current} vs baseline {base}")
+    return regressions
+
+
+def run(args, env):
+    imports = [measure_import(env) for _ in range(args.runs)]
+    first_requests = [measure_first_request(env) for _ in range(args.runs)]
+    return {
+        "service": os.path.basename(os.getcwd()),
+        "runs": args.runs,
+        "python": platform.python_version(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "import_ms": summarize(imports),
+        "first_request_ms": summarize(first_requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file, migrated first")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="print the N slowest imports of main")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative change before failing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "DATABASE_URL": args.database_url or f"sqlite:///{directory}/startup.db",
+            "WEB_CONCURRENCY": "1",
+            "LEADER_LOCK_DIR": directory,
+        }
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], env=env, check=True, capture_output=True)
+        if args.importtime:
+            for cumulative, name in slowest_imports(env, args.importtime):
+                print(f"{cumulative:>9.1f} ms  {name}")
+        results = run(args, env)
+
+    for key in METRICS:
+        print(f"{key:<17} median {results[key]['median']:>8} min {results[key]['min']:>8} max {results[key]['max']:>8}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+    if not args.baseline:
+        sys.exit(0)
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (threshold {args.threshold:.0%})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
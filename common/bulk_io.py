@@ -0,0 +1,285 @@
+import asyncio
+import csv
+import hmac
+import io
+import json
+import os
+import sys
+from typing import Optional
+from fastapi import Header, HTTPException
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+# Bulk import and export as NDJSON or CSV, in constant memory, shared by the
+# services' bulk modules. Imports parse the input as it arrives, validate it
+# IMPORT_CHUNK_SIZE rows at a time with the API's own schemas, and hand each
+# chunk to the service to write, usually with one binary COPY. A bad row is
+# reported with its line number and skipped; it never aborts the rest. CSV
+# exports stream straight out of COPY ... TO STDOUT; NDJSON exports read
+# through a server-side cursor.
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", "5000"))
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+BULK_MAX_ERRORS = int(os.environ.get("BULK_MAX_ERRORS", "1000"))
+# The bulk endpoints are off unless a token is configured.
+BULK_API_TOKEN = os.environ.get("BULK_API_TOKEN", "")
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Postgres integer columns and text: values outside these pass validation
+# only to fail the COPY.
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+def require_bulk_token(x_bulk_token: Optional[str] = Header(None)):
+    if not BULK_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Bulk endpoints are disabled")
+    if not hmac.compare_digest(x_bulk_token or "", BULK_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid bulk token")
+
+# Parsing. Both parsers yield (line number, row dict or None, error or None).
+
+# Yields (text, error) per line. A line that isn't UTF-8 comes with an
+# error, and with its bad bytes replaced so a CSV record still splits right.
+async def _lines(chunks):
+    def decode(line):
+        try:
+            return line.decode().rstrip("\r"), None
+        except UnicodeDecodeError as e:
+            return line.decode(errors="replace").rstrip("\r"), f"Invalid UTF-8: {e.reason} at byte {e.start}"
+
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield decode(line)
+    if buffer:
+        yield decode(buffer)
+
+async def parse_ndjson(chunks):
+    line_no = 0
+    async for line, error in _lines(chunks):
+        line_no += 1
+        if error is not None:
+            yield line_no, None, error
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"Invalid JSON: {e}"
+            continue
+        if isinstance(row, dict):
+            yield line_no, row, None
+        else:
+            yield line_no, None, "Expected a JSON object"
+
+async def parse_csv(chunks):
+    header, pending, line_no, start, record_error = None, [], 0, 0, None
+    async for line, error in _lines(chunks):
+        line_no += 1
+        if not pending:
+            start, record_error = line_no, None
+        pending.append(line)
+        record_error = record_error or error
+        record = "\n".join(pending)
+        # An odd number of quotes means a quoted field runs onto the next line.
+        if record.count('"') % 2:
+            continue
+        pending = []
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = values
+            if record_error is not None:
+                yield start, None, record_error
+        elif record_error is not None:
+            yield start, None, record_error
+        elif len(values) != len(header):
+            yield start, None, f"Expected {len(header)} fields, got {len(values)}"
+        else:
+            yield start, dict(zip(header, values)), None
+    if pending:
+        yield start, None, "Unterminated quoted field"
+
+def parser_for(format: str):
+    return parse_csv if format == "csv" else parse_ndjson
+
+# Importing
+
+def _add_error(report, line: int, error: str):
+    report["error_count"] += 1
+    if len(report["errors"]) < BULK_MAX_ERRORS:
+        report["errors"].append({"line": line, "error": error})
+
+def _describe(error: ValidationError):
+    messages = []
+    for detail in error.errors():
+        field = ".".join(str(part) for part in detail["loc"])
+        messages.append(f"{field}: {detail['msg']}" if field else detail["msg"])
+    return "; ".join(messages)
+
+def _column_error(item):
+    for field, value in item.model_dump().items():
+        if isinstance(value, int) and not isinstance(value, bool) and not INT32_MIN <= value <= INT32_MAX:
+            return f"{field}: Input should fit in a 32-bit integer"
+        if isinstance(value, str) and "\x00" in value:
+            return f"{field}: Input should not contain NUL characters"
+    return None
+
+async def _chunked(rows, size: int):
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Whether the database refused some of the rows, rather than failed to run
+# the write at all; only then is it worth splitting the chunk.
+def _rejected_rows(error: Exception):
+    return (
+        isinstance(error, DBAPIError)
+        and not error.connection_invalidated
+        and not isinstance(error, OperationalError)
+    )
+
+# Writes a chunk, and if the database rejects it, each half on its own, down
+# to the single rows that fail, so one bad row costs about log2(chunk) extra
+# writes instead of the whole chunk.
+async def _write_bisecting(write_chunk, valid):
+    try:
+        return await write_chunk(valid)
+    except Exception as e:
+        if not _rejected_rows(e):
+            print(f"Bulk import chunk failed: {e}")
+            return 0, [(line, f"Chunk failed: {e}") for line, _ in valid]
+        if len(valid) == 1:
+            return 0, [(valid[0][0], f"Rejected by the database: {e.orig}")]
+    middle = len(valid) // 2
+    first_written, first_errors = await _write_bisecting(write_chunk, valid[:middle])
+    second_written, second_errors = await _write_bisecting(write_chunk, valid[middle:])
+    return first_written + second_written, first_errors + second_errors
+
+# Validates rows against schema and hands each chunk of valid (line, item)
+# pairs to write_chunk, which returns (rows written, [(line, error)]). If
+# given, prepare runs once per chunk before it is written, for work that
+# shouldn't be repeated when a failed write is split (e.g. hashing), and
+# returns the (line, item) pairs to write and [(line, error)]. A chunk is
+# written while the next one is parsed and validated.
+async def import_rows(rows, schema, write_chunk, chunk_size: int = IMPORT_CHUNK_SIZE, prepare=None):
+    report = {"imported": 0, "error_count": 0, "errors": []}
+
+    async def write(valid):
+        errors = []
+        if prepare is not None:
+            try:
+                valid, errors = await prepare(valid)
+            except Exception as e:
+                print(f"Bulk import chunk failed: {e}")
+                return 0, [(line, f"Chunk failed: {e}") for line, _ in valid]
+        if not valid:
+            return 0, errors
+        written, write_errors = await _write_bisecting(write_chunk, valid)
+        return written, errors + write_errors
+
+    async def collect(task):
+        written, errors = await task
+        report["imported"] += written
+        for line, error in errors:
+            _add_error(report, line, error)
+
+    writing = None
+    async for chunk in _chunked(rows, chunk_size):
+        valid = []
+        for line, row, error in chunk:
+            if error is None:
+                try:
+                    item = schema.model_validate(row)
+                except ValidationError as e:
+                    error = _describe(e)
+                else:
+                    error = _column_error(item)
+                    if error is None:
+                        valid.append((line, item))
+                        continue
+            _add_error(report, line, error)
+        if writing is not None:
+            await collect(writing)
+            writing = None
+        if valid:
+            writing = asyncio.ensure_future(write(valid))
+    if writing is not None:
+        await collect(writing)
+    return report
+
+async def copy_records(conn, table, columns, records):
+    if conn.dialect.name == "postgresql":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table.name, records=records, columns=columns)
+    else:
+        await conn.execute(insert(table), [dict(zip(columns, record)) for record in records])
+
+# Exporting
+
+async def _copy_out(conn, query: str):
+    raw = await conn.get_raw_connection()
+    queue = asyncio.Queue(maxsize=16)
+
+    async def produce():
+        try:
+            await raw.driver_connection.copy_from_query(query, output=queue.put, format="csv", header=True)
+        finally:
+            await queue.put(None)
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            yield chunk
+        await task
+    finally:
+        task.cancel()
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+async def export_rows(engine, query, columns, format: str = "ndjson"):
+    async with engine.connect() as conn:
+        if format == "csv" and conn.dialect.name == "postgresql":
+            compiled = query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+            async for chunk in _copy_out(conn, str(compiled)):
+                yield chunk
+            return
+
+        if format == "csv":
+            yield _csv_lines([columns])
+        result = await conn.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for batch in result.partitions():
+            if format == "csv":
+                yield _csv_lines(batch)
+            else:
+                yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in batch)
+
+# For the services' CLIs: reads a file, or stdin for -, in chunks.
+async def file_chunks(path: str, size: int = 1 << 20):
+    with (sys.stdin.buffer if path == "-" else open(path, "rb")) as source:
+        while True:
+            chunk = source.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+async def write_to_stdout(chunks):
+    async for chunk in chunks:
+        sys.stdout.buffer.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+    sys.stdout.buffer.flush()
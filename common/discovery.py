@@ -0,0 +1,124 @@
+import asyncio
+import os
+import socket
+import httpx
+from http_client import http_client
+
+# Consul registration and discovery without blocking the event loop.
+#
+# The instance registers itself once on startup (from its leader worker)
+# with an HTTP health check that Consul runs against it, and deregisters on
+# shutdown; Consul also drops it if the check stays critical for
+# CONSUL_DEREGISTER_AFTER. Its ID comes from the hostname and port, so every worker of a container, and whichever takes over as leader,
+# registers the same one. For every service named in CONSUL_WATCH a
+# background task follows /v1/health/service/<name>?passing with blocking
+# queries, so instances(name) is a dictionary read that only ever returns
+# instances whose checks pass.
+CONSUL_URL = f"http://{os.environ.get('CONSUL_HOST', 'consul')}:{os.environ.get('CONSUL_PORT', '8500')}"
+CONSUL_CHECK_PATH = os.environ.get("CONSUL_CHECK_PATH", "/health/ready")
+CONSUL_CHECK_INTERVAL = os.environ.get("CONSUL_CHECK_INTERVAL", "10s")
+CONSUL_CHECK_TIMEOUT = os.environ.get("CONSUL_CHECK_TIMEOUT", "2s")
+CONSUL_DEREGISTER_AFTER = os.environ.get("CONSUL_DEREGISTER_AFTER", "1m")
+CONSUL_WATCH_WAIT = int(os.environ.get("CONSUL_WATCH_WAIT", "55"))
+CONSUL_WATCH = [name for name in os.environ.get("CONSUL_WATCH", "").split(",") if name]
+CONSUL_RETRY_DELAY = 1.0
+
+# The address other containers reach this one on. Each replica has its own,
+# unlike the compose service name.
+def default_address():
+    return os.environ.get("SERVICE_ADDRESS") or socket.gethostbyname(socket.gethostname())
+
+class Discovery:
+    def __init__(self, name: str, port: int, tags=(), watch=(), client=http_client):
+        self.name = name
+        self.port = port
+        self.tags = list(tags)
+        self.watch = list(watch)
+        self.client = client
+        self.service_id = f"{name}-{socket.gethostname()}-{port}"
+        self.registered = False
+        self._instances = {}
+        self._tasks = []
+
+    def instances(self, name: str):
+        return self._instances.get(name, [])
+
+    async def register(self, address: str = None):
+        address = address or default_address()
+        response = await self.client.put(f"{CONSUL_URL}/v1/agent/service/register", json={
+            "ID": self.service_id,
+            "Name": self.name,
+            "Address": address,
+            "Port": self.port,
+            "Tags": self.tags,
+            "Check": {
+                "HTTP": f"http://{address}:{self.port}{CONSUL_CHECK_PATH}",
+                "Interval": CONSUL_CHECK_INTERVAL,
+                "Timeout": CONSUL_CHECK_TIMEOUT,
+                "DeregisterCriticalServiceAfter": CONSUL_DEREGISTER_AFTER,
+            },
+        })
+        response.raise_for_status()
+        self.registered = True
+        print(f"Registered {self.name} with Consul as {self.service_id} at {address}:{self.port}")
+
+    async def deregister(self):
+        if not self.registered:
+            return
+        response = await self.client.put(f"{CONSUL_URL}/v1/agent/service/deregister/{self.service_id}")
+        response.raise_for_status()
+        self.registered = False
+        print(f"Deregistered {self.service_id} from Consul")
+
+    # One blocking query: returns once the healthy set changes or after
+    # CONSUL_WATCH_WAIT seconds, with the index to wait on next.
+    async def poll(self, name: str, index: int = 0):
+        response = await self.client.get(
+            f"{CONSUL_URL}/v1/health/service/{name}",
+            params={"passing": "true", "index": index, "wait": f"{CONSUL_WATCH_WAIT}s"},
+            timeout=CONSUL_WATCH_WAIT + 10,
+        )
+        response.raise_for_status()
+        self._instances[name] = [
+            (entry["Service"]["Address"] or entry["Node"]["Address"], entry["Service"]["Port"])
+            for entry in response.json()
+        ]
+        new_index = int(response.headers.get("X-Consul-Index", "0"))
+        # Consul asks clients to start over if the index goes backwards.
+        return 0 if new_index < index else new_index
+
+    async def _watch(self, name: str):
+        index = 0
+        while True:
+            try:
+                index = await self.poll(name, index)
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                print(f"Watching {name} in Consul failed, retrying: {e}")
+                index = 0
+                await asyncio.sleep(CONSUL_RETRY_DELAY)
+
+    # Run by the leader worker only, so a container registers once however
+    # many workers it has.
+    async def register_until_done(self):
+        while True:
+            try:
+                await self.register()
+                return
+            except (httpx.HTTPError, OSError) as e:
+                print(f"Consul registration failed, retrying: {e}")
+                await asyncio.sleep(CONSUL_RETRY_DELAY)
+
+    # Starts the watches. Neither a missing Consul nor a missing watched
+    # service holds up startup.
+    def start(self):
+        self._tasks = [asyncio.create_task(self._watch(name)) for name in self.watch]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self.deregister()
+        except (httpx.HTTPError, OSError) as e:
+            print(f"Consul deregistration failed: {e}")
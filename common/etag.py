@@ -0,0 +1,24 @@
+import hashlib
+from fastapi import Response
+
+# ETags for GETs that clients poll. A tag comes from a row's version column
+# or from a payload that is already serialized, so it costs no serialization,
+# and a request whose If-None-Match has it gets an empty 304 instead.
+
+def for_version(kind: str, id: int, version: int):
+    return f'"{kind}-{id}-v{version}"'
+
+def for_content(content):
+    if isinstance(content, str):
+        content = content.encode()
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+# If-None-Match uses the weak comparison, so W/ tags match too.
+def matches(if_none_match, etag: str):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+def not_modified(etag: str):
+    return Response(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+from sqlalchemy import text
+from instrumentation import LoopLagMonitor, pool_stats
+
+# Readiness for Consul and the gateway, shared by the services' health
+# modules, which only register their probes. /health/ready probes every
+# dependency concurrently, each within HEALTH_PROBE_TIMEOUT, and caches the
+# result for HEALTH_CACHE_TTL seconds; concurrent callers share one run, so
+# however often it is polled, the dependencies see at most one probe per
+# interval. A replica is ready when its critical probes pass, its DB pools
+# aren't saturated and its event loop isn't lagging. /health/live only says
+# the process is serving requests.
+HEALTH_PROBE_TIMEOUT = float(os.environ.get("HEALTH_PROBE_TIMEOUT", "0.5"))
+HEALTH_CACHE_TTL = float(os.environ.get("HEALTH_CACHE_TTL", "2"))
+HEALTH_MAX_POOL_UTILIZATION = float(os.environ.get("HEALTH_MAX_POOL_UTILIZATION", "1.0"))
+HEALTH_MAX_LOOP_LAG = float(os.environ.get("HEALTH_MAX_LOOP_LAG", "0.5"))
+
+class Probe:
+    def __init__(self, name: str, check, critical: bool = True):
+        self.name = name
+        self.check = check
+        self.critical = critical
+
+class HealthCheck:
+    def __init__(self, probes, pools: dict, lag_monitor: LoopLagMonitor,
+                 timeout: float = HEALTH_PROBE_TIMEOUT, ttl: float = HEALTH_CACHE_TTL):
+        self.probes = probes
+        self.pools = pools
+        self.lag_monitor = lag_monitor
+        self.timeout = timeout
+        self.ttl = ttl
+        self._result = None
+        self._checked_at = 0.0
+        self._running = None
+
+    async def _probe(self, probe: Probe):
+        started = time.perf_counter()
+        error = None
+        try:
+            await asyncio.wait_for(probe.check(), self.timeout)
+        except asyncio.TimeoutError:
+            error = f"timed out after {self.timeout}s"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        result = {"ok": error is None, "critical": probe.critical, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+        if error is not None:
+            result["error"] = error
+        return probe.name, result
+
+    async def _run(self):
+        checks = dict(await asyncio.gather(*(self._probe(probe) for probe in self.probes)))
+        pools = {name: pool_stats(pool) for name, pool in self.pools.items()}
+        lag = self.lag_monitor.lag
+        ready = (
+            all(check["ok"] for check in checks.values() if check["critical"])
+            and all(stats is None or stats["utilization"] < HEALTH_MAX_POOL_UTILIZATION for stats in pools.values())
+            and lag < HEALTH_MAX_LOOP_LAG
+        )
+        return ready, {
+            "status": "ready" if ready else "unavailable",
+            "checks": checks,
+            "pools": pools,
+            "loop_lag_ms": round(lag * 1000, 2),
+        }
+
+    # Returns (ready, report).
+    async def ready(self):
+        if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+        if self._running is None or self._running.done():
+            self._running = asyncio.ensure_future(self._run())
+        self._result = await asyncio.shield(self._running)
+        self._checked_at = time.monotonic()
+        return self._result
+
+    def live(self):
+        return {"status": "alive", "loop_lag_ms": round(self.lag_monitor.lag * 1000, 2)}
+
+# Probes for the dependencies every service has.
+
+def database_check(engine):
+    async def check():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    return check
+
+def redis_check(get_redis):
+    async def check():
+        await get_redis().ping()
+    return check
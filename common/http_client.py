@@ -0,0 +1,184 @@
+import asyncio
+import importlib.util
+import os
+import random
+import time
+from collections import defaultdict
+import httpx
+from prometheus_client import Counter, Gauge, Histogram
+
+# One pooled httpx.AsyncClient per process for calls to other services,
+# started and closed with the app. Connections are kept alive and reused,
+# HTTP/2 is used when the h2 package is installed, and every host gets at
+# most HTTP_MAX_PER_HOST requests in flight.
+#
+# Failed requests (connection errors, timeouts, 502/503/504) are retried
+# up to HTTP_RETRIES times with full-jitter exponential backoff, but only when
+# repeating them is safe: idempotent methods, or requests carrying an
+# Idempotency-Key header. After HTTP_BREAKER_FAILURES failures in a row a
+# host's circuit opens and calls to it fail fast with CircuitOpenError for
+# HTTP_BREAKER_RESET seconds, after which one trial request is let through.
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "5"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "2"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_MAX_PER_HOST = int(os.environ.get("HTTP_MAX_PER_HOST", "20"))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.1"))
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", "2"))
+HTTP_BREAKER_FAILURES = int(os.environ.get("HTTP_BREAKER_FAILURES", "5"))
+HTTP_BREAKER_RESET = float(os.environ.get("HTTP_BREAKER_RESET", "30"))
+HTTP2 = os.environ.get("HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {502, 503, 504}
+
+requests_total = Counter("http_client_requests_total", "Outgoing HTTP requests", ["host", "outcome"])
+retries_total = Counter("http_client_retries_total", "Outgoing HTTP requests retried", ["host"])
+request_latency = Histogram("http_client_request_seconds", "Outgoing HTTP request latency", ["host"])
+in_flight = Gauge("http_client_in_flight", "Outgoing HTTP requests in flight", ["host"])
+pool_connections = Gauge("http_client_pool_connections", "Connections in the HTTP client pool", ["state"])
+circuit_open = Gauge("http_client_circuit_open", "1 while a host's circuit breaker is open", ["host"])
+
+class CircuitOpenError(httpx.HTTPError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, host: str, failures: int = HTTP_BREAKER_FAILURES, reset: float = HTTP_BREAKER_RESET, clock=time.monotonic):
+        self.host = host
+        self.max_failures = failures
+        self.reset = reset
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    # Closed: everything passes. Open: nothing passes until reset seconds
+    # have gone by, then a single trial request does.
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.clock() - self.opened_at >= self.reset:
+            # Restart the clock, so a trial that never reports back only
+            # blocks the host for another reset period.
+            self.opened_at = self.clock()
+            self.trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        circuit_open.labels(self.host).set(0)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial or self.failures >= self.max_failures:
+            self.opened_at = self.clock()
+            self.trial = False
+            circuit_open.labels(self.host).set(1)
+
+def backoff(attempt: int, base: float = HTTP_BACKOFF_BASE, cap: float = HTTP_BACKOFF_MAX):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class HttpClient:
+    def __init__(self, retries: int = HTTP_RETRIES, max_per_host: int = HTTP_MAX_PER_HOST, transport=None):
+        self.retries = retries
+        self.max_per_host = max_per_host
+        self.transport = transport
+        self._client = None
+        self._breakers = {}
+        self._slots = defaultdict(lambda: asyncio.Semaphore(self.max_per_host))
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2,
+                transport=self.transport,
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def breaker(self, host: str):
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker(host)
+        return self._breakers[host]
+
+    def _record_pool(self):
+        # httpx doesn't expose its pool, so this reads httpcore's.
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        if pool is None:
+            return
+        connections = pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        pool_connections.labels("idle").set(idle)
+        pool_connections.labels("active").set(len(connections) - idle)
+
+    async def _send(self, host: str, method: str, url: str, **kwargs):
+        async with self._slots[host]:
+            in_flight.labels(host).inc()
+            started = time.perf_counter()
+            try:
+                return await self._client.request(method, url, **kwargs)
+            finally:
+                request_latency.labels(host).observe(time.perf_counter() - started)
+                in_flight.labels(host).dec()
+                self._record_pool()
+
+    # Like httpx.AsyncClient.request. Returns the last response, which may be
+    # a 5xx once retries are used up, and raises httpx errors as they are.
+    async def request(self, method: str, url: str, **kwargs):
+        await self.start()
+        method = method.upper()
+        host = httpx.URL(url).netloc.decode()
+        breaker = self.breaker(host)
+        headers = kwargs.get("headers") or {}
+        retryable = method in IDEMPOTENT_METHODS or any(name.lower() == "idempotency-key" for name in headers)
+        attempts = self.retries + 1 if retryable else 1
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                requests_total.labels(host, "circuit_open").inc()
+                raise CircuitOpenError(f"Circuit open for {host}")
+            try:
+                response = await self._send(host, method, url, **kwargs)
+            except httpx.TransportError:
+                requests_total.labels(host, "error").inc()
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+            else:
+                requests_total.labels(host, f"{response.status_code // 100}xx").inc()
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    return response
+            retries_total.labels(host).inc()
+            await asyncio.sleep(backoff(attempt))
+
+    async def get(self, url: str, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url: str, **kwargs):
+        return await self.request("PUT", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+http_client = HttpClient()
@@ -0,0 +1,229 @@
+import asyncio
+import os
+import re
+import time
+from functools import lru_cache
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+
+# Metrics below the HTTP layer, for telling apart the usual causes of a p99
+# regression: SQL that got slow, requests queueing for a pooled connection,
+# and handlers blocking the event loop. With INSTRUMENTATION_ENABLED=0 no
+# engine events are attached and nothing is recorded per query, checkout or
+# message; the loop lag sampler keeps running since /health/ready reads it.
+INSTRUMENTATION_ENABLED = os.environ.get("INSTRUMENTATION_ENABLED", "1") == "1"
+SQL_LABEL_MAX_LENGTH = int(os.environ.get("SQL_LABEL_MAX_LENGTH", "160"))
+LOOP_LAG_INTERVAL = 0.25
+GAUGE_SAMPLE_INTERVAL = 1.0
+
+query_duration = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution time, by engine and normalized statement",
+    ["engine", "statement"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+query_errors = Counter("db_query_errors_total", "SQL statements that raised, by engine", ["engine"])
+pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent getting a connection from the pool, including opening a new one",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+loop_lag = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a timer, sampled every 0.25s",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+# Set on every checkout and checkin rather than read from the pools when
+# scraped: with PROMETHEUS_MULTIPROC_DIR the scrape is answered from the
+# shared files alone, so only values each worker writes there show up.
+pool_size = Gauge("db_pool_size", "Connections the pool keeps open", ["engine"], multiprocess_mode="livesum")
+pool_checked_out = Gauge(
+    "db_pool_checked_out", "Connections currently checked out", ["engine"], multiprocess_mode="livesum",
+)
+pool_overflow = Gauge("db_pool_overflow", "Connections open beyond the pool size", ["engine"], multiprocess_mode="livesum")
+ws_connections = Gauge("ws_active_connections", "Open WebSocket connections", multiprocess_mode="livesum")
+ws_connections_total = Counter("ws_connections_total", "WebSocket connections accepted")
+ws_messages = Counter("ws_messages_total", "WebSocket messages, by direction", ["direction"])
+_ws_received = ws_messages.labels("received")
+_ws_sent = ws_messages.labels("sent")
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMETERS = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+|__\[POSTCOMPILE_\w+\]")
+_LISTS = re.compile(r"\(\?(?:, \?)+\)")
+_ROWS = re.compile(r"\(\?\)(?:, \(\?\))+")
+_SPACES = re.compile(r"\s+")
+
+# One label per query shape: literals, bound parameters, IN lists and
+# multi-row VALUES collapse to "?", so the label set stays as small as the
+# set of statements the code can issue.
+@lru_cache(maxsize=2048)
+def normalize_statement(statement: str):
+    statement = _SPACES.sub(" ", statement).strip()
+    statement = _LITERALS.sub("?", _PARAMETERS.sub("?", statement))
+    statement = _ROWS.sub("(?)", _LISTS.sub("(?)", statement))
+    if len(statement) > SQL_LABEL_MAX_LENGTH:
+        statement = statement[:SQL_LABEL_MAX_LENGTH - 3] + "..."
+    return statement
+
+# Connections checked out of a QueuePool against everything it may open.
+# Pools without a fixed size (SQLite's) report None.
+def pool_stats(pool):
+    if not hasattr(pool, "checkedout") or not hasattr(pool, "_max_overflow"):
+        return None
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "checked_out": checked_out,
+        "overflow": max(pool.overflow(), 0),
+        "utilization": round(checked_out / capacity, 3) if capacity else 0.0,
+    }
+
+def _record_pool(pool, name: str):
+    stats = pool_stats(pool)
+    if stats is None:
+        return
+    pool_size.labels(name).set(stats["size"])
+    pool_checked_out.labels(name).set(stats["checked_out"])
+    pool_overflow.labels(name).set(stats["overflow"])
+
+def _track_pool(pool, name: str):
+    # The pool has no event before a checkout starts, or after a checked in
+    # connection is counted as returned, so both are wrapped around _do_get
+    # and _do_return_conn, which every pool class implements.
+    do_get = pool._do_get
+    do_return_conn = pool._do_return_conn
+    histogram = pool_checkout_wait.labels(name)
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            _record_pool(pool, name)
+
+    def recorded_do_return_conn(record):
+        try:
+            do_return_conn(record)
+        finally:
+            _record_pool(pool, name)
+
+    pool._do_get = timed_do_get
+    pool._do_return_conn = recorded_do_return_conn
+    _record_pool(pool, name)
+
+# Attaches the SQL and pool metrics to an engine (sync or async) under the
+# given name.
+def instrument_engine(engine, name: str, enabled: bool = INSTRUMENTATION_ENABLED):
+    engine = getattr(engine, "sync_engine", engine)
+    if not enabled:
+        return
+    _track_pool(engine.pool, name)
+    errors = query_errors.labels(name)
+
+    # A stack, since a statement can run while another one's cursor is open.
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        query_duration.labels(name, normalize_statement(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        errors.inc()
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, record: bool = INSTRUMENTATION_ENABLED):
+        self.interval = interval
+        self.record = record
+        self.lag = 0.0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # How much later than asked for a sleep wakes up: the time callbacks
+    # spend waiting for the loop.
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+            if self.record:
+                loop_lag.observe(self.lag)
+
+lag_monitor = LoopLagMonitor()
+
+# Gauges computed from state in the process, like the WebSocket send queue
+# depth. A set_function would only run in the worker that happens to serve
+# the scrape, and not at all with PROMETHEUS_MULTIPROC_DIR, so each worker
+# writes its value every GAUGE_SAMPLE_INTERVAL instead.
+_sampled_gauges = []
+
+def sample_gauge(gauge, function):
+    _sampled_gauges.append((gauge, function))
+
+class GaugeSampler:
+    def __init__(self, interval: float = GAUGE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def sample(self):
+        for gauge, function in _sampled_gauges:
+            gauge.set(function())
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+gauge_sampler = GaugeSampler()
+
+def ws_opened():
+    if INSTRUMENTATION_ENABLED:
+        ws_connections.inc()
+        ws_connections_total.inc()
+
+def ws_closed():
+    if INSTRUMENTATION_ENABLED:
+        ws_connections.dec()
+
+def ws_received():
+    if INSTRUMENTATION_ENABLED:
+        _ws_received.inc()
+
+def ws_sent():
+    if INSTRUMENTATION_ENABLED:
+        _ws_sent.inc()
+
+def start():
+    lag_monitor.start()
+    gauge_sampler.start()
+
+async def stop():
+    await lag_monitor.stop()
+    await gauge_sampler.stop()
@@ -0,0 +1,197 @@
+import itertools
+import json
+import math
+import os
+import time
+from prometheus_client import Counter
+from redis.exceptions import RedisClusterException, RedisError
+from starlette.routing import Match
+from redis_client import get_async_redis
+
+# Per-client rate limiting as ASGI middleware, using GCRA: a token bucket
+# that stores only the "theoretical arrival time" of the next request per key.
+# A client may send `burst` requests at once and then `rate` per second.
+#
+# Each request is checked against one limit: the rule for its route if there
+# is one, otherwise the service-wide default, so e.g. login can be much
+# stricter than reads. Buckets are per client and per rule.
+#
+# The default "memory" backend keeps buckets in the process, which is fastest
+# but gives every replica its own budget. The "redis" backend evaluates the
+# same algorithm atomically in a Lua script so all replicas share one budget;
+# if Redis is unreachable the in-process buckets take over.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", "20"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "40"))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+# Only turn this on when the service is reachable only through a proxy that
+# replaces X-Forwarded-For with the caller's address, as the gateway does;
+# otherwise clients could pick their own bucket.
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get("RATE_LIMIT_TRUST_FORWARDED", "0") == "1"
+RATE_LIMIT_EXEMPT = ("/metrics", "/health/live", "/health/ready")
+
+decisions = Counter(
+    "rate_limit_decisions_total",
+    "Rate limiter decisions",
+    ["route", "decision", "backend"],
+)
+
+# KEYS[1] bucket; ARGV emission interval and burst, in milliseconds and
+# requests. Uses the Redis clock so replicas agree on "now".
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - burst * interval
+if now < allow_at then
+    return {0, 0, math.ceil(allow_at - now), math.ceil(tat - now)}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+return {1, math.floor((now - allow_at) / interval), 0, math.ceil(new_tat - now)}
+"""
+
+class Limit:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.interval = 1.0 / rate
+
+# A decision is (allowed, remaining, retry_after, reset), times in seconds.
+
+class MemoryLimiter:
+    name = "memory"
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._tats = {}
+
+    def _evict(self, now: float):
+        # Buckets whose arrival time has passed are full again and can go. If
+        # every bucket is still draining, the least recently used go instead,
+        # a tenth at a time so a flood of new clients doesn't rescan each time.
+        self._tats = {key: tat for key, tat in self._tats.items() if tat > now}
+        if len(self._tats) >= self.max_keys:
+            excess = len(self._tats) - self.max_keys + max(1, self.max_keys // 10)
+            for key in list(itertools.islice(self._tats, excess)):
+                del self._tats[key]
+
+    # Runs without awaiting, so it's atomic on the event loop.
+    def check(self, key: str, limit: Limit):
+        now = self.clock()
+        # Taking the key out and putting it back keeps the dict in least
+        # recently used order for _evict.
+        known = self._tats.pop(key, None)
+        tat = now if known is None else max(known, now)
+        new_tat = tat + limit.interval
+        allow_at = new_tat - limit.burst * limit.interval
+        if now < allow_at:
+            self._tats[key] = tat
+            return False, 0, allow_at - now, tat - now
+        if known is None and len(self._tats) >= self.max_keys:
+            self._evict(now)
+        self._tats[key] = new_tat
+        return True, int((now - allow_at) / limit.interval), 0.0, new_tat - now
+
+    async def acquire(self, key: str, limit: Limit):
+        return self.check(key, limit), self.name
+
+class RedisLimiter:
+    name = "redis"
+
+    def __init__(self, fallback: MemoryLimiter = None):
+        self.fallback = fallback or MemoryLimiter()
+        self._script = None
+
+    async def acquire(self, key: str, limit: Limit):
+        try:
+            if self._script is None:
+                self._script = get_async_redis().register_script(GCRA_SCRIPT)
+            allowed, remaining, retry_after, reset = await self._script(
+                keys=[f"ratelimit:{key}"], args=[limit.interval * 1000, limit.burst],
+            )
+        except (RedisError, RedisClusterException) as e:
+            print(f"Rate limiter lost Redis, using in-process buckets: {e}")
+            return self.fallback.check(key, limit), self.fallback.name
+        return (bool(allowed), int(remaining), retry_after / 1000, reset / 1000), self.name
+
+def get_limiter(backend: str = RATE_LIMIT_BACKEND):
+    return RedisLimiter() if backend == "redis" else MemoryLimiter()
+
+def client_id(scope):
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode().split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+# The path template of the route a request will hit, e.g. /api/users/{user_id},
+# so metrics and rules don't depend on IDs in the URL.
+def route_path(scope, routes=None):
+    for route in scope["app"].router.routes if routes is None else routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            # Recent FastAPI versions keep an included router as one route.
+            if hasattr(route, "original_router"):
+                return route_path(scope, route.original_router.routes)
+            return route.path
+    return None
+
+def _headers(limit: Limit, decision):
+    allowed, remaining, retry_after, reset = decision
+    headers = [
+        (b"ratelimit-limit", str(limit.burst).encode()),
+        (b"ratelimit-remaining", str(remaining).encode()),
+        (b"ratelimit-reset", str(math.ceil(reset)).encode()),
+    ]
+    if not allowed:
+        headers.append((b"retry-after", str(max(1, math.ceil(retry_after))).encode()))
+    return headers
+
+# rules maps "METHOD /route/template" to a Limit, or to None to exempt the route.
+class RateLimitMiddleware:
+    def __init__(self, app, rules: dict = None, default: Limit = None, limiter=None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.rules = rules or {}
+        self.default = default or Limit(RATE_LIMIT_RATE, RATE_LIMIT_BURST)
+        self.limiter = limiter or get_limiter()
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or scope["path"] in RATE_LIMIT_EXEMPT:
+            await self.app(scope, receive, send)
+            return
+
+        route = route_path(scope)
+        rule = f"{scope['method']} {route}"
+        limit = self.rules.get(rule, self.default)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        bucket = f"{client_id(scope)}:{rule if rule in self.rules else '*'}"
+        decision, backend = await self.limiter.acquire(bucket, limit)
+        decisions.labels(route or "unmatched", "allowed" if decision[0] else "limited", backend).inc()
+        headers = _headers(limit, decision)
+
+        if not decision[0]:
+            body = json.dumps({"detail": "Too many requests"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + headers,
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
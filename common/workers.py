@@ -0,0 +1,65 @@
+import asyncio
+import fcntl
+import os
+import tempfile
+
+# Roles for background work when the app runs in several worker processes
+# (WEB_CONCURRENCY > 1, see entrypoint.sh). Per-worker components, such as
+# caches, WebSocket fan-out and Consul watches, start in every worker. Jobs
+# given to a Leader run in exactly one worker per container: the one holding
+# an exclusive flock on its lock file. The others keep trying every
+# LEADER_RETRY_INTERVAL seconds, so when the leader exits (and the kernel
+# drops its lock) another worker takes its jobs over.
+LEADER_LOCK_DIR = os.environ.get("LEADER_LOCK_DIR", tempfile.gettempdir())
+LEADER_RETRY_INTERVAL = float(os.environ.get("LEADER_RETRY_INTERVAL", "5"))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+# Splits a per-container budget, such as database connections, evenly
+# between the container's processes, giving each at least minimum.
+def per_process(total: int, processes: int = WEB_CONCURRENCY, minimum: int = 0):
+    return max(minimum, total // max(1, processes))
+
+class Leader:
+    def __init__(self, name: str, lock_dir: str = LEADER_LOCK_DIR, retry_interval: float = LEADER_RETRY_INTERVAL):
+        self.path = os.path.join(lock_dir, f"{name}.leader.lock")
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._jobs = []
+        self._tasks = []
+        self._campaign = None
+        self._lock_file = None
+
+    # Adds a coroutine function to start once this worker is the leader.
+    def run(self, job):
+        self._jobs.append(job)
+
+    def _try_acquire(self):
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _run_for_leadership(self):
+        while not self._try_acquire():
+            await asyncio.sleep(self.retry_interval)
+        self.is_leader = True
+        print(f"Worker {os.getpid()} is the leader for {self.path}")
+        self._tasks = [asyncio.create_task(job()) for job in self._jobs]
+
+    def start(self):
+        self._campaign = asyncio.create_task(self._run_for_leadership())
+
+    async def stop(self):
+        tasks = [task for task in [self._campaign] + self._tasks if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._campaign, self._tasks = None, []
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_leader = False
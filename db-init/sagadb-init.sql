@@ -2,6 +2,11 @@ CREATE TABLE IF NOT EXISTS saga_transactions (
     id SERIAL PRIMARY KEY,
     saga_id UUID NOT NULL,
     status VARCHAR(255) NOT NULL,
+    user_id INTEGER,
+    post_id INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE UNIQUE INDEX IF NOT EXISTS ix_saga_transactions_saga_id ON saga_transactions (saga_id);
+CREATE INDEX IF NOT EXISTS ix_saga_transactions_status_updated_at ON saga_transactions (status, updated_at);
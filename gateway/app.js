@@ -8,7 +8,7 @@ const protoLoader = require('@grpc/proto-loader');
 const { createProxyMiddleware } = require('http-proxy-middleware');
 const { v4: uuidv4 } = require('uuid'); 
 const client = require('prom-client');
-const { Client } = require('pg');
+const { Pool } = require('pg');
 const Redis = require('ioredis');
 
 const app = express();
@@ -55,22 +55,23 @@ app.get('/metrics', async (req, res) => {
   
 const userServiceUrl = process.env.USER_SERVICE_URL;
 const recommendationServiceUrl = process.env.RECOMMENDATION_SERVICE_URL;
-const sagaDbClient = new Client({
+const sagaDb = new Pool({
     connectionString: process.env.SAGA_DB_URL,
+    max: parseInt(process.env.SAGA_DB_POOL_SIZE || '10', 10),
 });
 
-sagaDbClient.connect()
-    .then(() => {
-        console.log('Connected to saga database');
-    })
-    .catch(err => {
-        console.error('Error connecting to saga database', err);
-    });
+sagaDb.on('error', (err) => {
+    console.error('Idle saga database connection failed', err);
+});
+
+const SAGA_STEP_TIMEOUT = parseInt(process.env.SAGA_STEP_TIMEOUT || '5000', 10);
+const SAGA_STEP_RETRIES = 3;
+const SAGA_STEP_RETRY_DELAY = parseInt(process.env.SAGA_STEP_RETRY_DELAY || '200', 10);
 
 async function createSagaTransaction(sagaId) {
     const query = 'INSERT INTO saga_transactions (saga_id, status) VALUES ($1, $2) RETURNING *';
     try {
-        const res = await sagaDbClient.query(query, [sagaId, 'Started']);
+        const res = await sagaDb.query(query, [sagaId, 'Started']);
         return res.rows[0];
     } catch (err) {
         console.error('Error creating saga transaction', err);
@@ -78,33 +79,85 @@ async function createSagaTransaction(sagaId) {
     }
 }
 
-async function updateSagaTransaction(sagaId, status) {
-    const query = 'UPDATE saga_transactions SET status = $1 WHERE saga_id = $2 RETURNING *';
+// Records what a step created, so the saga can be compensated even if the
+// gateway dies before it finishes (see saga_worker).
+async function recordSagaStep(sagaId, column, value) {
+    await sagaDb.query(
+        `UPDATE saga_transactions SET ${column} = $1, updated_at = CURRENT_TIMESTAMP WHERE saga_id = $2`,
+        [value, sagaId]
+    );
+}
+
+// Moves the saga from one of fromStatuses to status. Returns false if the
+// saga was no longer in any of them, e.g. the recovery worker took it over.
+async function updateSagaTransaction(sagaId, status, fromStatuses) {
+    const query = `UPDATE saga_transactions SET status = $1, updated_at = CURRENT_TIMESTAMP
+                   WHERE saga_id = $2 AND status = ANY($3) RETURNING *`;
     try {
-        const res = await sagaDbClient.query(query, [status, sagaId]);
+        const res = await sagaDb.query(query, [status, sagaId, fromStatuses]);
+        if (res.rowCount === 0) {
+            console.log(`Saga ${sagaId} is no longer in ${fromStatuses.join('/')}, not moving it to ${status}`);
+            return false;
+        }
         console.log(`Saga transaction updated: ${res.rows[0].status}`);
-        return res.rows[0];
+        return true;
     } catch (err) {
         console.error('Error updating saga transaction', err);
         throw err;
     }
 }
 
+// The services rate-limit per client, so they need the caller's address
+// rather than the gateway's. The gateway is the edge, so whatever the client
+// put in X-Forwarded-For is replaced rather than passed on.
+const forwardedFor = (req) => req.socket.remoteAddress;
+
+// Sends one saga step, retrying timeouts, network errors, 429 and 5xx with
+// the same Idempotency-Key, so a step that succeeded but whose response was
+// lost returns the original result instead of running twice. The step is
+// sent on behalf of the client, so it counts against the client's rate limit
+// rather than the gateway's. Retries back off exponentially, or as long as a
+// 429's Retry-After asks.
+async function sagaStep(url, data, idempotencyKey, clientAddress) {
+    for (let attempt = 1; ; attempt++) {
+        try {
+            return await axios.post(url, data, {
+                timeout: SAGA_STEP_TIMEOUT,
+                headers: { 'Idempotency-Key': idempotencyKey, 'X-Forwarded-For': clientAddress },
+            });
+        } catch (err) {
+            const status = err.response && err.response.status;
+            const retryable = !err.response || status === 429 || status >= 500;
+            if (!retryable || attempt >= SAGA_STEP_RETRIES) {
+                throw err;
+            }
+            const retryAfter = status === 429 ? (parseInt(err.response.headers['retry-after'], 10) || 0) * 1000 : 0;
+            const delay = Math.max(retryAfter, SAGA_STEP_RETRY_DELAY * 2 ** (attempt - 1));
+            console.log(`Saga step ${idempotencyKey} failed (${err.message}), retry ${attempt} in ${delay}ms`);
+            await new Promise(resolve => setTimeout(resolve, delay));
+        }
+    }
+}
+
 async function compensate(sagaId, userId, postId) {
     console.log(`Compensating for saga ${sagaId}...`);
     try {
-        if (userId) {
-            console.log(`Deleting user with ID ${userId}`);
-            await axios.delete(`${process.env.USER_SERVICE_URL}/api/users/${userId}`);
+        if (!await updateSagaTransaction(sagaId, 'Compensating', ['Started'])) {
+            return;
         }
-
         if (postId) {
             console.log(`Deleting post with ID ${postId}`);
-            await axios.delete(`${process.env.RECOMMENDATION_SERVICE_URL}/api/posts/${postId}`);
+            await axios.delete(`${process.env.RECOMMENDATION_SERVICE_URL}/api/posts/${postId}`, { timeout: SAGA_STEP_TIMEOUT });
+        }
+
+        if (userId) {
+            console.log(`Deleting user with ID ${userId}`);
+            await axios.delete(`${process.env.USER_SERVICE_URL}/api/users/${userId}`, { timeout: SAGA_STEP_TIMEOUT });
         }
 
-        await updateSagaTransaction(sagaId, 'Failed');
+        await updateSagaTransaction(sagaId, 'Failed', ['Compensating']);
     } catch (err) {
+        // The saga stays 'Compensating' and saga_worker finishes it.
         console.error('Error during compensation:', err);
     }
 }
@@ -116,15 +169,19 @@ app.post('/api/saga/create', async (req, res) => {
     let postId = null;
 
     try {
-        const saga = await createSagaTransaction(sagaId);
+        await createSagaTransaction(sagaId);
 
-        const userResponse = await axios.post(`${process.env.USER_SERVICE_URL}/api/users/register`, userData);
+        const userResponse = await sagaStep(`${process.env.USER_SERVICE_URL}/api/users/register`, userData, `${sagaId}:user`, forwardedFor(req));
         userId = userResponse.data.id;
+        await recordSagaStep(sagaId, 'user_id', userId);
 
-        const postResponse = await axios.post(`${process.env.RECOMMENDATION_SERVICE_URL}/api/posts/`, postData);
+        const postResponse = await sagaStep(`${process.env.RECOMMENDATION_SERVICE_URL}/api/posts/`, postData, `${sagaId}:post`, forwardedFor(req));
         postId = postResponse.data.id;
+        await recordSagaStep(sagaId, 'post_id', postId);
 
-        await updateSagaTransaction(sagaId, 'Completed');
+        if (!await updateSagaTransaction(sagaId, 'Completed', ['Started'])) {
+            throw new Error(`Saga ${sagaId} was taken over by recovery`);
+        }
 
         res.status(200).json({
             message: 'Saga completed successfully',
@@ -241,25 +298,48 @@ const registerGatewayWithConsul = async () => {
     }
 };
 
-const getActiveReplicas = async (serviceName) => {
+// Healthy replicas per service, kept current by a Consul blocking query per
+// service, so a lookup is a memory read rather than a Consul round trip.
+const CONSUL_WATCH_WAIT = 55;
+const replicaCache = {};
+const replicaWatches = {};
+
+const watchReplicas = async (serviceName, onFirstLoad) => {
     const CONSUL_HOST = process.env.CONSUL_HOST || 'consul';
     const CONSUL_PORT = process.env.CONSUL_PORT || 8500;
     const CONSUL_URL = `http://${CONSUL_HOST}:${CONSUL_PORT}/v1/health/service/${serviceName}`;
-    
-    try {
-        const response = await axios.get(CONSUL_URL);
-        const healthyReplicas = response.data
-            .filter(entry => entry.Checks.every(check => check.Status === 'passing'))
-            .map(entry => `http://${entry.Service.Address}:${entry.Service.Port}`);
+    let index = 0;
 
-        return healthyReplicas.slice(0, 3);
-    } catch (error) {
-        console.error(`Failed to fetch replicas for ${serviceName} from Consul:`, error.message);
-        return [];
+    while (true) {
+        try {
+            const response = await axios.get(CONSUL_URL, {
+                params: { passing: true, index, wait: `${CONSUL_WATCH_WAIT}s` },
+                timeout: (CONSUL_WATCH_WAIT + 10) * 1000,
+            });
+            replicaCache[serviceName] = response.data
+                .map(entry => `http://${entry.Service.Address || entry.Node.Address}:${entry.Service.Port}`);
+            const nextIndex = parseInt(response.headers['x-consul-index'] || '0', 10);
+            // Consul asks clients to start over if the index goes backwards.
+            index = nextIndex < index ? 0 : nextIndex;
+        } catch (error) {
+            console.error(`Failed to watch replicas for ${serviceName} in Consul:`, error.message);
+            index = 0;
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+        onFirstLoad();
     }
 };
 
-const sendRequestWithRetries = async (serviceName, endpoint, requestData) => {
+const getActiveReplicas = async (serviceName) => {
+    if (!replicaWatches[serviceName]) {
+        replicaCache[serviceName] = [];
+        replicaWatches[serviceName] = new Promise(resolve => watchReplicas(serviceName, resolve));
+    }
+    await replicaWatches[serviceName];
+    return replicaCache[serviceName].slice(0, 3);
+};
+
+const sendRequestWithRetries = async (serviceName, endpoint, requestData, headers = {}) => {
     const replicas = await getActiveReplicas(serviceName); 
     for (let replica of replicas) {
         let retries = 0;
@@ -267,7 +347,7 @@ const sendRequestWithRetries = async (serviceName, endpoint, requestData) => {
 
         while (retries < MAX_RETRIES) {
             try {
-                const response = await breaker.fire(() => axios.post(url, requestData));
+                const response = await breaker.fire(() => axios.post(url, requestData, { headers }));
                 return response.data;
             } catch (error) {
                 retries += 1;
@@ -344,7 +424,7 @@ app.use('/api/users', async (req, res) => {
     requestUrl = req.originalUrl;
 
     try {
-        const responseData = await sendRequestWithRetries('user-service', endpoint, requestData);
+        const responseData = await sendRequestWithRetries('user-service', endpoint, requestData, { 'X-Forwarded-For': forwardedFor(req) });
         res.json(responseData); 
     } catch (error) {
         console.error("Service unavailable after all retries.");
@@ -355,19 +435,34 @@ app.use('/api/users', async (req, res) => {
 app.use('/api/posts', proxy(recommendationServiceUrl, {
     proxyReqOptDecorator: (proxyReqOpts, srcReq) => {
         proxyReqOpts.followRedirects = false;
+        proxyReqOpts.headers['x-forwarded-for'] = forwardedFor(srcReq);
         return proxyReqOpts;
     },
     skipToNextHandlerFilter: (proxyRes) => {
         return proxyRes.statusCode === 307;
     },
     proxyReqPathResolver: function (req) {
-        if (req.method === 'GET' && req.url === '/') {
-            return '/api/posts';
+        // Keep the query string (cursor, limit, stream) as-is so pagination
+        // cursors reach the service unchanged.
+        const [path, query] = req.url.split('?');
+        const search = query !== undefined ? `?${query}` : '';
+        if (req.method === 'GET' && path === '/') {
+            return '/api/posts' + search;
         }
         return '/api/posts' + req.url;
     }
 }));
 
+app.use('/api/recommendations', proxy(recommendationServiceUrl, {
+    proxyReqOptDecorator: (proxyReqOpts, srcReq) => {
+        proxyReqOpts.headers['x-forwarded-for'] = forwardedFor(srcReq);
+        return proxyReqOpts;
+    },
+    proxyReqPathResolver: function (req) {
+        return '/api/recommendations' + req.url;
+    }
+}));
+
 app.use(
     '/ws/api/comments',
     createProxyMiddleware({
@@ -0,0 +1,66 @@
+# Measures how many comments per second the subscriber can fan out to a set of
+# simulated WebSocket connections. Messages are fed in as raw pub/sub batches,
+# so the numbers cover decoding, the internal queue, the broadcast and the
+# per-connection writer tasks.
+#
+# Run from recommendation_service/:
+#   python -m benchmarks.comment_fanout --sockets 1000 --messages 2000
+import argparse
+import asyncio
+import json
+import time
+
+from comment_subscriber import CommentSubscriber, COMMENTS_CHANNEL, GLOBAL_ROOM
+from websocket_manager import WebSocketManager
+
+
+class SimulatedSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.received += 1
+
+
+async def run(sockets: int, messages: int, batch_size: int):
+    # Room for every message, so nothing is dropped for being slow.
+    ws_manager = WebSocketManager(queue_size=messages)
+    clients = [SimulatedSocket() for _ in range(sockets)]
+    for client in clients:
+        await ws_manager.connect(client)
+        ws_manager.join(client, GLOBAL_ROOM)
+
+    subscriber = CommentSubscriber(ws_manager, queue_size=messages, batch_size=batch_size)
+    payload = json.dumps({"content": "Benchmark comment", "user_id": 1, "post_id": 1}).encode()
+    message = {"type": "message", "channel": COMMENTS_CHANNEL.encode(), "data": payload}
+
+    start = time.perf_counter()
+    subscriber.start()
+    for offset in range(0, messages, batch_size):
+        subscriber.enqueue_batch([message] * min(batch_size, messages - offset))
+        await asyncio.sleep(0)
+    while any(client.received < messages for client in clients):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    await subscriber.stop()
+    return elapsed, subscriber.dropped
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    elapsed, dropped = asyncio.run(run(args.sockets, args.messages, args.batch_size))
+    deliveries = args.sockets * args.messages
+    print(f"{args.messages} messages to {args.sockets} sockets in {elapsed:.2f}s: "
+          f"{args.messages / elapsed:.0f} messages/s, {deliveries / elapsed:.0f} deliveries/s, {dropped} dropped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Compares concurrent request throughput of the old sync-session path (a sync
+# Session used inside an async handler) with the AsyncSession path.
+#
+# Needs a reachable database (DATABASE_URL). Run from recommendation_service/:
+#   python -m benchmarks.db_sync_vs_async --requests 2000 --concurrency 50
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import text
+
+import crud, models
+from database import SessionLocal, AsyncSessionLocal, engine
+
+
+def build_app(query_delay: float):
+    app = FastAPI()
+
+    @app.get("/sync")
+    async def sync_path():
+        db = SessionLocal()
+        try:
+            if query_delay:
+                db.execute(text("SELECT pg_sleep(:s)"), {"s": query_delay})
+            return len(crud.get_posts(db, limit=50))
+        finally:
+            db.close()
+
+    @app.get("/async")
+    async def async_path():
+        async with AsyncSessionLocal() as db:
+            if query_delay:
+                await db.execute(text("SELECT pg_sleep(:s)"), {"s": query_delay})
+            return len(await crud.get_posts_async(db, limit=50))
+
+    return app
+
+
+async def run(app, path: str, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get(path)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--query-delay-ms", type=float, default=5.0,
+                        help="extra server-side latency per request (pg_sleep), 0 to disable")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    app = build_app(args.query_delay_ms / 1000)
+
+    async def compare():
+        for path in ("/sync", "/async"):
+            elapsed = await run(app, path, args.requests, args.concurrency)
+            print(f"{path:7} {args.requests} requests, concurrency {args.concurrency}: "
+                  f"{elapsed:.2f}s, {args.requests / elapsed:.0f} req/s")
+
+    asyncio.run(compare())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# Load test for the recommendation service: runs the app in this process (on
+# SQLite and fakeredis unless told otherwise) and drives one of these mixes
+# from --concurrency virtual users for --duration seconds:
+#   crud    - each user creates, reads, updates and deletes its own posts
+#   browse  - paging through posts, reading single posts and faceted search
+#             over --posts seeded posts (full-text queries on Postgres only)
+#   fanout  - each user is a WebSocket client posting comments to a post that
+#             --subscribers other clients listen to; a step lasts until every
+#             subscriber has the comment
+# Rate limiting is off unless RATE_LIMIT_ENABLED is set, since it would only
+# measure the 429s. WebSocket clients talk to the app over ASGI directly,
+# so fanout covers the endpoint, Redis pub/sub and the send queues but not
+# the WebSocket framing.
+#
+# Run from recommendation_service/:
+#   python -m benchmarks.load --scenario browse --concurrency 20 --duration 10 \
+#       --output results.json --baseline benchmarks/baselines/browse.json
+# With --postgres it starts a throwaway Postgres container (needs docker).
+# Exits with 1 if any metric regressed against the baseline by more than
+# --threshold.
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+
+from benchmarks import loadgen
+
+CAR_MODELS = [f"Model {i}" for i in range(20)]
+WORDS = ["engine", "turbo", "diesel", "hybrid", "electric", "mileage", "brakes", "gearbox", "leather", "reliable"]
+FANOUT_POST_ID = 1
+FANOUT_TIMEOUT = 10.0
+
+
+def new_post(rng, user_id: int):
+    return {
+        "title": f"{rng.choice(WORDS).title()} {rng.choice(CAR_MODELS)}",
+        "content": " ".join(rng.choice(WORDS) for _ in range(40)),
+        "car_model": rng.choice(CAR_MODELS),
+        "user_id": user_id,
+    }
+
+
+async def seed(count: int, rng):
+    import crud, schemas
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        for i in range(count):
+            await crud.create_post_async(db, schemas.PostCreate(**new_post(rng, i % 100)))
+    return list(range(1, count + 1))
+
+
+def crud_scenario(client, args, rng):
+    async def setup(index):
+        return {"user_id": index, "posts": []}
+
+    async def create(state):
+        response = await client.post("/api/posts/", json=new_post(rng, state["user_id"]))
+        response.raise_for_status()
+        state["posts"].append(response.json()["id"])
+
+    async def read(state):
+        if not state["posts"]:
+            return await create(state)
+        response = await client.get(f"/api/posts/{rng.choice(state['posts'])}")
+        response.raise_for_status()
+
+    async def update(state):
+        if not state["posts"]:
+            return await create(state)
+        response = await client.put(f"/api/posts/{rng.choice(state['posts'])}", json=new_post(rng, state["user_id"]))
+        response.raise_for_status()
+
+    async def delete(state):
+        if not state["posts"]:
+            return await create(state)
+        response = await client.delete(f"/api/posts/{state['posts'].pop(rng.randrange(len(state['posts'])))}")
+        response.raise_for_status()
+
+    return setup, [
+        loadgen.Step("create", 3, create), loadgen.Step("read", 4, read),
+        loadgen.Step("update", 2, update), loadgen.Step("delete", 1, delete),
+    ]
+
+
+def browse_scenario(client, args, rng):
+    full_text = args.postgres or (args.database_url or "").startswith("postgres")
+
+    async def setup(index):
+        return {}
+
+    async def list_page(state):
+        response = await client.get("/api/posts", params={"cursor": rng.randrange(args.posts), "limit": 20})
+        response.raise_for_status()
+
+    # Like a front page, most reads go to a few hot posts.
+    async def read(state):
+        post_id = rng.randrange(1, 51) if rng.random() < 0.8 else rng.randrange(1, args.posts + 1)
+        response = await client.get(f"/api/posts/{post_id}")
+        response.raise_for_status()
+
+    async def search(state):
+        params = {"car_model": rng.choice(CAR_MODELS)}
+        if full_text:
+            params["q"] = rng.choice(WORDS)
+        response = await client.get("/api/posts/search", params=params)
+        response.raise_for_status()
+
+    return setup, [loadgen.Step("list", 4, list_page), loadgen.Step("read", 5, read), loadgen.Step("search", 1, search)]
+
+
+# An in-process WebSocket client: runs the app's ASGI handler for one
+# connection and calls on_text for every frame the app sends.
+class AsgiWebSocket:
+    _ports = itertools.count(40000)
+
+    def __init__(self, app, path: str, query: str = "", on_text=None):
+        self.app = app
+        self.path = path
+        self.query = query
+        self.on_text = on_text
+        self.incoming = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.task = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": self.path, "raw_path": self.path.encode(), "root_path": "", "query_string": self.query.encode(),
+            "headers": [(b"host", b"bench")], "client": ("127.0.0.1", next(self._ports)), "server": ("bench", 80),
+            "subprotocols": [], "state": {},
+        }
+        await self.incoming.put({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(scope, self.incoming.get, self._send))
+        await self.accepted.wait()
+
+    async def _send(self, message):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif message["type"] == "websocket.send" and self.on_text is not None:
+            self.on_text(message.get("text") or message["bytes"].decode())
+        elif message["type"] == "websocket.close":
+            raise RuntimeError(f"WebSocket closed by the app with code {message.get('code')}")
+
+    async def send(self, text: str):
+        await self.incoming.put({"type": "websocket.receive", "text": text})
+
+    async def close(self):
+        await self.incoming.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.gather(self.task, return_exceptions=True)
+
+
+def fanout_scenario(app, args, rng):
+    # comment number -> [subscribers still waiting for it, event set when none are]
+    waiting = {}
+    numbers = itertools.count()
+    sockets = []
+
+    def on_text(text):
+        # A slow subscriber may get several comments coalesced into one frame.
+        for line in text.split("\n"):
+            entry = waiting.get(json.loads(line).get("number"))
+            if entry is not None:
+                entry[0] -= 1
+                if entry[0] == 0:
+                    entry[1].set()
+
+    async def setup(index):
+        if index == 0:
+            for _ in range(args.subscribers):
+                subscriber = AsgiWebSocket(app, "/ws/api/comments", f"post_id={FANOUT_POST_ID}", on_text)
+                await subscriber.connect()
+                sockets.append(subscriber)
+            # Let the subscription reach Redis before anyone posts.
+            await asyncio.sleep(0.5)
+        # Publishers listen to a room nobody posts to.
+        publisher = AsgiWebSocket(app, "/ws/api/comments", f"post_id=-{index + 1}")
+        await publisher.connect()
+        sockets.append(publisher)
+        return {"socket": publisher, "user_id": index}
+
+    async def comment(state):
+        number = next(numbers)
+        done = asyncio.Event()
+        waiting[number] = [args.subscribers, done]
+        try:
+            await state["socket"].send(json.dumps({
+                "post_id": FANOUT_POST_ID, "user_id": state["user_id"], "number": number,
+                "content": " ".join(rng.choice(WORDS) for _ in range(20)), "sent_at": time.time(),
+            }))
+            await asyncio.wait_for(done.wait(), FANOUT_TIMEOUT)
+        finally:
+            del waiting[number]
+
+    return setup, [loadgen.Step("comment", 1, comment)], sockets
+
+
+SCENARIOS = {"crud": crud_scenario, "browse": browse_scenario, "fanout": fanout_scenario}
+
+
+async def run(args):
+    import comment_subscriber
+    from alembic import command
+    from alembic.config import Config
+    from database import async_engine
+    from main import app, comment_subscriber as subscriber
+
+    command.upgrade(Config("alembic.ini"), "head")
+    if not args.redis_cluster:
+        import fakeredis
+        server = loadgen.use_fakeredis()
+        comment_subscriber.get_async_node_redis = lambda *_, **__: fakeredis.FakeAsyncRedis(server=server)
+
+    rng = random.Random(args.seed)
+    if args.scenario == "fanout":
+        subscriber.start()
+        setup, steps, sockets = fanout_scenario(app, args, rng)
+        try:
+            return await loadgen.drive(steps, setup, args.concurrency, args.duration, args.warmup, args.seed)
+        finally:
+            for socket in sockets:
+                await socket.close()
+            await subscriber.stop()
+            await async_engine.dispose()
+
+    if args.scenario == "browse":
+        await seed(args.posts, rng)
+    try:
+        async with loadgen.serve(app) as url:
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+                setup, steps = SCENARIOS[args.scenario](client, args, rng)
+                return await loadgen.drive(steps, setup, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    loadgen.add_arguments(parser, SCENARIOS)
+    parser.add_argument("--posts", type=int, default=1000, help="posts seeded for browse")
+    parser.add_argument("--subscribers", type=int, default=200, help="listening WebSocket clients for fanout")
+    args = parser.parse_args()
+
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    with loadgen.database(args, "postdb"):
+        results = asyncio.run(run(args))
+    sys.exit(loadgen.report(loadgen.describe("recommendation_service", args, results), args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Compares p50/p99 latency of post reads with the read-through cache on and
+# off. Reads go through post_cache directly, so the numbers cover the
+# database/Redis path and serialization but not HTTP.
+#
+# Needs a reachable database (DATABASE_URL) and the Redis cluster. Run from
+# recommendation_service/:
+#   python -m benchmarks.post_cache --reads 5000 --concurrency 50
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import crud, models, post_cache, schemas
+from database import AsyncSessionLocal, engine
+
+
+async def seed(count: int):
+    async with AsyncSessionLocal() as db:
+        existing = await crud.get_posts_async(db, limit=count)
+        for i in range(len(existing), count):
+            post = schemas.PostCreate(title=f"Post {i}", content="Benchmark post " * 20,
+                                      car_model=f"Model {i % 20}", user_id=i % 100)
+            await crud.create_post_async(db, post)
+        return [post.id for post in await crud.get_posts_async(db, limit=count)]
+
+
+async def measure(post_ids, reads: int, concurrency: int, hot_keys: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    # Most traffic goes to a few hot posts, like a front page.
+    hot = post_ids[:hot_keys]
+
+    async def one():
+        post_id = random.choice(hot) if random.random() < 0.8 else random.choice(post_ids)
+        async with semaphore:
+            start = time.perf_counter()
+            await post_cache.get_post(post_id)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(reads)))
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+async def compare(args):
+    post_ids = await seed(args.posts)
+    for enabled in (False, True):
+        post_cache.POST_CACHE_ENABLED = enabled
+        p50, p99 = await measure(post_ids, args.reads, args.concurrency, args.hot_keys)
+        print(f"cache {'on ' if enabled else 'off'}: p50 {p50 * 1000:.2f}ms  p99 {p99 * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--reads", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--hot-keys", type=int, default=20)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    asyncio.run(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Times /api/posts/search queries on a large synthetic dataset with the
+# indexes from migration 0001 and again with index scans disabled, so the
+# planner falls back to sequential scans. Prints the scan nodes each plan
+# used next to p50/p99 latency.
+#
+# Needs Postgres (DATABASE_URL) migrated to head. Seeding 1M posts takes a
+# few minutes the first time; later runs reuse them. Run from
+# recommendation_service/:
+#   python -m benchmarks.post_search --posts 1000000 --runs 20
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from sqlalchemy import text
+
+import crud
+from database import AsyncSessionLocal
+
+WORDS = [
+    "engine", "turbo", "diesel", "hybrid", "electric", "mileage", "brakes", "suspension", "gearbox", "clutch",
+    "tyres", "warranty", "rust", "interior", "leather", "sunroof", "navigation", "reliable", "noisy", "comfortable",
+    "sporty", "family", "economy", "towing", "winter", "highway", "city", "service", "recall", "upgrade",
+]
+
+SEED = text("""
+    INSERT INTO posts (title, content, car_model, user_id)
+    SELECT
+        'Post ' || i || ' ' || w[1 + (i * 7) % array_length(w, 1)],
+        array_to_string(ARRAY(
+            SELECT w[1 + floor(random() * array_length(w, 1))::int] FROM generate_series(1, 40 + i * 0)
+        ), ' '),
+        'Model ' || (i % 200),
+        i % 10000
+    FROM generate_series(:start, :stop) AS i, (SELECT CAST(:words AS text[]) AS w) AS words
+""")
+
+QUERIES = [
+    {"q": "turbo"},
+    {"q": "\"leather sunroof\""},
+    {"q": "hybrid -diesel", "car_models": ["Model 7"]},
+    {"car_models": ["Model 42"], "user_ids": [42, 242]},
+]
+
+SEQSCAN_ONLY = ["SET LOCAL enable_indexscan = off", "SET LOCAL enable_bitmapscan = off", "SET LOCAL enable_indexonlyscan = off"]
+
+
+async def seed(count: int, batch: int = 100000):
+    async with AsyncSessionLocal() as db:
+        existing = await db.scalar(text("SELECT count(*) FROM posts"))
+        for start in range(existing + 1, count + 1, batch):
+            await db.execute(SEED, {"start": start, "stop": min(start + batch - 1, count), "words": WORDS})
+            await db.commit()
+            print(f"seeded {min(start + batch - 1, count)} posts")
+        await db.execute(text("ANALYZE posts"))
+        await db.commit()
+
+
+def scan_nodes(plan):
+    nodes = [plan["Node Type"]] if "Scan" in plan["Node Type"] else []
+    for child in plan.get("Plans", []):
+        nodes += scan_nodes(child)
+    return nodes
+
+
+# The same WHERE clause crud.search_posts_async builds.
+async def plan_of(db, params):
+    conditions = ["true"]
+    if params.get("q"):
+        conditions.append(f"search_vector @@ websearch_to_tsquery('{crud.SEARCH_CONFIG}', :q)")
+    if params.get("car_models"):
+        conditions.append("car_model = ANY(:car_models)")
+    if params.get("user_ids"):
+        conditions.append("user_id = ANY(:user_ids)")
+    explain = text(f"EXPLAIN (FORMAT JSON) SELECT id FROM posts WHERE {' AND '.join(conditions)}")
+    plan = await db.scalar(explain, {"q": params.get("q"), "car_models": params.get("car_models"),
+                                     "user_ids": params.get("user_ids")})
+    return scan_nodes((plan if isinstance(plan, list) else json.loads(plan))[0]["Plan"])
+
+
+async def measure(params, runs: int, seqscan: bool):
+    latencies = []
+    async with AsyncSessionLocal() as db:
+        for statement in SEQSCAN_ONLY if seqscan else []:
+            await db.execute(text(statement))
+        nodes = await plan_of(db, params)
+        for _ in range(runs):
+            start = time.perf_counter()
+            await crud.search_posts_async(db, q=params.get("q"), car_models=params.get("car_models", ()),
+                                          user_ids=params.get("user_ids", ()))
+            latencies.append(time.perf_counter() - start)
+        await db.rollback()
+    latencies.sort()
+    return nodes, statistics.median(latencies), latencies[max(0, int(len(latencies) * 0.99) - 1)]
+
+
+async def compare(args):
+    await seed(args.posts)
+    for params in QUERIES:
+        print(params)
+        for seqscan in (False, True):
+            nodes, p50, p99 = await measure(params, args.runs, seqscan)
+            label = "seq scan" if seqscan else "indexed "
+            print(f"  {label}: p50 {p50 * 1000:.1f}ms  p99 {p99 * 1000:.1f}ms  plan {', '.join(sorted(set(nodes)))}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(compare(args))
+
+
+if __name__ == "__main__":
+    main()
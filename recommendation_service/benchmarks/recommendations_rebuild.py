@@ -0,0 +1,43 @@
+# Times the batch recommendation rebuild (recommendations.compute) on
+# synthetic interactions of growing size. Car model popularity follows a Zipf
+# distribution, like real forums where a few models get most posts. Only the
+# matrix work and top-K extraction are timed, not loading from Postgres or
+# writing to Redis.
+#
+# Run from recommendation_service/:
+#   python -m benchmarks.recommendations_rebuild --sizes 10000,100000,1000000
+import argparse
+import time
+
+import numpy as np
+
+import recommendations
+
+
+def synthetic(interactions: int, car_models: int, rng):
+    users = max(1, interactions // 10)
+    user_ids = rng.integers(0, users, interactions)
+    models = np.minimum(rng.zipf(1.3, interactions), car_models) - 1
+    labels = np.array([f"Model {i}" for i in range(car_models)], dtype=object)
+    weights = rng.choice([recommendations.REC_POST_WEIGHT, recommendations.REC_COMMENT_WEIGHT], interactions, p=[0.2, 0.8])
+    return user_ids, labels[models], weights
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[10000, 100000, 1000000])
+    parser.add_argument("--car-models", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=recommendations.REC_TOP_K)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        user_ids, car_models, weights = synthetic(size, args.car_models, rng)
+        start = time.perf_counter()
+        result = recommendations.compute(user_ids, car_models, weights, args.top_k)
+        elapsed = time.perf_counter() - start
+        print(f"{size:>9} interactions, {len(result['users']):>7} users, {len(result['car_models'])} models: {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
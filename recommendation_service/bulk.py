@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import json
+import sys
+from sqlalchemy import select
+import models, schemas
+from bulk_io import FORMATS, MEDIA_TYPES, copy_records, export_rows, file_chunks, import_rows, parser_for, require_bulk_token, write_to_stdout
+from database import async_engine
+
+# Bulk import and export of posts, on top of the shared parsing, validation
+# and COPY plumbing in bulk_io.
+POST_COLUMNS = ["title", "content", "car_model", "user_id"]
+POST_EXPORT_COLUMNS = ["id"] + POST_COLUMNS
+
+async def _write_posts(valid):
+    records = [tuple(getattr(post, column) for column in POST_COLUMNS) for _, post in valid]
+    async with async_engine.begin() as conn:
+        await copy_records(conn, models.Post.__table__, POST_COLUMNS, records)
+    return len(records), []
+
+async def import_posts(chunks, format: str = "ndjson"):
+    return await import_rows(parser_for(format)(chunks), schemas.PostCreate, _write_posts)
+
+def export_posts(format: str = "ndjson"):
+    query = select(*(getattr(models.Post, column) for column in POST_EXPORT_COLUMNS)).order_by(models.Post.id)
+    return export_rows(async_engine, query, POST_EXPORT_COLUMNS, format)
+
+# CLI: python -m bulk import posts.ndjson / python -m bulk export --format csv > posts.csv
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import or export posts.")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", nargs="?", default="-", help="file to import, - for stdin")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        asyncio.run(write_to_stdout(export_posts(args.format)))
+        return
+    report = asyncio.run(import_posts(file_chunks(args.path), args.format))
+    print(json.dumps(report, indent=2), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+from redis.exceptions import RedisError
+from redis_client import get_async_redis, get_async_node_redis
+
+COMMENTS_CHANNEL = "comments_channel"
+COMMENT_QUEUE_SIZE = int(os.environ.get("COMMENT_QUEUE_SIZE", "10000"))
+COMMENT_BATCH_SIZE = int(os.environ.get("COMMENT_BATCH_SIZE", "100"))
+# Sharded pub/sub (Redis 7+) keeps each room's messages on the shard that owns
+# its channel instead of broadcasting every message to every node.
+COMMENT_SHARDED_PUBSUB = os.environ.get("COMMENT_SHARDED_PUBSUB", "0") == "1"
+
+# Clients that don't pick a room get every comment, as before rooms existed.
+GLOBAL_ROOM = "all"
+
+def post_room(post_id):
+    return f"post:{post_id}"
+
+def car_model_room(car_model: str):
+    return f"car_model:{car_model}"
+
+def room_channel(room: str):
+    return COMMENTS_CHANNEL if room == GLOBAL_ROOM else f"comments:{room}"
+
+# Publishes a comment to the global channel and to each of its rooms. A client
+# in several of the rooms must still get the comment once, so room messages
+# start with a line listing all the rooms it went to; a replica delivers each
+# copy only to clients that aren't in a room earlier in that list. The global
+# channel carries the bare comment, as other consumers read it.
+async def publish_comment(message: str, rooms, sharded: bool = COMMENT_SHARDED_PUBSUB):
+    redis = get_async_redis()
+    rooms = list(dict.fromkeys(rooms))
+    room_message = f"{json.dumps(rooms)}\n{message}"
+    publishes = [redis.publish(COMMENTS_CHANNEL, message)]
+    for room in rooms:
+        channel = room_channel(room)
+        publishes.append(redis.spublish(channel, room_message) if sharded else redis.publish(channel, room_message))
+    await asyncio.gather(*publishes)
+
+class _Reader:
+    # One pub/sub connection and the channels subscribed on it. Classic
+    # pub/sub uses a single reader on any node (moving to the next node if the
+    # connection drops); sharded pub/sub needs one reader per shard node.
+    def __init__(self, subscriber, node=None):
+        self.subscriber = subscriber
+        self.node = node
+        self.node_index = 0
+        self.channels = set()
+        self.pubsub = None
+        self.changed = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    def _connect(self):
+        if self.node is None:
+            return get_async_node_redis(self.node_index).pubsub()
+        host, port = self.node
+        return get_async_node_redis(host=host, port=port).pubsub()
+
+    async def _send(self, subscribe: bool, channels):
+        if self.pubsub is None or not channels:
+            return
+        if self.subscriber.sharded:
+            await (self.pubsub.ssubscribe if subscribe else self.pubsub.sunsubscribe)(*channels)
+        else:
+            await (self.pubsub.subscribe if subscribe else self.pubsub.unsubscribe)(*channels)
+
+    async def add(self, channel: str):
+        self.channels.add(channel)
+        self.changed.set()
+        await self._send(True, [channel])
+
+    async def remove(self, channel: str):
+        self.channels.discard(channel)
+        await self._send(False, [channel])
+
+    async def _read_batch(self):
+        # Wait for one message, then take whatever else is already buffered.
+        batch = []
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+        while message is not None:
+            batch.append(message)
+            if len(batch) >= self.subscriber.batch_size:
+                break
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=0)
+        return batch
+
+    async def _run(self):
+        while True:
+            if not self.channels:
+                self.changed.clear()
+                await self.changed.wait()
+                continue
+            self.pubsub = self._connect()
+            try:
+                await self._send(True, list(self.channels))
+                while self.channels:
+                    self.subscriber.enqueue_batch(await self._read_batch())
+            except (RedisError, OSError) as e:
+                print(f"Comment subscriber lost Redis node {self.node or self.node_index}: {e}, reconnecting")
+                self.node_index += 1
+                await asyncio.sleep(1)
+            finally:
+                pubsub, self.pubsub = self.pubsub, None
+                await pubsub.reset()
+
+# Consumes the comment channels of the rooms that have local listeners, on the
+# app's own event loop, and hands the messages to the WebSocket manager.
+# Messages are read and decoded in batches into a bounded queue; when the
+# queue is full the oldest message is dropped so a slow fan-out can't grow
+# memory without limit.
+class CommentSubscriber:
+    def __init__(self, ws_manager, queue_size: int = COMMENT_QUEUE_SIZE, batch_size: int = COMMENT_BATCH_SIZE,
+                 sharded: bool = COMMENT_SHARDED_PUBSUB):
+        self.ws_manager = ws_manager
+        self.batch_size = batch_size
+        self.sharded = sharded
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._readers = {}
+        self._reader_by_channel = {}
+        self._room_by_channel = {}
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._fan_out())]
+
+    async def stop(self):
+        tasks = self._tasks + [reader.task for reader in self._readers.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._readers = {}
+        self._reader_by_channel = {}
+        self._room_by_channel = {}
+
+    async def _reader_for(self, channel: str):
+        if self.sharded:
+            cluster = get_async_redis()
+            await cluster.initialize()
+            node = cluster.get_node_from_key(channel)
+            key = (node.host, node.port)
+        else:
+            key = None
+        if key not in self._readers:
+            self._readers[key] = _Reader(self, key)
+        return self._readers[key]
+
+    async def subscribe(self, room: str):
+        channel = room_channel(room)
+        if channel in self._reader_by_channel:
+            return
+        self._room_by_channel[channel] = room
+        reader = await self._reader_for(channel)
+        self._reader_by_channel[channel] = reader
+        await reader.add(channel)
+
+    async def unsubscribe(self, room: str):
+        channel = room_channel(room)
+        self._room_by_channel.pop(channel, None)
+        reader = self._reader_by_channel.pop(channel, None)
+        if reader is not None:
+            await reader.remove(channel)
+
+    def enqueue_batch(self, messages):
+        for message in messages:
+            channel, data = message["channel"], message["data"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            if isinstance(data, bytes):
+                data = data.decode()
+            if channel == COMMENTS_CHANNEL:
+                room, skip_rooms = GLOBAL_ROOM, ()
+            else:
+                room = self._room_by_channel.get(channel)
+                if room is None:
+                    # Read before the room was unsubscribed.
+                    continue
+                header, _, data = data.partition("\n")
+                rooms = json.loads(header)
+                skip_rooms = [GLOBAL_ROOM] + (rooms[:rooms.index(room)] if room in rooms else [])
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait((room, data, skip_rooms))
+
+    async def _fan_out(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            for room, message, skip_rooms in batch:
+                try:
+                    self.ws_manager.broadcast(message, room=room, skip_rooms=skip_rooms)
+                except Exception as e:
+                    print(f"Failed to broadcast comment: {e}")
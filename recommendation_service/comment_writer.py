@@ -0,0 +1,162 @@
+import asyncio
+import os
+import time
+import uuid
+from prometheus_client import Histogram
+from redis.exceptions import ResponseError
+from sqlalchemy.exc import DBAPIError, OperationalError
+import crud, schemas
+from database import AsyncSessionLocal
+from redis_client import get_async_redis
+import post_cache
+import recommendations
+
+# Write-behind for WebSocket comments. The endpoint only appends a comment to
+# a Redis Stream; a writer task on every replica reads the stream through a
+# shared consumer group and flushes to Postgres in multi-row INSERTs once
+# COMMENT_FLUSH_SIZE comments are buffered or COMMENT_FLUSH_INTERVAL seconds
+# have passed. Entries are acked only after their batch is committed, and
+# entries left pending by a crashed replica are claimed by the others, so
+# delivery is at-least-once; the idempotency key makes repeats harmless.
+COMMENT_STREAM = "comments:stream"
+COMMENT_GROUP = "comment-writers"
+COMMENT_FLUSH_SIZE = int(os.environ.get("COMMENT_FLUSH_SIZE", "500"))
+COMMENT_FLUSH_INTERVAL = float(os.environ.get("COMMENT_FLUSH_INTERVAL", "0.5"))
+COMMENT_CLAIM_IDLE = int(os.environ.get("COMMENT_CLAIM_IDLE", "30"))
+COMMENT_RETRY_DELAY = float(os.environ.get("COMMENT_RETRY_DELAY", "1"))
+COMMENT_RETRY_MAX_DELAY = float(os.environ.get("COMMENT_RETRY_MAX_DELAY", "30"))
+
+flush_batch_size = Histogram(
+    "comment_flush_batch_size",
+    "Comments written per write-behind flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+flush_latency = Histogram("comment_flush_latency_seconds", "Time to write one batch of comments to Postgres")
+
+# Appends a comment to the stream and returns it with its idempotency key
+# filled in. Never touches the database.
+async def enqueue(comment: schemas.CommentCreate):
+    if comment.idempotency_key is None:
+        comment = comment.model_copy(update={"idempotency_key": str(uuid.uuid4())})
+    await get_async_redis().xadd(COMMENT_STREAM, {"comment": comment.model_dump_json()})
+    return comment
+
+# Whether the database refused the rows themselves (a missing post, a value
+# out of range, bad text) rather than failed to run the INSERT at all.
+def _rejected_rows(error: DBAPIError):
+    return not error.connection_invalidated and not isinstance(error, OperationalError)
+
+class CommentWriter:
+    def __init__(self, flush_size: int = COMMENT_FLUSH_SIZE, flush_interval: float = COMMENT_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.consumer = f"writer-{uuid.uuid4()}"
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _ensure_group(self, redis):
+        try:
+            await redis.xgroup_create(COMMENT_STREAM, COMMENT_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _claim_stale(self, redis):
+        _, entries, *_ = await redis.xautoclaim(
+            COMMENT_STREAM, COMMENT_GROUP, self.consumer,
+            min_idle_time=COMMENT_CLAIM_IDLE * 1000, count=self.flush_size,
+        )
+        return entries
+
+    async def _run(self):
+        delay = COMMENT_RETRY_DELAY
+        while True:
+            redis = get_async_redis()
+            try:
+                await self._ensure_group(redis)
+                buffer = await self._claim_stale(redis)
+                last_claim = first_buffered = time.monotonic()
+                while True:
+                    # A full buffer (claimed entries can fill it) is flushed
+                    # before anything more is read.
+                    if len(buffer) < self.flush_size:
+                        block_ms = max(1, int(self.flush_interval * 1000))
+                        response = await redis.xreadgroup(
+                            COMMENT_GROUP, self.consumer, {COMMENT_STREAM: ">"},
+                            count=self.flush_size - len(buffer), block=block_ms,
+                        )
+                        for _, entries in response or []:
+                            if entries and not buffer:
+                                first_buffered = time.monotonic()
+                            buffer.extend(entries)
+                    now = time.monotonic()
+                    if buffer and (len(buffer) >= self.flush_size or now - first_buffered >= self.flush_interval):
+                        await self.flush(redis, buffer)
+                        buffer = []
+                        delay = COMMENT_RETRY_DELAY
+                    if now - last_claim >= COMMENT_CLAIM_IDLE:
+                        buffer.extend(await self._claim_stale(redis))
+                        last_claim = first_buffered = now
+            except Exception as e:
+                # Redis or the database is down, or the flush failed part way.
+                # Unacked entries stay pending and get claimed again.
+                print(f"Comment writer failed: {e!r}, retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, COMMENT_RETRY_MAX_DELAY)
+
+    async def flush(self, redis, entries):
+        ids = [entry_id for entry_id, _ in entries]
+        comments = []
+        for _, fields in entries:
+            try:
+                comments.append(schemas.CommentCreate.model_validate_json(fields["comment"]))
+            except ValueError as e:
+                print(f"Skipping malformed comment in stream: {e}")
+
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            try:
+                inserted = set(await crud.create_comments_async(db, comments))
+            except DBAPIError as e:
+                # Usually a comment on a post that no longer exists. Write the
+                # rest one by one so a single bad row doesn't stall the stream;
+                # rows the database won't take are dropped and acked with the
+                # rest. Connection failures leave the whole batch pending.
+                if not _rejected_rows(e):
+                    raise
+                await db.rollback()
+                inserted = set()
+                for comment in comments:
+                    try:
+                        inserted.update(await crud.create_comments_async(db, [comment]))
+                    except DBAPIError as e:
+                        if not _rejected_rows(e):
+                            raise
+                        await db.rollback()
+                        print(f"Dropping comment {comment.idempotency_key}: {e.orig}")
+            # Only count each stored comment once, however often it was delivered.
+            new_comments = list({
+                comment.idempotency_key: comment for comment in comments if comment.idempotency_key in inserted
+            }.values())
+            car_models = await crud.get_car_models_async(db, {comment.post_id for comment in new_comments})
+        flush_latency.observe(time.perf_counter() - started)
+        flush_batch_size.observe(len(comments))
+
+        async with redis.pipeline() as pipe:
+            pipe.xack(COMMENT_STREAM, COMMENT_GROUP, *ids)
+            pipe.xdel(COMMENT_STREAM, *ids)
+            await pipe.execute()
+
+        await post_cache.invalidate_posts({comment.post_id for comment in comments})
+        await recommendations.record_interactions(
+            (comment.user_id, car_models.get(comment.post_id), recommendations.REC_COMMENT_WEIGHT)
+            for comment in new_comments
+        )
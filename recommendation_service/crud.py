@@ -1,23 +1,204 @@
 import asyncio
-from sqlalchemy.orm import Session
+from collections import defaultdict
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased, joinedload, noload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 import models, schemas
+import idempotency
 
-def get_post(db: Session, post_id: int):
-    return db.query(models.Post).filter(models.Post.id == post_id).first()
+# Comments are always loaded explicitly so serializing a post never falls back
+# to one lazy SELECT per post. comments_limit picks what gets loaded:
+#   None - every comment (selectinload for lists, joinedload for one post)
+#   0    - no comments
+#   K    - only the latest K comments of each post
 
-def get_posts(db: Session):
-    return db.query(models.Post).all()
+def _comment_options(query, comments_limit, single=False):
+    if comments_limit is None:
+        return query.options(joinedload(models.Post.comments) if single else selectinload(models.Post.comments))
+    return query.options(noload(models.Post.comments))
 
-async def create_post_async(db: Session, post: schemas.PostCreate):
+def _latest_comments_query(posts, comments_limit):
+    rank = func.row_number().over(partition_by=models.Comment.post_id, order_by=models.Comment.id.desc())
+    ranked = (
+        select(models.Comment, rank.label("rank"))
+        .where(models.Comment.post_id.in_([post.id for post in posts]))
+        .subquery()
+    )
+    comment = aliased(models.Comment, ranked)
+    return select(comment).where(ranked.c.rank <= comments_limit).order_by(comment.post_id, comment.id)
+
+def _attach_comments(posts, comments):
+    by_post = defaultdict(list)
+    for comment in comments:
+        by_post[comment.post_id].append(comment)
+    for post in posts:
+        set_committed_value(post, "comments", by_post[post.id])
+
+def _needs_latest_comments(posts, comments_limit):
+    return comments_limit is not None and comments_limit > 0 and len(posts) > 0
+
+def _posts_query(cursor, comments_limit):
+    query = _comment_options(select(models.Post), comments_limit)
+    if cursor is not None:
+        query = query.where(models.Post.id > cursor)
+    return query.order_by(models.Post.id)
+
+def get_post(db: Session, post_id: int, comments_limit: int = None):
+    query = _comment_options(select(models.Post), comments_limit, single=True).where(models.Post.id == post_id)
+    post = db.scalars(query).unique().first()
+    if post is not None and _needs_latest_comments([post], comments_limit):
+        _attach_comments([post], db.scalars(_latest_comments_query([post], comments_limit)))
+    return post
+
+def get_posts(db: Session, cursor: int = None, limit: int = 50, comments_limit: int = None):
+    posts = db.scalars(_posts_query(cursor, comments_limit).limit(limit)).all()
+    if _needs_latest_comments(posts, comments_limit):
+        _attach_comments(posts, db.scalars(_latest_comments_query(posts, comments_limit)))
+    return posts
+
+def stream_posts(db: Session, cursor: int = None, batch_size: int = 1000, comments_limit: int = None):
+    # yield_per opens a server-side cursor so rows arrive in batches instead of
+    # being buffered client-side all at once.
+    query = _posts_query(cursor, comments_limit).execution_options(yield_per=batch_size)
+    for batch in db.scalars(query).partitions():
+        if _needs_latest_comments(batch, comments_limit):
+            _attach_comments(batch, db.scalars(_latest_comments_query(batch, comments_limit)))
+        yield from batch
+
+def create_post(db: Session, post: schemas.PostCreate):
     db_post = models.Post(**post.dict())
     db.add(db_post)
     db.commit()
     db.refresh(db_post)
-    #await asyncio.sleep(10)
     return db_post
 
 def delete_post(db: Session, post_id: int):
     post = db.query(models.Post).filter(models.Post.id == post_id).first()
     if post:
         db.delete(post)
-        db.commit()
\ No newline at end of file
+        db.commit()
+
+# Async versions of the above, for handlers running on the event loop.
+
+async def get_post_async(db: AsyncSession, post_id: int, comments_limit: int = None):
+    query = _comment_options(select(models.Post), comments_limit, single=True).where(models.Post.id == post_id)
+    post = (await db.scalars(query)).unique().first()
+    if post is not None and _needs_latest_comments([post], comments_limit):
+        _attach_comments([post], await db.scalars(_latest_comments_query([post], comments_limit)))
+    return post
+
+async def get_posts_async(db: AsyncSession, cursor: int = None, limit: int = 50, comments_limit: int = None):
+    posts = (await db.scalars(_posts_query(cursor, comments_limit).limit(limit))).all()
+    if _needs_latest_comments(posts, comments_limit):
+        _attach_comments(posts, await db.scalars(_latest_comments_query(posts, comments_limit)))
+    return posts
+
+async def stream_posts_async(db: AsyncSession, cursor: int = None, batch_size: int = 1000, comments_limit: int = None):
+    query = _posts_query(cursor, comments_limit).execution_options(yield_per=batch_size)
+    result = await db.stream_scalars(query)
+    async for batch in result.partitions():
+        if _needs_latest_comments(batch, comments_limit):
+            _attach_comments(batch, await db.scalars(_latest_comments_query(batch, comments_limit)))
+        for post in batch:
+            yield post
+
+# With commit=False the post is only flushed, so the caller can add more to
+# the same transaction.
+async def create_post_async(db: AsyncSession, post: schemas.PostCreate, commit: bool = True):
+    db_post = models.Post(**post.dict(), comments=[])
+    db.add(db_post)
+    if not commit:
+        await db.flush()
+        return db_post
+    await db.commit()
+    #await asyncio.sleep(10)
+    return db_post
+
+# Creates the post and stores its response under idempotency_key in one
+# transaction. Returns the response as a dict.
+async def create_post_once_async(db: AsyncSession, post: schemas.PostCreate, idempotency_key: str, request_hash: str):
+    db_post = await create_post_async(db, post, commit=False)
+    response = schemas.Post.model_validate(db_post).model_dump()
+    return await idempotency.remember(db, idempotency_key, request_hash, response)
+
+# Inserts the comments in one multi-row INSERT, skipping any whose
+# idempotency key is already stored. Returns the keys of the new rows.
+async def create_comments_async(db: AsyncSession, comments):
+    if not comments:
+        return []
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    statement = (
+        dialect.insert(models.Comment)
+        .values([
+            {
+                "post_id": comment.post_id,
+                "comment_text": comment.content,
+                "user_id": comment.user_id,
+                "idempotency_key": comment.idempotency_key,
+            }
+            for comment in comments
+        ])
+        .on_conflict_do_nothing(index_elements=["idempotency_key"])
+        .returning(models.Comment.idempotency_key)
+    )
+    inserted = (await db.scalars(statement)).all()
+    await db.commit()
+    return inserted
+
+async def get_car_models_async(db: AsyncSession, post_ids):
+    query = select(models.Post.id, models.Post.car_model).where(models.Post.id.in_(post_ids))
+    return dict((await db.execute(query)).all())
+
+# Full-text search over title and content, with facet filters and counts on
+# car_model and user_id. Facet counts use every filter except the facet's
+# own, so selecting one car model still shows how many hits the others have.
+SEARCH_CONFIG = "english"
+FACETS = ("car_model", "user_id")
+search_vector = literal_column("posts.search_vector", type_=TSVECTOR)
+
+def _search_conditions(tsquery, filters, skip=None):
+    conditions = [] if tsquery is None else [search_vector.op("@@")(tsquery)]
+    for facet, values in filters.items():
+        if values and facet != skip:
+            conditions.append(getattr(models.Post, facet).in_(values))
+    return conditions
+
+async def _facet_counts(db: AsyncSession, facet: str, conditions, limit: int):
+    column = getattr(models.Post, facet)
+    count = func.count().label("count")
+    query = select(column, count).where(*conditions).group_by(column).order_by(count.desc(), column).limit(limit)
+    return [{"value": value, "count": n} for value, n in await db.execute(query)]
+
+async def search_posts_async(db: AsyncSession, q: str = None, car_models=(), user_ids=(),
+                             limit: int = 20, offset: int = 0, facet_limit: int = 20):
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q) if q else None
+    filters = {"car_model": list(car_models), "user_id": list(user_ids)}
+    conditions = _search_conditions(tsquery, filters)
+
+    # The total rides along on every row instead of costing its own query.
+    query = select(models.Post, func.count().over().label("total")).where(*conditions).options(noload(models.Post.comments))
+    if tsquery is None:
+        query = query.order_by(models.Post.id.desc())
+    else:
+        query = query.order_by(func.ts_rank_cd(search_vector, tsquery).desc(), models.Post.id)
+    rows = (await db.execute(query.limit(limit).offset(offset))).all()
+    if rows:
+        total = rows[0].total
+    elif offset:
+        total = await db.scalar(select(func.count()).select_from(models.Post).where(*conditions))
+    else:
+        total = 0
+
+    facets = {}
+    for facet in FACETS:
+        facets[facet] = await _facet_counts(db, facet, _search_conditions(tsquery, filters, skip=facet), facet_limit)
+    return {"total": total, "posts": [row[0] for row in rows], "facets": facets}
+
+async def delete_post_async(db: AsyncSession, post_id: int):
+    post = await db.get(models.Post, post_id)
+    if post:
+        await db.delete(post)
+        await db.commit()
@@ -0,0 +1,19 @@
+#!/bin/sh
+set -e
+
+# The schema comes from the migrations; replicas starting together wait on
+# an advisory lock (see migrations/env.py).
+alembic upgrade head
+
+# One worker per CPU unless WEB_CONCURRENCY says otherwise. With more than
+# one, the workers share their Prometheus metrics through a directory.
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-$(nproc)}"
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+fi
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+echo "Starting recommendation service with $WEB_CONCURRENCY worker(s)..."
+exec uvicorn main:app --host 0.0.0.0 --port 8001 --workers "$WEB_CONCURRENCY"
@@ -0,0 +1,14 @@
+from database import async_engine, engine
+from health_check import HealthCheck, Probe, database_check, redis_check
+from instrumentation import lag_monitor
+from redis_client import get_async_redis
+from user_client import user_client
+
+# This service's readiness probes; the checking itself is in health_check.py.
+
+checker = HealthCheck(
+    # Posts are served without authors while the user service is down.
+    [Probe("postgres", database_check(async_engine)), Probe("redis", redis_check(get_async_redis)), Probe("user_service_grpc", user_client.ping, critical=False)],
+    {"db": engine.pool, "db_async": async_engine.pool},
+    lag_monitor,
+)
@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+import models
+from database import AsyncSessionLocal
+
+# Requests sent with an Idempotency-Key header are answered once: the
+# response is stored in the same transaction as the write it describes, and
+# a retry with the same key and body gets that response back without writing
+# again. Reusing a key for a different body is an error. Keys are kept for
+# IDEMPOTENCY_TTL seconds and then purged.
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_PURGE_INTERVAL = int(os.environ.get("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def fingerprint(operation: str, payload: dict):
+    body = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(f"{operation}\n{body}".encode()).hexdigest()
+
+# Returns the stored response for key, or None if the key is new or expired.
+async def lookup(db, key: str, request_hash: str):
+    record = await db.get(models.IdempotencyKey, key)
+    if record is None:
+        return None
+    if record.expires_at <= datetime.utcnow():
+        await db.delete(record)
+        await db.flush()
+        return None
+    if record.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return json.loads(record.response)
+
+# Stores the response next to the pending write and commits both. If another
+# request with the same key committed first, returns its response instead.
+async def remember(db, key: str, request_hash: str, response: dict):
+    db.add(models.IdempotencyKey(
+        key=key,
+        request_hash=request_hash,
+        response=json.dumps(response),
+        expires_at=datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL),
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        replay = await lookup(db, key, request_hash)
+        if replay is None:
+            raise
+        return replay
+    return response
+
+async def purge_expired():
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= datetime.utcnow()))
+        await db.commit()
+        return result.rowcount
+
+async def purge_loop():
+    while True:
+        try:
+            purged = await purge_expired()
+            if purged:
+                print(f"Purged {purged} expired idempotency keys")
+        except Exception as e:
+            print(f"Idempotency key purge failed: {e}")
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
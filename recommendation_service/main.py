@@ -1,147 +1,341 @@
-from fastapi import FastAPI, WebSocket, Depends, HTTPException, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, FastAPI, WebSocket, Depends, Header, HTTPException, WebSocketDisconnect, Query, Request, Response, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import models, schemas, crud
-from database import SessionLocal, engine
-from websocket_manager import WebSocketManager
+from database import AsyncSessionLocal
+from websocket_manager import ws_manager
 import schemas
 import json
 import asyncio
-import threading
-import redis
-import consul
 import os
-import uuid
+from contextlib import asynccontextmanager
 from prometheus_fastapi_instrumentator import Instrumentator
-from rediscluster import RedisCluster
+from comment_subscriber import CommentSubscriber, GLOBAL_ROOM, car_model_room, post_room, publish_comment
+import post_cache
+import recommendations
+import bulk
+import etag
+import idempotency
+from redis.exceptions import RedisError
+import comment_writer
+import rate_limit
+import workers
+import grpc
+from user_client import user_client
+from http_client import http_client
+from discovery import CONSUL_WATCH, Discovery
+import health
+import instrumentation
+from pydantic import ValidationError
 
 INSTANCE_ID = os.environ.get('INSTANCE_ID', '1')
+POSTS_PAGE_SIZE = int(os.environ.get('POSTS_PAGE_SIZE', '50'))
+POSTS_MAX_PAGE_SIZE = int(os.environ.get('POSTS_MAX_PAGE_SIZE', '500'))
+POSTS_STREAM_BATCH_SIZE = int(os.environ.get('POSTS_STREAM_BATCH_SIZE', '1000'))
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+SEARCH_FACET_LIMIT = int(os.environ.get('SEARCH_FACET_LIMIT', '20'))
 
-startup_nodes = [
-    {"host": "redis-node-1", "port": "6379"},
-    {"host": "redis-node-2", "port": "6379"},
-    {"host": "redis-node-3", "port": "6379"},
-    {"host": "redis-node-4", "port": "6379"},
-    {"host": "redis-node-5", "port": "6379"},
-    {"host": "redis-node-6", "port": "6379"}
-]
+comment_subscriber = CommentSubscriber(ws_manager)
+writer = comment_writer.CommentWriter()
 
-redis_client = RedisCluster(startup_nodes=startup_nodes, decode_responses=True)
+discovery = Discovery("recommendation-service", 8001, tags=["posts"], watch=CONSUL_WATCH)
 
-def redis_comment_listener():
-    pubsub = redis_client.pubsub()
-    pubsub.subscribe("comments_channel")
+# Everything else runs in every worker; see workers.py. Each worker has its
+# own WebSocket clients and subscriptions, and its own consumer in the
+# comment writer's group.
+leader = workers.Leader("recommendation-service")
+leader.run(discovery.register_until_done)
+leader.run(idempotency.purge_loop)
 
-    for message in pubsub.listen():
-        if message and message['type'] == 'message':
-            print(f"New message from Redis: {message['data']}")
-            asyncio.run(ws_manager.broadcast(message['data']))
+# Importing this module connects to nothing: every client is built on first
+# use or here, when the app starts. The schema comes from `alembic upgrade
+# head`, run before the app (see entrypoint.sh).
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    comment_subscriber.start()
+    writer.start()
+    await http_client.start()
+    instrumentation.start()
+    discovery.start()
+    leader.start()
+    yield
+    # Leave Consul first so no new traffic is routed here.
+    await leader.stop()
+    await discovery.stop()
+    await comment_subscriber.stop()
+    await writer.stop()
+    await user_client.close()
+    await instrumentation.stop()
+    await http_client.close()
 
-listener_thread = threading.Thread(target=redis_comment_listener)
-listener_thread.daemon = True
-listener_thread.start()
+router = APIRouter()
 
-app = FastAPI()
-
-models.Base.metadata.create_all(bind=engine)
-
-ws_manager = WebSocketManager()
-
-semaphore = asyncio.Semaphore(10)
-
-instrumentator = Instrumentator()
-instrumentator.instrument(app).expose(app)
-
-def register_with_consul():
-    c = consul.Consul(host='consul', port=8500)
-    for _ in range(1, 4):
-        instance_uuid = f"recommendation-service-{uuid.uuid4()}"
-        instance_address = f"recommendation-service"
-
-    c.agent.service.register(
-        name='recommendation-service',
-        service_id=instance_uuid,
-        address=instance_address,
-        port=8001,
-        tags=["posts"]
-    )
-    print(f"Registered recommendation-service with Consul as {instance_uuid}")
-
-@app.on_event("startup")
-async def startup_event():
-    register_with_consul()
-
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-@app.post("/api/posts/", response_model=schemas.Post)
-async def create_post(post: schemas.PostCreate, db: Session = Depends(get_db)):
+# With an Idempotency-Key header, a retried request returns the post the
+# first attempt created instead of creating another.
+@router.post("/api/posts/", response_model=schemas.Post)
+async def create_post(
+    post: schemas.PostCreate,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=idempotency.IDEMPOTENCY_KEY_MAX_LENGTH),
+):
+    if idempotency_key is not None:
+        request_hash = idempotency.fingerprint("create_post", post.model_dump())
+        replay = await idempotency.lookup(db, idempotency_key, request_hash)
+        if replay is not None:
+            return replay
+        create = crud.create_post_once_async(db, post, idempotency_key, request_hash)
+    else:
+        create = crud.create_post_async(db, post)
     try:
-        result = await asyncio.wait_for(crud.create_post_async(db, post), timeout=3)
+        result = await asyncio.wait_for(create, timeout=3)
+        await post_cache.invalidate_lists()
+        background_tasks.add_task(
+            recommendations.record_interactions, [(post.user_id, post.car_model, recommendations.REC_POST_WEIGHT)]
+        )
         return result
     except asyncio.TimeoutError:
         raise HTTPException(status_code=408, detail="Task Timeout: The request took too long to process.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except SQLAlchemyError as e:
+        print(f"Post creation failed: {e}")
+        raise HTTPException(status_code=500, detail="The post could not be saved")
+
+async def stream_posts_ndjson(cursor: Optional[int], comments_limit: Optional[int]):
+    async with AsyncSessionLocal() as db:
+        posts = crud.stream_posts_async(db, cursor=cursor, batch_size=POSTS_STREAM_BATCH_SIZE, comments_limit=comments_limit)
+        async for post in posts:
+            yield schemas.Post.model_validate(post).model_dump_json() + "\n"
 
-# Retrieve all posts.
-@app.get("/api/posts")
-async def get_posts(db: Session = Depends(get_db)):
-    posts = db.query(models.Post).all()
+# Adds an "author" ({"id", "name"}, or null for an unknown user) to each post,
+# with one batched gRPC lookup for all of them. If the user service can't be
+# reached the posts are returned without authors.
+async def attach_authors(posts: list):
+    try:
+        authors = await user_client.get_users({post["user_id"] for post in posts})
+    except grpc.RpcError as e:
+        print(f"Author lookup failed: {e}")
+        return posts
+    for post in posts:
+        author = authors.get(post["user_id"])
+        post["author"] = {"id": author.id, "name": author.name} if author else None
     return posts
 
+# Retrieve posts page by page, ordered by ID. Pass the X-Next-Cursor header of a
+# response back as ?cursor= to get the next page, or use ?stream=true to get
+# every post after the cursor as NDJSON. ?comments_limit=K keeps only the latest
+# K comments of each post (0 skips comments). ?include_authors=true adds each
+# post's author from the user service.
+@router.get("/api/posts", response_model=List[schemas.Post])
+async def get_posts(
+    cursor: Optional[int] = None,
+    limit: int = Query(POSTS_PAGE_SIZE, ge=1, le=POSTS_MAX_PAGE_SIZE),
+    stream: bool = False,
+    comments_limit: Optional[int] = Query(None, ge=0),
+    include_authors: bool = False,
+):
+    if stream:
+        return StreamingResponse(stream_posts_ndjson(cursor, comments_limit), media_type="application/x-ndjson")
+
+    # The cache hands back the page already serialized.
+    page = await post_cache.get_posts(cursor, limit, comments_limit)
+    headers = {"X-Next-Cursor": page["next_cursor"]} if page["next_cursor"] else None
+    content = page["posts"]
+    if include_authors:
+        content = json.dumps(await attach_authors(json.loads(content)))
+    return Response(content=content, media_type="application/json", headers=headers)
+
+# Bulk import: the body is NDJSON (one post per line) or CSV with a header
+# row. Rows that fail validation are reported by line number and skipped.
+@router.post("/api/posts/bulk", dependencies=[Depends(bulk.require_bulk_token)])
+async def import_posts(request: Request, format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    report = await bulk.import_posts(request.stream(), format)
+    if report["imported"]:
+        await post_cache.invalidate_lists()
+    return report
+
+# Bulk export of every post, without comments, ordered by ID.
+@router.get("/api/posts/bulk", dependencies=[Depends(bulk.require_bulk_token)])
+async def export_posts(format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    return StreamingResponse(bulk.export_posts(format), media_type=bulk.MEDIA_TYPES[format])
+
+# Ranked full-text search over post titles and content. ?q= takes web-search
+# syntax ("quoted phrases", -excluded, or); car_model and user_id filter the
+# hits and come back as facets with per-value counts. Without q, matching
+# posts are listed newest first.
+@router.get("/api/posts/search", response_model=schemas.PostSearchResult)
+async def search_posts(
+    q: Optional[str] = None,
+    car_model: List[str] = Query([]),
+    user_id: List[int] = Query([]),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=POSTS_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    return await crud.search_posts_async(
+        db, q=q, car_models=car_model, user_ids=user_id, limit=limit, offset=offset, facet_limit=SEARCH_FACET_LIMIT,
+    )
+
 # Retrieve a specific post by ID.
-@app.get("/api/posts/{post_id}", response_model=schemas.Post)
-def get_post(post_id: int, db: Session = Depends(get_db)):
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
-    if post is None:
+@router.get("/api/posts/{post_id}", response_model=schemas.Post)
+async def get_post(post_id: int, comments_limit: Optional[int] = Query(None, ge=0), include_author: bool = False,
+                   if_none_match: Optional[str] = Header(None)):
+    payload = await post_cache.get_post(post_id, comments_limit)
+    if payload is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    return post
+    if include_author:
+        payload = json.dumps((await attach_authors([json.loads(payload)]))[0])
+    # The payload comes serialized from the cache, so the tag is a hash of it.
+    tag = etag.for_content(payload)
+    if etag.matches(if_none_match, tag):
+        return etag.not_modified(tag)
+    return Response(content=payload, media_type="application/json", headers={"ETag": tag})
 
 # Update a specific post by ID.
-@app.put("/api/posts/{post_id}", response_model=dict)
-def update_post(post_id: int, updated_post: schemas.PostCreate, db: Session = Depends(get_db)):
-    post = crud.get_post(db, post_id=post_id)
+@router.put("/api/posts/{post_id}", response_model=dict)
+async def update_post(post_id: int, updated_post: schemas.PostCreate, db: AsyncSession = Depends(get_db)):
+    post = await crud.get_post_async(db, post_id=post_id)
     if post is None:
         raise HTTPException(status_code=404, detail="Post not found")
     
     post.title = updated_post.title
     post.content = updated_post.content
     post.car_model = updated_post.car_model
-    db.commit()
-    db.refresh(post)
+    await db.commit()
+    await post_cache.invalidate_post(post_id)
     
     return {"message": "Post updated successfully"}
 
 # Delete a specific post by ID.
-@app.delete("/api/posts/{post_id}", response_model=dict)
-def delete_post(post_id: int, db: Session = Depends(get_db)):
-    post = crud.get_post(db, post_id=post_id)
+@router.delete("/api/posts/{post_id}", response_model=dict)
+async def delete_post(post_id: int, db: AsyncSession = Depends(get_db)):
+    post = await crud.get_post_async(db, post_id=post_id)
     if post is None:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    crud.delete_post(db, post_id=post_id)
+    await crud.delete_post_async(db, post_id=post_id)
+    await post_cache.invalidate_post(post_id)
     
     return {"message": "Post deleted successfully"}
 
-@app.websocket("/ws/api/comments")
+# Car models recommended for the user, best first. Users with no posts or
+# comments yet get the most popular models.
+@router.get("/api/recommendations/{user_id}")
+async def get_recommendations(user_id: int):
+    try:
+        payload = await recommendations.for_user(user_id)
+    except RedisError as e:
+        print(f"Recommendation read failed: {e}")
+        raise HTTPException(status_code=503, detail="Recommendations are unavailable")
+    return Response(content=payload, media_type="application/json")
+
+# Car models most often discussed by the same people as this one.
+@router.get("/api/recommendations/car-models/{car_model}")
+async def get_similar_car_models(car_model: str):
+    try:
+        payload = await recommendations.similar_models(car_model)
+    except RedisError as e:
+        print(f"Recommendation read failed: {e}")
+        raise HTTPException(status_code=503, detail="Recommendations are unavailable")
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Car model not found")
+    return Response(content=payload, media_type="application/json")
+
+def comment_rooms(post_ids, car_models):
+    return [post_room(post_id) for post_id in post_ids] + [car_model_room(car_model) for car_model in car_models]
+
+def as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+async def join_room(websocket: WebSocket, room: str):
+    if ws_manager.join(websocket, room):
+        await comment_subscriber.subscribe(room)
+
+async def leave_room(websocket: WebSocket, room: str):
+    if ws_manager.leave(websocket, room):
+        await comment_subscriber.unsubscribe(room)
+
+# Queues the comment for the write-behind and stamps its idempotency key on
+# the message, so clients can tell a comment from its redelivery. Messages
+# that aren't valid comments are still broadcast but not stored.
+async def persist_comment(comment_data: dict):
+    try:
+        comment = schemas.CommentCreate.model_validate(comment_data)
+    except ValidationError:
+        return
+    comment = await comment_writer.enqueue(comment)
+    comment_data["idempotency_key"] = comment.idempotency_key
+
+# Clients pick rooms with ?post_id=...&car_model=... (both repeatable) or by
+# sending {"action": "subscribe" | "unsubscribe", "post_id": ..., "car_model": ...}.
+# A client without rooms gets every comment. Comments are published to the
+# room of their post_id and, if given, of their car_model; every replica,
+# this one included, delivers them to its local listeners through Redis.
+@router.websocket("/ws/api/comments")
 async def websocket_endpoint(websocket: WebSocket):
     await ws_manager.connect(websocket)
     try:
+        rooms = comment_rooms(websocket.query_params.getlist("post_id"), websocket.query_params.getlist("car_model"))
+        for room in rooms or [GLOBAL_ROOM]:
+            await join_room(websocket, room)
+
         while True:
             data = await websocket.receive_text()
+            instrumentation.ws_received()
             comment_data = json.loads(data)
-            
-            redis_client.publish("comments_channel", json.dumps(comment_data))
-            await ws_manager.broadcast(f"New comment: {comment_data['content']} by user {comment_data['user_id']}")
+            rooms = comment_rooms(as_list(comment_data.get("post_id")), as_list(comment_data.get("car_model")))
+
+            action = comment_data.get("action")
+            if action == "subscribe":
+                await leave_room(websocket, GLOBAL_ROOM)
+                for room in rooms:
+                    await join_room(websocket, room)
+            elif action == "unsubscribe":
+                for room in rooms:
+                    await leave_room(websocket, room)
+            else:
+                await persist_comment(comment_data)
+                await publish_comment(json.dumps(comment_data), rooms)
     except WebSocketDisconnect:
-        ws_manager.disconnect(websocket)
+        pass
+    finally:
+        for room in ws_manager.disconnect(websocket):
+            await comment_subscriber.unsubscribe(room)
 
 # Service status
-@app.get("/status")
+@router.get("/status")
 def status():
     return {"status": f"Post service instance {INSTANCE_ID} is running"}
+
+@router.get("/health/live")
+async def health_live():
+    return health.checker.live()
+
+# 200 while this replica can serve requests, 503 otherwise; see health.py.
+@router.get("/health/ready")
+async def health_ready():
+    ready, report = await health.checker.ready()
+    return JSONResponse(report, status_code=200 if ready else 503)
+
+def create_app():
+    app = FastAPI(lifespan=lifespan)
+    # Pool, query, loop lag and WebSocket metrics come from
+    # instrumentation.py and are served on the same /metrics.
+    Instrumentator().instrument(app).expose(app)
+    # Writes and full-text search cost far more than cached reads, so they
+    # get a smaller budget per client than the default.
+    app.add_middleware(rate_limit.RateLimitMiddleware, rules={
+        "POST /api/posts/": rate_limit.Limit(rate=2, burst=20),
+        "GET /api/posts/search": rate_limit.Limit(rate=5, burst=20),
+    })
+    app.include_router(router)
+    return app
+
+app = create_app()
@@ -0,0 +1,47 @@
+import time
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import text
+import models
+from database import engine
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+# Every replica runs the migrations on start, so they take an advisory lock
+# and the others wait instead of racing on alembic_version. The others poll
+# with pg_try_advisory_lock and no transaction open in between: a session
+# blocked inside pg_advisory_lock holds a snapshot, and CREATE INDEX
+# CONCURRENTLY in the migrating session waits for every older snapshot, so
+# the two would deadlock.
+MIGRATION_LOCK_POLL_INTERVAL = 1
+MIGRATION_LOCK_ID = 8001
+
+def run_migrations_offline():
+    context.configure(url=str(engine.url), target_metadata=models.Base.metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        postgres = connection.dialect.name == "postgresql"
+        if postgres:
+            lock = text("SELECT pg_try_advisory_lock(:id)")
+            while not connection.execute(lock, {"id": MIGRATION_LOCK_ID}).scalar():
+                connection.commit()
+                time.sleep(MIGRATION_LOCK_POLL_INTERVAL)
+            connection.commit()
+        try:
+            context.configure(connection=connection, target_metadata=models.Base.metadata)
+            with context.begin_transaction():
+                context.run_migrations()
+        finally:
+            if postgres:
+                connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+                connection.commit()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
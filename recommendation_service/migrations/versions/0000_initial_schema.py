@@ -0,0 +1,47 @@
+"""Posts and comments
+
+Revision ID: 0000
+Revises:
+Create Date: 2026-10-18
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0000"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases from before migrations got these tables from db-init or from
+    # create_all on a service start.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("posts"):
+        op.create_table(
+            "posts",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("title", sa.String()),
+            sa.Column("content", sa.Text()),
+            sa.Column("car_model", sa.String()),
+            sa.Column("user_id", sa.Integer()),
+        )
+        op.create_index("ix_posts_id", "posts", ["id"])
+        op.create_index("ix_posts_title", "posts", ["title"])
+        op.create_index("ix_posts_car_model", "posts", ["car_model"])
+        op.create_index("ix_posts_user_id", "posts", ["user_id"])
+    if not inspector.has_table("comments"):
+        op.create_table(
+            "comments",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("post_id", sa.Integer(), sa.ForeignKey("posts.id")),
+            sa.Column("comment_text", sa.Text()),
+            sa.Column("user_id", sa.Integer()),
+            sa.Column("idempotency_key", sa.String(), unique=True),
+        )
+        op.create_index("ix_comments_id", "comments", ["id"])
+
+
+def downgrade():
+    op.drop_table("comments")
+    op.drop_table("posts")
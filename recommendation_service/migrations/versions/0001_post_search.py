@@ -0,0 +1,41 @@
+"""Full-text search column and facet indexes on posts
+
+Revision ID: 0001
+Revises: 0000
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0001"
+down_revision = "0000"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # Title matches rank above content matches. Adding a stored generated
+    # column rewrites the table once; the indexes are then built without
+    # blocking writes.
+    op.execute("""
+        ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(content, '')), 'B')
+        ) STORED
+    """)
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_search_vector ON posts USING gin (search_vector)")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_car_model ON posts (car_model)")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_user_id ON posts (user_id)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_posts_user_id")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_posts_car_model")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_posts_search_vector")
+    op.execute("ALTER TABLE posts DROP COLUMN IF EXISTS search_vector")
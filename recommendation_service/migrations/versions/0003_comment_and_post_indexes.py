@@ -0,0 +1,51 @@
+"""Indexes for comments by post and posts by author and car model
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# The latest comments of a page of posts are read by post_id in id order;
+# search filters and facets on user_id and car_model. Tables made by db-init
+# have none of these, and 0001 only added the posts ones on Postgres.
+INDEXES = [
+    ("ix_comments_post_id_id", "comments", "post_id, id"),
+    ("ix_posts_user_id", "posts", "user_id"),
+    ("ix_posts_car_model", "posts", "car_model"),
+]
+
+
+def _drop_if_invalid(name):
+    # A concurrent build that failed leaves an invalid index behind, which
+    # IF NOT EXISTS would then skip.
+    query = sa.text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)")
+    if op.get_bind().execute(query, {"name": name}).scalar():
+        op.execute(f"DROP INDEX CONCURRENTLY {name}")
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        for name, table, columns in INDEXES:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        return
+    # Built without blocking writes to the tables.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            _drop_if_invalid(name)
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def downgrade():
+    # The posts indexes belong to 0000 and 0001.
+    if op.get_bind().dialect.name != "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_comments_post_id_id")
+        return
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_comments_post_id_id")
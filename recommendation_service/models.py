@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text, ForeignKey
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -8,17 +8,33 @@ class Post(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     content = Column(Text)
-    car_model = Column(String)
-    user_id = Column(Integer)
+    car_model = Column(String, index=True)
+    user_id = Column(Integer, index=True)
+    # posts.search_vector, the tsvector that /api/posts/search matches
+    # against, is a Postgres-only generated column added by migration 0001.
 
     comments = relationship("Comment", back_populates="post", cascade="all, delete-orphan")
 
 class Comment(Base):
     __tablename__ = "comments"
+    # The latest comments of each post are read by post_id in id order.
+    __table_args__ = (Index("ix_comments_post_id_id", "post_id", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     post_id = Column(Integer, ForeignKey('posts.id'))
     comment_text = Column(Text)
     user_id = Column(Integer)
+    # Set by the WebSocket write-behind so a redelivered comment is stored once.
+    idempotency_key = Column(String, unique=True)
+
+    post = relationship("Post", back_populates="comments")
+
+# The stored response of a request sent with an Idempotency-Key header, kept
+# until expires_at so a retry gets the same answer instead of a second write.
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
 
-    post = relationship("Post", back_populates="comments")
\ No newline at end of file
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    response = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,176 @@
+import asyncio
+import os
+from redis.exceptions import RedisError
+import crud, schemas
+from database import AsyncSessionLocal
+from redis_client import get_async_redis
+
+# Read-through cache of serialized schemas.Post payloads (comments included).
+# Single posts live under {post:<id>}; list pages live under {posts:list}:...,
+# all in one hash slot so a write can drop every cached page at once.
+#
+# Invalidating bumps a generation counter next to the cached keys, in the same
+# slot. A load remembers the generation it started under and only stores its
+# result if the counter hasn't moved, so a load that read the database before
+# a write can't put the old payload back after the write dropped it.
+POST_CACHE_ENABLED = os.environ.get("POST_CACHE_ENABLED", "1") == "1"
+POST_CACHE_TTL = int(os.environ.get("POST_CACHE_TTL", "300"))
+POST_LIST_CACHE_TTL = int(os.environ.get("POST_LIST_CACHE_TTL", "30"))
+
+LIST_KEYS = "{posts:list}:keys"
+LIST_GENERATION = "{posts:list}:gen"
+
+# KEYS[1] generation, KEYS[2] post; ARGV generation seen, payload, TTL
+STORE_POST_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# KEYS[1] generation, KEYS[2] page, KEYS[3] LIST_KEYS; ARGV generation seen,
+# TTL, then the page's field/value pairs
+STORE_PAGE_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then return 0 end
+for i = 3, #ARGV, 2 do redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1]) end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('SADD', KEYS[3], KEYS[2])
+redis.call('EXPIRE', KEYS[3], ARGV[2])
+return 1
+"""
+
+_inflight = {}
+
+def _post_key(post_id: int):
+    return f"{{post:{post_id}}}"
+
+def _post_generation_key(post_id: int):
+    return f"{{post:{post_id}}}:gen"
+
+def _list_key(cursor, limit: int, comments_limit):
+    # No cursor is the same page as cursor 0, since IDs start at 1.
+    comments = "all" if comments_limit is None else comments_limit
+    return f"{{posts:list}}:{cursor or 0}:{limit}:{comments}"
+
+# Concurrent misses on the same key share one load instead of each querying
+# the database.
+async def _single_flight(key: str, load):
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(load())
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _inflight.pop(key) if _inflight.get(key) is done else None)
+    # shield: a cancelled caller mustn't cancel the load the others wait on
+    return await asyncio.shield(task)
+
+async def _load_post(post_id: int, comments_limit=None):
+    async with AsyncSessionLocal() as db:
+        post = await crud.get_post_async(db, post_id=post_id, comments_limit=comments_limit)
+        if post is None:
+            return None
+        return schemas.Post.model_validate(post).model_dump_json()
+
+async def _load_posts(cursor, limit: int, comments_limit):
+    async with AsyncSessionLocal() as db:
+        posts = await crud.get_posts_async(db, cursor=cursor, limit=limit, comments_limit=comments_limit)
+        payload = "[" + ",".join(schemas.Post.model_validate(post).model_dump_json() for post in posts) + "]"
+    next_cursor = str(posts[-1].id) if len(posts) == limit else ""
+    return {"posts": payload, "next_cursor": next_cursor}
+
+# Only the full view of a post (every comment) is cached.
+async def get_post(post_id: int, comments_limit=None):
+    if not POST_CACHE_ENABLED or comments_limit is not None:
+        return await _load_post(post_id, comments_limit)
+
+    key, generation_key = _post_key(post_id), _post_generation_key(post_id)
+    redis = get_async_redis()
+    try:
+        cached, generation = await redis.mget(key, generation_key)
+        if cached is not None:
+            return cached
+    except RedisError as e:
+        print(f"Post cache read failed: {e}")
+        return await _load_post(post_id)
+
+    async def load():
+        payload = await _load_post(post_id)
+        if payload is not None:
+            try:
+                await redis.register_script(STORE_POST_SCRIPT)(
+                    keys=[generation_key, key], args=[generation or "", payload, POST_CACHE_TTL],
+                )
+            except RedisError as e:
+                print(f"Post cache write failed: {e}")
+        return payload
+
+    return await _single_flight(key, load)
+
+# Returns a page as {"posts": <JSON array>, "next_cursor": <id or "">}.
+async def get_posts(cursor, limit: int, comments_limit=None):
+    if not POST_CACHE_ENABLED:
+        return await _load_posts(cursor, limit, comments_limit)
+
+    key = _list_key(cursor, limit, comments_limit)
+    redis = get_async_redis()
+    try:
+        async with redis.pipeline() as pipe:
+            pipe.hgetall(key)
+            pipe.get(LIST_GENERATION)
+            cached, generation = await pipe.execute()
+        if cached:
+            return cached
+    except RedisError as e:
+        print(f"Post cache read failed: {e}")
+        return await _load_posts(cursor, limit, comments_limit)
+
+    async def load():
+        page = await _load_posts(cursor, limit, comments_limit)
+        fields = [item for field in page.items() for item in field]
+        try:
+            await redis.register_script(STORE_PAGE_SCRIPT)(
+                keys=[LIST_GENERATION, key, LIST_KEYS], args=[generation or "", POST_LIST_CACHE_TTL, *fields],
+            )
+        except RedisError as e:
+            print(f"Post cache write failed: {e}")
+        return page
+
+    return await _single_flight(key, load)
+
+async def invalidate_lists():
+    if not POST_CACHE_ENABLED:
+        return
+    redis = get_async_redis()
+    for key in [key for key in _inflight if key.startswith("{posts:list}")]:
+        del _inflight[key]
+    try:
+        async with redis.pipeline() as pipe:
+            pipe.incr(LIST_GENERATION)
+            pipe.expire(LIST_GENERATION, POST_CACHE_TTL)
+            pipe.smembers(LIST_KEYS)
+            *_, keys = await pipe.execute()
+        await redis.delete(LIST_KEYS, *keys)
+    except RedisError as e:
+        print(f"Post cache invalidation failed: {e}")
+
+async def invalidate_post(post_id: int):
+    await invalidate_posts([post_id])
+
+async def invalidate_posts(post_ids):
+    if not POST_CACHE_ENABLED:
+        return
+    redis = get_async_redis()
+    # Later reads start a fresh load rather than joining one that may have
+    # read the old row.
+    for post_id in post_ids:
+        _inflight.pop(_post_key(post_id), None)
+    try:
+        # Each post's keys share a slot; the pipeline sends every slot's
+        # commands to its node at once.
+        async with redis.pipeline() as pipe:
+            for post_id in post_ids:
+                pipe.incr(_post_generation_key(post_id))
+                pipe.expire(_post_generation_key(post_id), POST_CACHE_TTL)
+                pipe.delete(_post_key(post_id))
+            await pipe.execute()
+    except RedisError as e:
+        print(f"Post cache invalidation failed: {e}")
+    await invalidate_lists()
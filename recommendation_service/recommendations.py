@@ -0,0 +1,392 @@
+import argparse
+import asyncio
+import json
+import os
+from redis.exceptions import RedisError
+from sqlalchemy import func, literal, select, union_all
+import models
+from database import AsyncSessionLocal
+from redis_client import get_async_redis
+
+# Item-based car model recommendations. Users interact with car models by
+# posting about them (REC_POST_WEIGHT) or commenting on posts about them
+# (REC_COMMENT_WEIGHT). With R the user x car model interaction matrix,
+# C = R^T R is the car model co-occurrence matrix and S, C normalised to
+# cosine similarity, says which models interest the same people. A user's
+# scores are R_u S, minus the models they already interacted with.
+#
+# Results are precomputed into Redis so reads are a single GET:
+#   user:<user_id>     top-K models for the user, as JSON
+#   model:<car_model>  top-K similar models, as JSON
+#   popularity         ZSET of total interaction weight per model, the
+#                      fallback for users without interactions
+# together with the state needed to update them incrementally:
+#   interactions:<user_id>  HASH model -> weight, row u of R
+#   cooc:<car_model>        HASH model -> count, row of C
+#   norms                   HASH model -> C[m, m]
+#
+# Every key is {rec}:<version>:<name>, all in one hash slot, and {rec}:version
+# says which version is live. A new interaction updates R, C, the norms and
+# the lists of the user and of every model related to it in one Lua script,
+# so concurrent updates can't interleave. Other users' lists catch up on
+# their own next interaction or on the next full rebuild (python -m
+# recommendations). The rebuild writes a new version beside the live one,
+# replays onto it the interactions recorded meanwhile, makes it live and
+# deletes the old version, keys of deleted posts and users included.
+REC_TOP_K = int(os.environ.get("REC_TOP_K", "10"))
+REC_POST_WEIGHT = float(os.environ.get("REC_POST_WEIGHT", "3"))
+REC_COMMENT_WEIGHT = float(os.environ.get("REC_COMMENT_WEIGHT", "1"))
+REC_REBUILD_TIMEOUT = int(os.environ.get("REC_REBUILD_TIMEOUT", "3600"))
+REC_PIPELINE_SIZE = 1000
+
+VERSION = "{rec}:version"
+VERSIONS = "{rec}:versions"
+# Set while a rebuild runs; interactions recorded meanwhile are also queued
+# on REPLAY for the new version.
+BUILDING = "{rec}:building"
+REPLAY = "{rec}:replay"
+# The live version until the first rebuild.
+INITIAL_VERSION = "0"
+
+def _prefix(version: str):
+    return f"{{rec}}:{version}:"
+
+def user_key(user_id, version: str):
+    return f"{_prefix(version)}user:{user_id}"
+
+def model_key(car_model: str, version: str):
+    return f"{_prefix(version)}model:{car_model}"
+
+def interactions_key(user_id, version: str):
+    return f"{_prefix(version)}interactions:{user_id}"
+
+def cooc_key(car_model: str, version: str):
+    return f"{_prefix(version)}cooc:{car_model}"
+
+def popularity_key(version: str):
+    return f"{_prefix(version)}popularity"
+
+def norms_key(version: str):
+    return f"{_prefix(version)}norms"
+
+async def live_version(redis):
+    return await redis.get(VERSION) or INITIAL_VERSION
+
+# Batch computation. numpy and scipy are only needed here, by the rebuild
+# job, so they're imported on use rather than by every app worker.
+
+def _top_k_rows(matrix, labels, top_k: int):
+    import numpy as np
+
+    result = []
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        scores, columns = matrix.data[start:end], matrix.indices[start:end]
+        if len(scores) > top_k:
+            keep = np.argpartition(-scores, top_k)[:top_k]
+            scores, columns = scores[keep], columns[keep]
+        # labels are sorted, so ties broken by column are broken by name
+        order = np.lexsort((columns, -scores))
+        result.append([
+            {"car_model": str(labels[column]), "score": round(float(score), 6)}
+            for score, column in zip(scores[order], columns[order]) if score > 0
+        ])
+    return result
+
+# Takes parallel arrays of (user_id, car_model, weight) interactions and
+# returns the matrices and top-K lists described above.
+def compute(user_ids, car_models, weights, top_k: int = REC_TOP_K):
+    import numpy as np
+    from scipy import sparse
+
+    users, user_index = np.unique(np.asarray(user_ids), return_inverse=True)
+    car_model_labels, model_index = np.unique(np.asarray(car_models, dtype=object), return_inverse=True)
+    # Duplicate (user, model) pairs are summed.
+    interactions = sparse.csr_matrix(
+        (np.asarray(weights, dtype=np.float64), (user_index, model_index)),
+        shape=(len(users), len(car_model_labels)),
+    )
+    interactions.sum_duplicates()
+
+    cooccurrence = (interactions.T @ interactions).tocsr()
+    norms = cooccurrence.diagonal()
+    inverse = np.divide(1.0, np.sqrt(norms), out=np.zeros_like(norms), where=norms > 0)
+    similarity = (sparse.diags(inverse) @ cooccurrence @ sparse.diags(inverse)).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    seen = interactions.copy()
+    seen.data[:] = 1
+    scores = (interactions @ similarity).tocsr()
+    scores = (scores - scores.multiply(seen)).tocsr()
+    scores.eliminate_zeros()
+
+    return {
+        "users": users,
+        "car_models": car_model_labels,
+        "interactions": interactions,
+        "cooccurrence": cooccurrence,
+        "popularity": np.asarray(interactions.sum(axis=0)).ravel(),
+        "user_lists": _top_k_rows(scores, car_model_labels, top_k),
+        "model_lists": _top_k_rows(similarity, car_model_labels, top_k),
+    }
+
+def _rows(matrix, labels):
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        yield row, {str(labels[column]): float(value) for column, value in zip(matrix.indices[start:end], matrix.data[start:end])}
+
+async def _run_in_pipelines(redis, commands):
+    pipe = redis.pipeline()
+    queued = 0
+    for command, args, kwargs in commands:
+        getattr(pipe, command)(*args, **kwargs)
+        queued += 1
+        if queued >= REC_PIPELINE_SIZE:
+            await pipe.execute()
+            pipe, queued = redis.pipeline(), 0
+    if queued:
+        await pipe.execute()
+
+def _store_commands(result, version: str):
+    car_model_labels = result["car_models"]
+    if len(car_model_labels):
+        yield "zadd", (popularity_key(version), {str(m): float(w) for m, w in zip(car_model_labels, result["popularity"])}), {}
+        yield "hset", (norms_key(version),), {"mapping": {str(m): float(n) for m, n in zip(car_model_labels, result["cooccurrence"].diagonal())}}
+    for row, counts in _rows(result["cooccurrence"], car_model_labels):
+        car_model = str(car_model_labels[row])
+        yield "hset", (cooc_key(car_model, version),), {"mapping": counts}
+        yield "set", (model_key(car_model, version), json.dumps(result["model_lists"][row])), {}
+    for row, weights in _rows(result["interactions"], car_model_labels):
+        user_id = result["users"][row]
+        yield "hset", (interactions_key(user_id, version),), {"mapping": weights}
+        yield "set", (user_key(user_id, version), json.dumps(result["user_lists"][row])), {}
+
+# Writes a result into a version that isn't live yet.
+async def store(redis, result, version: str):
+    await _run_in_pipelines(redis, _store_commands(result, version))
+
+async def load_interactions(db):
+    posts = select(models.Post.user_id, models.Post.car_model, literal(REC_POST_WEIGHT).label("weight"))
+    comments = (
+        select(models.Comment.user_id, models.Post.car_model, literal(REC_COMMENT_WEIGHT).label("weight"))
+        .join(models.Post, models.Comment.post_id == models.Post.id)
+    )
+    events = union_all(posts, comments).subquery()
+    query = (
+        select(events.c.user_id, events.c.car_model, func.sum(events.c.weight))
+        .where(events.c.user_id.is_not(None), events.c.car_model.is_not(None))
+        .group_by(events.c.user_id, events.c.car_model)
+    )
+    rows = (await db.execute(query)).all()
+    return [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
+
+# KEYS[1] VERSION, KEYS[2] BUILDING, KEYS[3] REPLAY; ARGV the new version.
+# Makes it live only once every interaction queued during the build has been
+# replayed onto it.
+SWAP_SCRIPT = """
+if redis.call('LLEN', KEYS[3]) > 0 then return 0 end
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+async def _replay_and_swap(redis, version: str, top_k: int):
+    while True:
+        for entry in await redis.lpop(REPLAY, REC_PIPELINE_SIZE) or []:
+            user_id, car_model, weight = json.loads(entry)
+            await record_interaction(user_id, car_model, weight, top_k, redis, version=version)
+        if await redis.register_script(SWAP_SCRIPT)(keys=[VERSION, BUILDING, REPLAY], args=[version]):
+            return
+
+# Deletes the keys of every version before this one: the one it replaced and
+# any left by a rebuild that died.
+async def _delete_versions_before(redis, version: str):
+    pipe, queued = redis.pipeline(), 0
+    async for key in redis.scan_iter(match="{rec}:*", count=REC_PIPELINE_SIZE):
+        key_version = key.split(":")[1]
+        if not key_version.isdigit() or int(key_version) >= int(version):
+            continue
+        pipe.delete(key)
+        queued += 1
+        if queued >= REC_PIPELINE_SIZE:
+            await pipe.execute()
+            pipe, queued = redis.pipeline(), 0
+    if queued:
+        await pipe.execute()
+
+# Interactions are queued from before the database is read, so none is lost;
+# one stored just before the read but recorded just after it counts twice
+# until the next rebuild.
+async def rebuild(top_k: int = REC_TOP_K):
+    redis = get_async_redis()
+    version = str(await redis.incr(VERSIONS))
+    if not await redis.set(BUILDING, version, nx=True, ex=REC_REBUILD_TIMEOUT):
+        raise RuntimeError("Another recommendation rebuild is running")
+    try:
+        await redis.delete(REPLAY)
+        async with AsyncSessionLocal() as db:
+            user_ids, car_models, weights = await load_interactions(db)
+        result = compute(user_ids, car_models, weights, top_k)
+        await store(redis, result, version)
+        await _replay_and_swap(redis, version, top_k)
+    except BaseException:
+        await redis.delete(BUILDING)
+        raise
+    await _delete_versions_before(redis, version)
+    return result
+
+# Incremental updates
+
+# KEYS[1] VERSION, KEYS[2] BUILDING, KEYS[3] REPLAY; ARGV user_id, car_model,
+# weight, top_k and the version to update, "" for the live one. Adds weight to
+# R[user, car_model], updates C and the norms to match, and rewrites the
+# user's list and those of every model whose similarities changed. The
+# versioned keys aren't declared but share KEYS[1]'s slot.
+RECORD_SCRIPT = """
+local version = ARGV[5]
+if version == '' then
+    version = redis.call('GET', KEYS[1]) or '""" + INITIAL_VERSION + """'
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('RPUSH', KEYS[3], cjson.encode({ARGV[1], ARGV[2], tonumber(ARGV[3])}))
+    end
+end
+local prefix = '{rec}:' .. version .. ':'
+local user, car_model, weight, top_k = ARGV[1], ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4])
+
+local function number(x)
+    return string.format('%.17g', x)
+end
+
+local function hash(key)
+    local flat, result = redis.call('HGETALL', key), {}
+    for i = 1, #flat, 2 do result[flat[i]] = tonumber(flat[i + 1]) end
+    return result
+end
+
+-- Best first, ties broken by name, as in the batch job.
+local function ranked(scores)
+    local list = {}
+    for model, score in pairs(scores) do
+        if score > 0 then list[#list + 1] = {model, score} end
+    end
+    table.sort(list, function(a, b)
+        if a[2] ~= b[2] then return a[2] > b[2] end
+        return a[1] < b[1]
+    end)
+    local items = {}
+    for i = 1, math.min(top_k, #list) do
+        local score = math.floor(list[i][2] * 1e6 + 0.5) / 1e6
+        items[i] = '{"car_model": ' .. cjson.encode(list[i][1]) .. ', "score": ' .. cjson.encode(score) .. '}'
+    end
+    return '[' .. table.concat(items, ', ') .. ']'
+end
+
+local weights = hash(prefix .. 'interactions:' .. user)
+local old = weights[car_model] or 0
+local new = old + weight
+for other, other_weight in pairs(weights) do
+    if other ~= car_model then
+        redis.call('HINCRBYFLOAT', prefix .. 'cooc:' .. car_model, other, number(weight * other_weight))
+        redis.call('HINCRBYFLOAT', prefix .. 'cooc:' .. other, car_model, number(weight * other_weight))
+    end
+end
+redis.call('HINCRBYFLOAT', prefix .. 'cooc:' .. car_model, car_model, number(new * new - old * old))
+redis.call('HINCRBYFLOAT', prefix .. 'norms', car_model, number(new * new - old * old))
+redis.call('ZINCRBY', prefix .. 'popularity', number(weight), car_model)
+redis.call('HINCRBYFLOAT', prefix .. 'interactions:' .. user, car_model, number(weight))
+weights[car_model] = new
+
+-- car_model's norm changed, so every model that co-occurs with it has a new
+-- similarity to it.
+local norms = hash(prefix .. 'norms')
+local related, rows = {}, {}
+for model in pairs(weights) do related[model] = true end
+for model in pairs(hash(prefix .. 'cooc:' .. car_model)) do related[model] = true end
+for model in pairs(related) do rows[model] = hash(prefix .. 'cooc:' .. model) end
+
+for model in pairs(related) do
+    local own, scores = norms[model] or 0, {}
+    for other, count in pairs(rows[model]) do
+        local other_norm = norms[other] or 0
+        if other ~= model and own > 0 and other_norm > 0 then
+            scores[other] = count / math.sqrt(own * other_norm)
+        end
+    end
+    redis.call('SET', prefix .. 'model:' .. model, ranked(scores))
+end
+
+local scores = {}
+for model, model_weight in pairs(weights) do
+    local own = norms[model] or 0
+    for other, count in pairs(rows[model]) do
+        local other_norm = norms[other] or 0
+        if weights[other] == nil and own > 0 and other_norm > 0 then
+            scores[other] = (scores[other] or 0) + model_weight * count / math.sqrt(own * other_norm)
+        end
+    end
+end
+redis.call('SET', prefix .. 'user:' .. user, ranked(scores))
+return version
+"""
+
+# Adds weight to R[user, car_model] and updates everything that depends on it,
+# atomically. version is for replaying onto a rebuild that isn't live yet.
+async def record_interaction(user_id, car_model: str, weight: float, top_k: int = REC_TOP_K, redis=None, version: str = ""):
+    redis = redis or get_async_redis()
+    await redis.register_script(RECORD_SCRIPT)(
+        keys=[VERSION, BUILDING, REPLAY], args=[user_id, car_model, weight, top_k, version],
+    )
+
+# Records a batch of (user_id, car_model, weight) interactions, never raising
+# so callers on the write path aren't affected by Redis trouble.
+async def record_interactions(interactions):
+    for user_id, car_model, weight in interactions:
+        if user_id is None or car_model is None:
+            continue
+        try:
+            await record_interaction(user_id, car_model, weight)
+        except RedisError as e:
+            print(f"Recommendation update failed: {e}")
+
+# Reads. Each looks the live version up and reads from it in one script, so a
+# rebuild going live in between can't send it to deleted keys.
+
+# KEYS[1] VERSION; ARGV the key's name within the version
+GET_SCRIPT = """
+local version = redis.call('GET', KEYS[1]) or '""" + INITIAL_VERSION + """'
+return redis.call('GET', '{rec}:' .. version .. ':' .. ARGV[1])
+"""
+
+# KEYS[1] VERSION; ARGV how many
+POPULAR_SCRIPT = """
+local version = redis.call('GET', KEYS[1]) or '""" + INITIAL_VERSION + """'
+return redis.call('ZREVRANGE', '{rec}:' .. version .. ':popularity', 0, tonumber(ARGV[1]) - 1, 'WITHSCORES')
+"""
+
+async def popular(top_k: int = REC_TOP_K, redis=None):
+    redis = redis or get_async_redis()
+    best = await redis.register_script(POPULAR_SCRIPT)(keys=[VERSION], args=[top_k])
+    return [{"car_model": car_model, "score": round(float(score), 6)} for car_model, score in zip(best[::2], best[1::2])]
+
+# Returns the user's list as stored (a JSON string), or the most popular
+# models if the user has none yet.
+async def for_user(user_id: int, top_k: int = REC_TOP_K):
+    redis = get_async_redis()
+    cached = await redis.register_script(GET_SCRIPT)(keys=[VERSION], args=[f"user:{user_id}"])
+    if cached is not None and cached != "[]":
+        return cached
+    return json.dumps(await popular(top_k, redis))
+
+async def similar_models(car_model: str):
+    return await get_async_redis().register_script(GET_SCRIPT)(keys=[VERSION], args=[f"model:{car_model}"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild every recommendation list from the database.")
+    parser.add_argument("--top-k", type=int, default=REC_TOP_K)
+    args = parser.parse_args()
+    result = asyncio.run(rebuild(args.top_k))
+    print(f"Rebuilt recommendations for {len(result['users'])} users and {len(result['car_models'])} car models")
+
+if __name__ == "__main__":
+    main()
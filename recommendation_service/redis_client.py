@@ -0,0 +1,47 @@
+import threading
+from redis.asyncio import Redis as AsyncRedis
+from redis.cluster import RedisCluster, ClusterNode
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster, ClusterNode as AsyncClusterNode
+
+startup_nodes = [
+    ("redis-node-1", 6379),
+    ("redis-node-2", 6379),
+    ("redis-node-3", 6379),
+    ("redis-node-4", 6379),
+    ("redis-node-5", 6379),
+    ("redis-node-6", 6379),
+]
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+# The sync cluster client connects on construction, so clients are only built
+# the first time something needs Redis.
+def get_redis():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = RedisCluster(
+                startup_nodes=[ClusterNode(host, port) for host, port in startup_nodes],
+                decode_responses=True,
+            )
+        return _client
+
+def get_async_redis():
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = AsyncRedisCluster(
+                startup_nodes=[AsyncClusterNode(host, port) for host, port in startup_nodes],
+                decode_responses=True,
+            )
+        return _async_client
+
+# A plain connection to a single node: a startup node by index, or an explicit
+# host/port. Classic PUBLISH is propagated to every node in the cluster, so
+# subscribing on any one node sees all messages.
+def get_async_node_redis(index: int = 0, host: str = None, port: int = None):
+    if host is None:
+        host, port = startup_nodes[index % len(startup_nodes)]
+    return AsyncRedis(host=host, port=port)
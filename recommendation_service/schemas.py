@@ -1,21 +1,32 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import AfterValidator, BaseModel, Field
+from typing import Annotated, Dict, List, Optional, Union
+
+# Ids are Postgres integer columns, and Postgres text can't hold NUL. Values
+# outside these would pass validation only to fail the INSERT.
+INT32_MAX = 2**31 - 1
+
+def _no_nul(value: str):
+    if "\x00" in value:
+        raise ValueError("must not contain NUL characters")
+    return value
+
+RowId = Annotated[int, Field(gt=0, le=INT32_MAX)]
+Text = Annotated[str, AfterValidator(_no_nul)]
 
 class CommentBase(BaseModel):
     post_id: int
     comment_text: str
     user_id: int
 
-class CommentCreate(CommentBase):
-    content: str
-    user_id: int
-    post_id: int
+# A comment as sent over the WebSocket.
+class CommentCreate(BaseModel):
+    content: Text
+    user_id: RowId
+    post_id: RowId
+    idempotency_key: Optional[str] = None
 
 class Comment(CommentBase):
     id: int
-    content: str
-    user_id: int
-    post_id: int
 
     class Config:
         from_attributes = True
@@ -40,4 +51,13 @@ class Post(BaseModel):
     comments: List[Comment] = []
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class FacetCount(BaseModel):
+    value: Optional[Union[int, str]]
+    count: int
+
+class PostSearchResult(BaseModel):
+    total: int
+    posts: List[Post]
+    facets: Dict[str, List[FacetCount]]
@@ -0,0 +1,97 @@
+import asyncio
+import json
+from sqlalchemy.exc import DataError
+from sqlalchemy.ext.asyncio import create_async_engine
+import bulk, bulk_io, models
+
+CSV = (
+    b'title,content,car_model,user_id\n'
+    b'First,"Two\nlines, with ""quotes""",Civic,1\n'
+    b'Bad,content,Civic,not-a-number\n'
+    b'Short,row\n'
+    b'Second,plain,Golf,2\n'
+)
+
+async def chunks_of(data: bytes, size: int = 7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+def run_with_engine(scenario, monkeypatch):
+    async def wrapped():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        monkeypatch.setattr(bulk, "async_engine", engine)
+        try:
+            return await scenario()
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(wrapped())
+
+def test_csv_import_reports_bad_rows_and_keeps_the_rest(monkeypatch):
+    async def scenario():
+        report = await bulk_io.import_rows(bulk_io.parse_csv(chunks_of(CSV)), bulk.schemas.PostCreate, bulk._write_posts, chunk_size=2)
+        exported = "".join([chunk async for chunk in bulk.export_posts("ndjson")])
+        return report, [json.loads(line) for line in exported.splitlines()]
+
+    report, posts = run_with_engine(scenario, monkeypatch)
+
+    assert report["imported"] == 2
+    assert [error["line"] for error in report["errors"]] == [4, 5]
+    assert posts == [
+        {"id": 1, "title": "First", "content": 'Two\nlines, with "quotes"', "car_model": "Civic", "user_id": 1},
+        {"id": 2, "title": "Second", "content": "plain", "car_model": "Golf", "user_id": 2},
+    ]
+
+def test_ndjson_import_round_trips_through_csv_export(monkeypatch):
+    ndjson = b'{"title": "T", "content": "C", "car_model": "M", "user_id": 3}\n[1]\n{not json\n'
+
+    async def scenario():
+        report = await bulk.import_posts(chunks_of(ndjson), "ndjson")
+        exported = "".join([chunk async for chunk in bulk.export_posts("csv")])
+        return report, exported
+
+    report, exported = run_with_engine(scenario, monkeypatch)
+
+    assert report["imported"] == 1
+    assert [error["line"] for error in report["errors"]] == [2, 3]
+    assert exported == "id,title,content,car_model,user_id\n1,T,C,M,3\n"
+
+def test_import_reports_rows_the_columns_cannot_hold():
+    ndjson = (
+        b'{"title": "Big id", "content": "C", "car_model": "M", "user_id": 2147483648}\n'
+        b'{"title": "NUL", "content": "a\\u0000b", "car_model": "M", "user_id": 1}\n'
+        b'{"title": "Bad \xff byte", "content": "C", "car_model": "M", "user_id": 1}\n'
+        b'{"title": "Fine", "content": "C", "car_model": "M", "user_id": 1}\n'
+    )
+    written = []
+
+    async def write_chunk(valid):
+        written.extend(line for line, _ in valid)
+        return len(valid), []
+
+    report = asyncio.run(bulk_io.import_rows(bulk_io.parse_ndjson(chunks_of(ndjson)), bulk.schemas.PostCreate, write_chunk))
+
+    assert written == [4]
+    assert [(error["line"], error["error"].split(":")[0]) for error in report["errors"]] == [
+        (1, "user_id"), (2, "content"), (3, "Invalid UTF-8"),
+    ]
+
+def test_failed_chunk_is_split_down_to_the_rejected_rows():
+    rows = [{"title": f"Post {i}", "content": "C", "car_model": "M", "user_id": 1} for i in range(8)]
+    ndjson = "".join(json.dumps(row) + "\n" for row in rows).encode()
+    written = []
+
+    # Stands in for a COPY that Postgres refuses because of lines 3 and 6.
+    async def write_chunk(valid):
+        if any(line in (3, 6) for line, _ in valid):
+            raise DataError("COPY posts", {}, Exception("bad row"))
+        written.extend(line for line, _ in valid)
+        return len(valid), []
+
+    report = asyncio.run(bulk_io.import_rows(bulk_io.parse_ndjson(chunks_of(ndjson)), bulk.schemas.PostCreate, write_chunk))
+
+    assert report["imported"] == 6
+    assert sorted(written) == [1, 2, 4, 5, 7, 8]
+    assert [error["line"] for error in report["errors"]] == [3, 6]
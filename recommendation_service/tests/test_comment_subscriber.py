@@ -0,0 +1,58 @@
+import asyncio
+import json
+from comment_subscriber import COMMENTS_CHANNEL, CommentSubscriber, room_channel
+from websocket_manager import WebSocketManager
+from test_websocket_manager import FakeSocket, settle
+
+class RecordingManager:
+    def __init__(self):
+        self.messages = []
+
+    def broadcast(self, message: str, room: str = None, skip_rooms=()):
+        self.messages.append(message)
+
+def test_full_queue_drops_oldest_messages():
+    async def scenario():
+        manager = RecordingManager()
+        subscriber = CommentSubscriber(manager, queue_size=3, batch_size=2)
+        subscriber.enqueue_batch([{"channel": COMMENTS_CHANNEL.encode(), "data": data} for data in (b"1", b"2", b"3", b"4", b"5")])
+
+        subscriber._tasks = [asyncio.create_task(subscriber._fan_out())]
+        while not subscriber.queue.empty():
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        await subscriber.stop()
+        return manager.messages, subscriber.dropped
+
+    messages, dropped = asyncio.run(scenario())
+
+    assert messages == ["3", "4", "5"]
+    assert dropped == 2
+
+def test_client_in_several_rooms_gets_each_comment_once():
+    async def scenario():
+        manager = WebSocketManager()
+        both, post_only = FakeSocket(), FakeSocket()
+        for socket in (both, post_only):
+            await manager.connect(socket)
+        manager.join(both, "post:1")
+        manager.join(both, "car_model:Civic")
+        manager.join(post_only, "car_model:Civic")
+        subscriber = CommentSubscriber(manager)
+        rooms = ["post:1", "car_model:Civic", "car_model:Civic-gone"]
+        subscriber._room_by_channel = {room_channel(room): room for room in rooms}
+        await subscriber.unsubscribe("car_model:Civic-gone")
+
+        # What publish_comment sends to each room's channel.
+        subscriber.enqueue_batch([
+            {"channel": room_channel(room).encode(), "data": f"{json.dumps(rooms)}\nhello".encode()} for room in rooms
+        ])
+        subscriber.start()
+        await settle()
+        await subscriber.stop()
+        return both.sent, post_only.sent
+
+    both_sent, post_only_sent = asyncio.run(scenario())
+
+    assert both_sent == ["hello"]
+    assert post_only_sent == ["hello"]
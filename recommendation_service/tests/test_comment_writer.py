@@ -0,0 +1,167 @@
+import asyncio
+import fakeredis
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import DataError, OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import comment_writer, models, post_cache, recommendations, schemas
+
+# A fake Redis and an in-memory database holding post 1.
+async def flush_fixtures(monkeypatch):
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(comment_writer, "get_async_redis", lambda: redis)
+    monkeypatch.setattr(post_cache, "get_async_redis", lambda: redis)
+    monkeypatch.setattr(recommendations, "get_async_redis", lambda: redis)
+
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    monkeypatch.setattr(comment_writer, "AsyncSessionLocal", session_factory)
+    async with session_factory() as db:
+        db.add(models.Post(title="Post", content="content", car_model="Model", user_id=1))
+        await db.commit()
+    return redis, engine, session_factory
+
+def test_flush_writes_each_comment_once_and_acks(monkeypatch):
+    async def scenario():
+        redis, engine, session_factory = await flush_fixtures(monkeypatch)
+        writer = comment_writer.CommentWriter()
+        await writer._ensure_group(redis)
+        comment = await comment_writer.enqueue(schemas.CommentCreate(content="hi", user_id=2, post_id=1))
+        # A redelivery of the same comment, as after a crash before XACK.
+        await comment_writer.enqueue(comment)
+        await redis.set(post_cache._post_key(1), "stale")
+
+        entries = await redis.xreadgroup(comment_writer.COMMENT_GROUP, writer.consumer,
+                                         {comment_writer.COMMENT_STREAM: ">"}, count=10)
+        await writer.flush(redis, entries[0][1])
+
+        async with session_factory() as db:
+            stored = await db.scalar(select(func.count()).select_from(models.Comment))
+        pending = await redis.xpending(comment_writer.COMMENT_STREAM, comment_writer.COMMENT_GROUP)
+        cached = await redis.get(post_cache._post_key(1))
+        interactions = await redis.hgetall(recommendations.interactions_key(2, await recommendations.live_version(redis)))
+        await engine.dispose()
+        return stored, pending["pending"], await redis.xlen(comment_writer.COMMENT_STREAM), cached, interactions
+
+    stored, pending, length, cached, interactions = asyncio.run(scenario())
+
+    assert stored == 1
+    assert pending == 0
+    assert length == 0
+    assert cached is None
+    assert {model: float(weight) for model, weight in interactions.items()} == {"Model": recommendations.REC_COMMENT_WEIGHT}
+
+def test_flush_drops_rows_the_database_rejects(monkeypatch):
+    create_comments = comment_writer.crud.create_comments_async
+
+    # Stands in for a value Postgres refuses, e.g. one out of a column's range.
+    async def create_comments_async(db, comments):
+        if any(comment.content == "rejected" for comment in comments):
+            raise DataError("INSERT INTO comments", {}, Exception("value out of range"))
+        return await create_comments(db, comments)
+
+    monkeypatch.setattr(comment_writer.crud, "create_comments_async", create_comments_async)
+
+    async def scenario():
+        redis, engine, session_factory = await flush_fixtures(monkeypatch)
+        writer = comment_writer.CommentWriter()
+        await writer._ensure_group(redis)
+        await comment_writer.enqueue(schemas.CommentCreate(content="rejected", user_id=2, post_id=1))
+        await comment_writer.enqueue(schemas.CommentCreate(content="hi", user_id=2, post_id=1))
+
+        entries = await redis.xreadgroup(comment_writer.COMMENT_GROUP, writer.consumer,
+                                         {comment_writer.COMMENT_STREAM: ">"}, count=10)
+        await writer.flush(redis, entries[0][1])
+
+        async with session_factory() as db:
+            stored = (await db.scalars(select(models.Comment.comment_text))).all()
+        pending = await redis.xpending(comment_writer.COMMENT_STREAM, comment_writer.COMMENT_GROUP)
+        await engine.dispose()
+        return stored, pending["pending"]
+
+    stored, pending = asyncio.run(scenario())
+
+    assert stored == ["hi"]
+    assert pending == 0
+
+@pytest.mark.parametrize("fields", [{"post_id": 2**31}, {"user_id": 0}, {"content": "a\x00b"}])
+def test_comment_ids_and_text_must_fit_the_columns(fields):
+    with pytest.raises(ValueError):
+        schemas.CommentCreate.model_validate({"content": "hi", "user_id": 2, "post_id": 1, **fields})
+
+def run_writer(monkeypatch, flush, flushes: int, pending: int = 0, flush_size: int = 500):
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        xreadgroup = redis.xreadgroup
+        done = asyncio.Event()
+
+        # fakeredis answers a blocking read at once without yielding, which
+        # would starve the loop. Once the test has seen enough the writer
+        # stops here, since cancelling it inside a fakeredis call can leave
+        # the connection pool stuck.
+        async def blocking_xreadgroup(*args, block=None, **kwargs):
+            await asyncio.sleep((block or 0) / 1000)
+            if done.is_set():
+                raise asyncio.CancelledError()
+            return await xreadgroup(*args, **kwargs)
+
+        monkeypatch.setattr(redis, "xreadgroup", blocking_xreadgroup)
+        monkeypatch.setattr(comment_writer, "get_async_redis", lambda: redis)
+        monkeypatch.setattr(comment_writer, "COMMENT_RETRY_DELAY", 0.01)
+        writer = comment_writer.CommentWriter(flush_size=flush_size, flush_interval=0.01)
+        calls = []
+
+        async def recording_flush(redis, entries):
+            calls.append(len(entries))
+            await flush(len(calls))
+            await redis.xack(comment_writer.COMMENT_STREAM, comment_writer.COMMENT_GROUP, *[id for id, _ in entries])
+            if len(calls) == flushes:
+                done.set()
+
+        monkeypatch.setattr(writer, "flush", recording_flush)
+        await writer._ensure_group(redis)
+        for i in range(max(pending, 1)):
+            await comment_writer.enqueue(schemas.CommentCreate(content=f"hi {i}", user_id=2, post_id=1))
+        if pending:
+            # Read by a consumer that then died; the writer claims them all at start.
+            stale = (await xreadgroup(comment_writer.COMMENT_GROUP, "crashed", {comment_writer.COMMENT_STREAM: ">"}))[0][1]
+
+            async def claim_stale(redis):
+                claimed = list(stale)
+                stale.clear()
+                return claimed
+
+            monkeypatch.setattr(writer, "_claim_stale", claim_stale)
+        writer.start()
+        try:
+            await asyncio.wait_for(done.wait(), 5)
+            alive = not writer._task.done()
+        finally:
+            done.set()
+            await asyncio.gather(writer._task, return_exceptions=True)
+        return calls, alive
+
+    return asyncio.run(scenario())
+
+def test_writer_flushes_a_full_batch_of_claimed_entries(monkeypatch):
+    async def flush(call):
+        pass
+
+    calls, alive = run_writer(monkeypatch, flush, flushes=1, pending=5, flush_size=5)
+
+    assert calls == [5]
+    assert alive
+
+def test_writer_keeps_running_when_a_flush_fails(monkeypatch):
+    async def flush(call):
+        if call == 1:
+            raise OperationalError("INSERT INTO comments", {}, Exception("connection lost"))
+
+    # The failed batch stays pending and is claimed again right away.
+    monkeypatch.setattr(comment_writer, "COMMENT_CLAIM_IDLE", 0)
+    calls, alive = run_writer(monkeypatch, flush, flushes=2)
+
+    assert len(calls) == 2
+    assert alive
@@ -0,0 +1,47 @@
+import asyncio
+import json
+import httpx
+from discovery import Discovery
+from http_client import HttpClient
+
+def test_register_poll_and_deregister():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path.startswith("/v1/health/service/"):
+            return httpx.Response(200, headers={"X-Consul-Index": "42"}, json=[
+                {"Node": {"Address": "10.0.0.1"}, "Service": {"Address": "10.0.1.5", "Port": 8000}},
+                {"Node": {"Address": "10.0.0.2"}, "Service": {"Address": "", "Port": 8000}},
+            ])
+        return httpx.Response(200)
+
+    async def scenario():
+        client = HttpClient(transport=httpx.MockTransport(handler))
+        discovery = Discovery("recommendation-service", 8001, tags=["posts"], client=client)
+        await discovery.register(address="10.0.1.9")
+        index = await discovery.poll("user-service", index=7)
+        await discovery.deregister()
+        await client.close()
+        return discovery, index
+
+    discovery, index = asyncio.run(scenario())
+    register, poll, deregister = requests
+    registration = json.loads(register.content)
+
+    assert registration["ID"] == discovery.service_id
+    assert registration["Address"] == "10.0.1.9"
+    assert registration["Check"]["HTTP"] == "http://10.0.1.9:8001/health/ready"
+    assert poll.url.params["index"] == "7"
+    assert poll.url.params["passing"] == "true"
+    assert index == 42
+    assert discovery.instances("user-service") == [("10.0.1.5", 8000), ("10.0.0.2", 8000)]
+    assert discovery.instances("unknown") == []
+    assert deregister.url.path == f"/v1/agent/service/deregister/{discovery.service_id}"
+
+def test_workers_of_a_container_share_one_service_id():
+    first = Discovery("recommendation-service", 8001)
+    second = Discovery("recommendation-service", 8001)
+
+    assert first.service_id == second.service_id
+    assert first.service_id != Discovery("recommendation-service", 8002).service_id
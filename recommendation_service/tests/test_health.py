@@ -0,0 +1,60 @@
+import asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+import health_check
+from instrumentation import LoopLagMonitor
+
+def test_ready_runs_probes_concurrently_and_caches_the_result():
+    calls = []
+
+    async def ok():
+        calls.append("ok")
+
+    async def hangs():
+        calls.append("hangs")
+        await asyncio.sleep(10)
+
+    async def broken():
+        raise ConnectionError("refused")
+
+    async def scenario():
+        checker = health_check.HealthCheck(
+            [health_check.Probe("postgres", ok), health_check.Probe("redis", hangs, critical=False), health_check.Probe("grpc", broken, critical=False)],
+            {}, LoopLagMonitor(), timeout=0.05, ttl=60,
+        )
+        first, second = await asyncio.gather(checker.ready(), checker.ready())
+        cached = await checker.ready()
+        return first, second, cached
+
+    (ready, report), second, cached = asyncio.run(scenario())
+
+    assert ready is True
+    assert report["checks"]["postgres"]["ok"] is True
+    assert report["checks"]["redis"]["error"] == "timed out after 0.05s"
+    assert report["checks"]["grpc"]["error"] == "refused"
+    assert report["checks"]["redis"]["latency_ms"] < 1000
+    # Concurrent and later callers share one run.
+    assert second == cached == (ready, report)
+    assert calls == ["ok", "hangs"]
+
+def test_not_ready_when_a_critical_probe_fails_or_the_pool_is_saturated():
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=1, max_overflow=0)
+
+    async def ok():
+        pass
+
+    async def broken():
+        raise ConnectionError("refused")
+
+    async def scenario():
+        failing = health_check.HealthCheck([health_check.Probe("postgres", broken)], {}, LoopLagMonitor())
+        saturated = health_check.HealthCheck([health_check.Probe("postgres", ok)], {"db": engine.pool}, LoopLagMonitor())
+        with engine.connect():
+            return await failing.ready(), await saturated.ready()
+
+    (failing_ready, _), (saturated_ready, report) = asyncio.run(scenario())
+    engine.dispose()
+
+    assert failing_ready is False
+    assert saturated_ready is False
+    assert report["pools"]["db"] == {"size": 1, "checked_out": 1, "overflow": 0, "utilization": 1.0}
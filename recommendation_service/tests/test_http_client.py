@@ -0,0 +1,76 @@
+import asyncio
+import httpx
+import pytest
+import http_client
+
+def run(responses, method="GET", headers=None, retries=2):
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        result = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return httpx.Response(result)
+
+    async def scenario():
+        client = http_client.HttpClient(retries=retries, transport=httpx.MockTransport(handler))
+        try:
+            return await client.request(method, "http://user_service:8000/api/users/1", headers=headers)
+        finally:
+            await client.close()
+
+    return asyncio.run(scenario()), calls
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(http_client, "backoff", lambda attempt: 0)
+
+def test_retries_idempotent_requests_until_success():
+    response, calls = run([httpx.ConnectError("refused"), 503, 200])
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+def test_post_is_only_retried_with_an_idempotency_key():
+    response, calls = run([503, 200], method="POST")
+    keyed, keyed_calls = run([503, 200], method="POST", headers={"Idempotency-Key": "saga-1:post"})
+
+    assert (response.status_code, len(calls)) == (503, 1)
+    assert (keyed.status_code, len(keyed_calls)) == (200, 2)
+
+def test_breaker_opens_after_repeated_failures_and_lets_a_trial_through():
+    class Clock:
+        now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    clock = Clock()
+    breaker = http_client.CircuitBreaker("user_service:8000", failures=2, reset=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.allow()
+    # Only one trial at a time.
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+def test_open_circuit_fails_fast():
+    async def scenario():
+        calls = []
+        client = http_client.HttpClient(retries=0, transport=httpx.MockTransport(lambda request: calls.append(1) or httpx.Response(503)))
+        try:
+            for _ in range(http_client.HTTP_BREAKER_FAILURES):
+                await client.get("http://flaky:80/")
+            with pytest.raises(http_client.CircuitOpenError):
+                await client.get("http://flaky:80/")
+            return len(calls)
+        finally:
+            await client.close()
+
+    assert asyncio.run(scenario()) == http_client.HTTP_BREAKER_FAILURES
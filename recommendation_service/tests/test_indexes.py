@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+import pytest
+import sqlalchemy as sa
+import crud
+import models
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="module")
+def migrated(tmp_path_factory):
+    url = f"sqlite:///{tmp_path_factory.mktemp('db')}/postdb.db"
+    result = subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=SERVICE_DIR,
+                            env={**os.environ, "DATABASE_URL": url}, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    engine = sa.create_engine(url)
+    yield engine
+    engine.dispose()
+
+# True if SQLite's plan for the query looks rows of the table up through the
+# index rather than scanning the table.
+def uses_index(engine, query, table: str, index: str):
+    with engine.connect() as conn:
+        sql = str(query.compile(conn, compile_kwargs={"literal_binds": True}))
+        steps = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+    return any(step.startswith(f"SEARCH {table} ") and f"INDEX {index} " in step for step in steps)
+
+def test_latest_comments_of_a_page_use_the_post_id_index(migrated):
+    query = crud._latest_comments_query([SimpleNamespace(id=1), SimpleNamespace(id=2)], 3)
+
+    assert uses_index(migrated, query, "comments", "ix_comments_post_id_id")
+
+def test_search_facet_filters_use_the_posts_indexes(migrated):
+    by_user = crud._search_conditions(None, {"user_id": [1, 2]})
+    by_car_model = crud._search_conditions(None, {"car_model": ["Civic"]})
+
+    assert uses_index(migrated, sa.select(models.Post).where(*by_user), "posts", "ix_posts_user_id")
+    assert uses_index(migrated, sa.select(models.Post).where(*by_car_model), "posts", "ix_posts_car_model")
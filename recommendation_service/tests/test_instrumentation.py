@@ -0,0 +1,85 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+import instrumentation
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_normalize_statement_collapses_literals_parameters_and_lists():
+    assert instrumentation.normalize_statement(
+        "SELECT posts.id\n  FROM posts WHERE posts.id IN (%(id_1)s, %(id_2)s, %(id_3)s) AND car_model = 'Civic' LIMIT 20"
+    ) == "SELECT posts.id FROM posts WHERE posts.id IN (?) AND car_model = ? LIMIT ?"
+    assert instrumentation.normalize_statement(
+        "INSERT INTO comments (post_id, content) VALUES ($1, $2), ($3, $4)"
+    ) == "INSERT INTO comments (post_id, content) VALUES (?)"
+    assert instrumentation.normalize_statement("SELECT now()::date WHERE id = :id") == "SELECT now()::date WHERE id = ?"
+    assert len(instrumentation.normalize_statement("SELECT " + ", ".join(f"c{i}" for i in range(100)))) == instrumentation.SQL_LABEL_MAX_LENGTH
+
+def test_instrument_engine_records_queries_checkouts_and_pool_gauges():
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=2, max_overflow=1)
+    instrumentation.instrument_engine(engine, "test")
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, {"engine": "test", **labels}) or 0
+
+    statement = "SELECT ? WHERE ? = ?"
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1 WHERE :a = :a"), {"a": 5})
+        conn.execute(text("SELECT 2 WHERE :a = :a"), {"a": 6})
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing"))
+        checked_out = sample("db_pool_checked_out")
+
+    assert sample("db_query_duration_seconds_count", statement=statement) == 2
+    assert sample("db_query_errors_total") == 1
+    assert sample("db_pool_checkout_wait_seconds_count") == 1
+    assert checked_out == 1
+    assert sample("db_pool_size") == 2
+    assert sample("db_pool_checked_out") == 0
+    engine.dispose()
+
+def test_loop_lag_monitor_sees_a_blocked_loop():
+    async def scenario():
+        monitor = instrumentation.LoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+
+    before = REGISTRY.get_sample_value("event_loop_lag_seconds_sum") or 0
+    asyncio.run(scenario())
+
+    assert REGISTRY.get_sample_value("event_loop_lag_seconds_sum") - before >= 0.05
+
+def test_pool_and_sampled_gauges_reach_a_multiprocess_scrape(tmp_path):
+    # The gauges must be in the files a multiprocess scrape reads, which only
+    # works in a fresh interpreter with PROMETHEUS_MULTIPROC_DIR set.
+    script = (
+        "from prometheus_client import CollectorRegistry, Gauge, multiprocess\n"
+        "from sqlalchemy import create_engine\n"
+        "from sqlalchemy.pool import QueuePool\n"
+        "import instrumentation\n"
+        "engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=2)\n"
+        "instrumentation.instrument_engine(engine, 'test')\n"
+        "depth = Gauge('test_depth', 'depth', multiprocess_mode='livesum')\n"
+        "instrumentation.sample_gauge(depth, lambda: 7)\n"
+        "instrumentation.gauge_sampler.sample()\n"
+        "with engine.connect():\n"
+        "    registry = CollectorRegistry()\n"
+        "    multiprocess.MultiProcessCollector(registry)\n"
+        "    print(registry.get_sample_value('db_pool_checked_out', {'engine': 'test'}),\n"
+        "          registry.get_sample_value('test_depth'))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=SERVICE_DIR, capture_output=True, text=True,
+                            env={**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["1.0", "7.0"]
@@ -0,0 +1,48 @@
+import asyncio
+from benchmarks import loadgen
+
+def test_summarize_reports_percentiles_in_milliseconds():
+    summary = loadgen.summarize([i / 1000 for i in range(100, 0, -1)], errors=2, elapsed=2.0)
+
+    assert summary == {"requests": 100, "errors": 2, "rps": 50.0, "p50_ms": 51.0, "p95_ms": 96.0, "p99_ms": 100.0}
+
+def test_drive_counts_only_steps_after_warmup_and_failures_as_errors():
+    async def ok(state):
+        await asyncio.sleep(0.01)
+
+    async def broken(state):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("500")
+
+    async def setup(index):
+        return {}
+
+    results = asyncio.run(loadgen.drive(
+        [loadgen.Step("ok", 1, ok), loadgen.Step("broken", 1, broken)], setup,
+        concurrency=2, duration=0.2, warmup=0.05, seed=1,
+    ))
+
+    assert results["steps"]["broken"]["errors"] == results["steps"]["broken"]["requests"] > 0
+    assert results["steps"]["ok"]["errors"] == 0
+    assert results["total"]["requests"] == results["steps"]["ok"]["requests"] + results["steps"]["broken"]["requests"]
+    assert results["total"]["requests"] <= 2 * 0.2 / 0.01 + 2
+
+def test_compare_flags_slower_latency_lower_rps_and_more_errors():
+    def run(p99, rps, errors=0, concurrency=20):
+        summary = {"requests": 1000, "errors": errors, "rps": rps, "p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": p99}
+        return {"service": "recommendation_service", "scenario": "browse", "concurrency": concurrency,
+                "database": "sqlite", "redis": "fakeredis", "steps": {"read": summary}, "total": summary}
+
+    baseline = run(p99=30.0, rps=200.0)
+
+    assert loadgen.compare(run(p99=36.0, rps=170.0), baseline, threshold=0.25) == []
+    assert loadgen.compare(run(p99=40.0, rps=200.0), baseline, threshold=0.25) == [
+        "total: p99_ms 40.0 vs baseline 30.0", "read: p99_ms 40.0 vs baseline 30.0",
+    ]
+    assert loadgen.compare(run(p99=30.0, rps=100.0, errors=50), baseline, threshold=0.25) == [
+        "total: rps 100.0 vs baseline 200.0", "total: error rate 5.0% vs baseline 0.0%",
+        "read: rps 100.0 vs baseline 200.0", "read: error rate 5.0% vs baseline 0.0%",
+    ]
+    assert loadgen.compare(run(p99=30.0, rps=200.0, concurrency=50), baseline, threshold=0.25) == [
+        "concurrency: 50 vs baseline 20",
+    ]
@@ -0,0 +1,62 @@
+import asyncio
+import fakeredis
+import post_cache
+
+def run_with_slow_loads(monkeypatch, scenario):
+    async def main():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        monkeypatch.setattr(post_cache, "get_async_redis", lambda: redis)
+        rows = {"version": "old"}
+        loading, release = asyncio.Event(), asyncio.Event()
+
+        # Reads the row, then stalls until released, like a slow query.
+        async def load_post(post_id, comments_limit=None):
+            version = rows["version"]
+            loading.set()
+            await release.wait()
+            return f'{{"id": {post_id}, "version": "{version}"}}'
+
+        async def load_posts(cursor, limit, comments_limit):
+            version = rows["version"]
+            loading.set()
+            await release.wait()
+            return {"posts": f'[{{"version": "{version}"}}]', "next_cursor": ""}
+
+        monkeypatch.setattr(post_cache, "_load_post", load_post)
+        monkeypatch.setattr(post_cache, "_load_posts", load_posts)
+        return await scenario(redis, rows, loading, release)
+
+    return asyncio.run(main())
+
+def test_load_started_before_an_invalidation_is_not_cached(monkeypatch):
+    async def scenario(redis, rows, loading, release):
+        stale = asyncio.ensure_future(post_cache.get_post(1))
+        await loading.wait()
+        rows["version"] = "new"
+        await post_cache.invalidate_post(1)
+        release.set()
+        return await stale, await post_cache.get_post(1), await redis.get(post_cache._post_key(1))
+
+    stale, fresh, cached = run_with_slow_loads(monkeypatch, scenario)
+
+    assert '"old"' in stale
+    assert '"new"' in fresh
+    assert cached == fresh
+
+def test_page_load_started_before_an_invalidation_is_not_cached(monkeypatch):
+    async def scenario(redis, rows, loading, release):
+        stale = asyncio.ensure_future(post_cache.get_posts(None, 20))
+        await loading.wait()
+        rows["version"] = "new"
+        await post_cache.invalidate_lists()
+        release.set()
+        await stale
+        cached_after_stale = await redis.hgetall(post_cache._list_key(None, 20, None))
+        fresh = await post_cache.get_posts(None, 20)
+        return cached_after_stale, fresh, await redis.hgetall(post_cache._list_key(None, 20, None))
+
+    cached_after_stale, fresh, cached = run_with_slow_loads(monkeypatch, scenario)
+
+    assert cached_after_stale == {}
+    assert '"new"' in fresh["posts"]
+    assert cached == fresh
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import crud, idempotency, models, schemas
+from database import count_queries
+
+def run_with_posts(check, posts=5, comments_per_post=3):
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+        async with session_factory() as db:
+            for i in range(posts):
+                post = models.Post(title=f"Post {i}", content="content", car_model="Model", user_id=1)
+                post.comments = [
+                    models.Comment(comment_text=f"Comment {j}", user_id=2) for j in range(comments_per_post)
+                ]
+                db.add(post)
+            await db.commit()
+
+        try:
+            async with session_factory() as db:
+                with count_queries(engine) as statements:
+                    result = await check(db)
+                return result, statements
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(scenario())
+
+def test_get_posts_loads_comments_in_one_extra_query():
+    posts, statements = run_with_posts(lambda db: crud.get_posts_async(db, limit=5))
+
+    assert len(statements) == 2
+    assert [len(post.comments) for post in posts] == [3] * 5
+
+def test_get_post_loads_comments_with_a_join():
+    post, statements = run_with_posts(lambda db: crud.get_post_async(db, post_id=1))
+
+    assert len(statements) == 1
+    assert len(post.comments) == 3
+
+def test_get_posts_without_comments():
+    posts, statements = run_with_posts(lambda db: crud.get_posts_async(db, limit=5, comments_limit=0))
+
+    assert len(statements) == 1
+    assert all(post.comments == [] for post in posts)
+
+@pytest.mark.parametrize("comments_limit", [1, 2])
+def test_get_posts_keeps_latest_comments(comments_limit):
+    posts, statements = run_with_posts(lambda db: crud.get_posts_async(db, limit=5, comments_limit=comments_limit))
+
+    assert len(statements) == 2
+    for post in posts:
+        assert [c.comment_text for c in post.comments] == [f"Comment {j}" for j in range(3 - comments_limit, 3)]
+
+def test_stream_posts_loads_comments_per_batch():
+    async def stream(db):
+        return [post async for post in crud.stream_posts_async(db, batch_size=2, comments_limit=1)]
+
+    posts, statements = run_with_posts(stream)
+
+    # one streaming SELECT plus one comments query for each of the 3 batches
+    assert len(statements) == 4
+    assert [len(post.comments) for post in posts] == [1] * 5
+
+def test_create_comments_skips_known_idempotency_keys():
+    async def write_twice(db):
+        first = [schemas.CommentCreate(content="a", user_id=2, post_id=1, idempotency_key="k1"),
+                 schemas.CommentCreate(content="b", user_id=2, post_id=2, idempotency_key="k2")]
+        second = [schemas.CommentCreate(content="b", user_id=2, post_id=2, idempotency_key="k2"),
+                  schemas.CommentCreate(content="c", user_id=2, post_id=2, idempotency_key="k3")]
+        inserted = [await crud.create_comments_async(db, first), await crud.create_comments_async(db, second)]
+        posts = await crud.get_posts_async(db, limit=2)
+        return inserted, [[c.comment_text for c in post.comments] for post in posts]
+
+    (inserted, comments), statements = run_with_posts(write_twice, posts=2, comments_per_post=0)
+
+    assert inserted == [["k1", "k2"], ["k3"]]
+    assert comments == [["a"], ["b", "c"]]
+
+def test_search_facets_ignore_their_own_filter():
+    async def seed_and_search(db):
+        db.add_all([
+            models.Post(title="Civic", content="c", car_model="Civic", user_id=1),
+            models.Post(title="Civic", content="c", car_model="Civic", user_id=2),
+            models.Post(title="Golf", content="c", car_model="Golf", user_id=1),
+        ])
+        await db.commit()
+        return await crud.search_posts_async(db, car_models=["Civic"], user_ids=[1])
+
+    result, _ = run_with_posts(seed_and_search, posts=0)
+
+    assert result["total"] == 1
+    assert [post.car_model for post in result["posts"]] == ["Civic"]
+    assert result["facets"]["car_model"] == [{"value": "Civic", "count": 1}, {"value": "Golf", "count": 1}]
+    assert result["facets"]["user_id"] == [{"value": 1, "count": 1}, {"value": 2, "count": 1}]
+
+def test_search_query_uses_the_tsvector_column():
+    tsquery = func.websearch_to_tsquery(crud.SEARCH_CONFIG, "turbo")
+    condition, = crud._search_conditions(tsquery, {"car_model": [], "user_id": []})
+
+    sql = str(condition.compile(dialect=postgresql.dialect()))
+
+    assert sql.startswith("posts.search_vector @@ websearch_to_tsquery(")
+
+def test_create_post_once_replays_the_first_response():
+    async def check(db):
+        post = schemas.PostCreate(title="New", content="content", car_model="Model", user_id=1)
+        request_hash = idempotency.fingerprint("create_post", post.model_dump())
+        first = await crud.create_post_once_async(db, post, "saga-1:post", request_hash)
+        replay = await idempotency.lookup(db, "saga-1:post", request_hash)
+        with pytest.raises(HTTPException) as reused:
+            await idempotency.lookup(db, "saga-1:post", idempotency.fingerprint("create_post", {"title": "Other"}))
+        count = await db.scalar(select(func.count()).select_from(models.Post))
+        return first, replay, reused.value.status_code, count
+
+    (first, replay, reused_status, count), _ = run_with_posts(check, posts=1, comments_per_post=0)
+
+    assert replay == first
+    assert first["id"] == 2
+    assert reused_status == 422
+    assert count == 2
+
+# A TestClient for the app over a SQLite file holding posts 1..posts, with
+# the post cache off. NullPool: the app runs on the client's own event loop.
+def posts_client(monkeypatch, tmp_path, posts=5):
+    from fastapi.testclient import TestClient
+    from sqlalchemy.pool import NullPool
+    import main, post_cache
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/posts.db", poolclass=NullPool)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        async with session_factory() as db:
+            for i in range(1, posts + 1):
+                post = models.Post(title=f"Post {i}", content="content", car_model="Model", user_id=1)
+                post.comments = [models.Comment(comment_text=f"Comment on {i}", user_id=2)]
+                db.add(post)
+            await db.commit()
+
+    asyncio.run(setup())
+    monkeypatch.setattr(post_cache, "POST_CACHE_ENABLED", False)
+    monkeypatch.setattr(post_cache, "AsyncSessionLocal", session_factory)
+    monkeypatch.setattr(main, "AsyncSessionLocal", session_factory)
+    return TestClient(main.app)
+
+def test_get_posts_first_page(monkeypatch, tmp_path):
+    response = posts_client(monkeypatch, tmp_path).get("/api/posts", params={"limit": 2})
+
+    assert response.status_code == 200
+    assert [post["id"] for post in response.json()] == [1, 2]
+    assert response.json()[0]["comments"][0]["comment_text"] == "Comment on 1"
+    assert response.headers["X-Next-Cursor"] == "2"
+
+def test_get_posts_follows_the_cursor_to_the_last_page(monkeypatch, tmp_path):
+    client = posts_client(monkeypatch, tmp_path)
+    pages, cursor = [], None
+    while True:
+        response = client.get("/api/posts", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append([post["id"] for post in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert pages == [[1, 2], [3, 4], [5]]
+
+def test_get_posts_rejects_an_invalid_cursor(monkeypatch, tmp_path):
+    response = posts_client(monkeypatch, tmp_path).get("/api/posts", params={"cursor": "not-a-number"})
+
+    assert response.status_code == 422
+
+def test_get_posts_streams_ndjson(monkeypatch, tmp_path):
+    response = posts_client(monkeypatch, tmp_path).get("/api/posts", params={"stream": "true", "cursor": 2})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert "X-Next-Cursor" not in response.headers
+    lines = response.text.splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [3, 4, 5]
+    assert json.loads(lines[0])["comments"][0]["comment_text"] == "Comment on 3"
+
+def test_get_post_answers_if_none_match_with_304(monkeypatch):
+    from fastapi.testclient import TestClient
+    import main, post_cache
+
+    async def get_post(post_id, comments_limit=None):
+        return '{"id": 1, "title": "Civic", "content": "content", "car_model": "Civic", "user_id": 1, "comments": []}'
+
+    monkeypatch.setattr(post_cache, "get_post", get_post)
+    client = TestClient(main.app)
+    first = client.get("/api/posts/1")
+    second = client.get("/api/posts/1", headers={"If-None-Match": f'W/{first.headers["ETag"]}'})
+    other = client.get("/api/posts/1", headers={"If-None-Match": '"something-else"'})
+
+    assert first.status_code == 200 and first.json()["title"] == "Civic"
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert other.status_code == 200
+
+@pytest.mark.parametrize("error, status, detail", [
+    (HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request"), 422,
+     "Idempotency-Key was already used for a different request"),
+    (OperationalError("INSERT INTO posts", {}, Exception("password=secret")), 500, "The post could not be saved"),
+])
+def test_create_post_keeps_http_errors_and_hides_db_errors(monkeypatch, error, status, detail):
+    from fastapi.testclient import TestClient
+    import main
+
+    async def create_post_async(db, post):
+        raise error
+
+    monkeypatch.setattr(crud, "create_post_async", create_post_async)
+    response = TestClient(main.app).post(
+        "/api/posts/", json={"title": "New", "content": "content", "car_model": "Model", "user_id": 1},
+    )
+
+    assert response.status_code == status
+    assert response.json() == {"detail": detail}
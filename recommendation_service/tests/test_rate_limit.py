@@ -0,0 +1,83 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import rate_limit
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_gcra_allows_burst_then_refills_at_rate():
+    clock = FakeClock()
+    limiter = rate_limit.MemoryLimiter(clock=clock)
+    limit = rate_limit.Limit(rate=2, burst=3)
+
+    burst = [limiter.check("client", limit) for _ in range(3)]
+    denied = limiter.check("client", limit)
+    clock.now += 0.5
+    refilled = limiter.check("client", limit)
+
+    assert [allowed for allowed, *_ in burst] == [True, True, True]
+    assert [remaining for _, remaining, *_ in burst] == [2, 1, 0]
+    assert denied[0] is False
+    assert denied[2] == 0.5
+    assert refilled[0] is True
+    # Other clients have their own bucket.
+    assert limiter.check("other", limit)[0] is True
+
+def test_full_limiter_evicts_least_recently_used_buckets():
+    clock = FakeClock()
+    limiter = rate_limit.MemoryLimiter(max_keys=3, clock=clock)
+    limit = rate_limit.Limit(rate=1, burst=1)
+
+    for key in ("a", "b", "c"):
+        limiter.check(key, limit)
+    clock.now += 0.5
+    # "a" is used again, so "b" is now the least recently used.
+    assert limiter.check("a", limit)[0] is False
+    limiter.check("d", limit)
+
+    assert limiter.check("a", limit)[0] is False
+    assert limiter.check("c", limit)[0] is False
+    assert limiter.check("b", limit)[0] is True
+
+def test_middleware_limits_per_client_and_route():
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        return {"id": item_id}
+
+    @app.post("/login")
+    def login():
+        return {}
+
+    app.add_middleware(
+        rate_limit.RateLimitMiddleware,
+        rules={"POST /login": rate_limit.Limit(rate=1, burst=1)},
+        default=rate_limit.Limit(rate=1, burst=2),
+        limiter=rate_limit.MemoryLimiter(),
+        enabled=True,
+    )
+    client = TestClient(app)
+
+    first = client.get("/items/1")
+    second = client.get("/items/2")
+    limited = client.get("/items/3")
+    # The login rule has its own bucket, untouched by the reads above.
+    login = client.post("/login")
+    login_limited = client.post("/login")
+
+    assert first.status_code == 200
+    assert first.headers["ratelimit-limit"] == "2"
+    assert first.headers["ratelimit-remaining"] == "1"
+    assert second.status_code == 200
+    assert limited.status_code == 429
+    assert limited.json() == {"detail": "Too many requests"}
+    assert int(limited.headers["retry-after"]) >= 1
+    assert login.status_code == 200
+    assert login_limited.status_code == 429
+    limited_count = rate_limit.decisions.labels("/items/{item_id}", "limited", "memory")._value.get()
+    assert limited_count >= 1
@@ -0,0 +1,104 @@
+import asyncio
+import contextlib
+import json
+import fakeredis
+import recommendations
+
+INTERACTIONS = [
+    (1, "Civic", 3.0), (1, "Golf", 1.0),
+    (2, "Civic", 3.0), (2, "Golf", 3.0), (2, "Corolla", 1.0),
+    (3, "Corolla", 3.0), (3, "Civic", 1.0),
+    (4, "Model 3", 3.0),
+]
+
+def test_batch_scores_unseen_models_by_similarity():
+    result = recommendations.compute(*zip(*INTERACTIONS), top_k=5)
+    users = list(result["users"])
+
+    assert [item["car_model"] for item in result["user_lists"][users.index(1)]] == ["Corolla"]
+    assert result["user_lists"][users.index(4)] == []
+    civic = list(result["car_models"]).index("Civic")
+    assert [item["car_model"] for item in result["model_lists"][civic]] == ["Golf", "Corolla"]
+
+def test_incremental_updates_match_a_full_rebuild():
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        for user_id, car_model, weight in INTERACTIONS:
+            await recommendations.record_interaction(user_id, car_model, weight, top_k=5, redis=redis)
+        incremental = {key: await redis.get(key) for key in await redis.keys(recommendations.model_key("*", "0"))}
+
+        await redis.flushall()
+        await recommendations.store(redis, recommendations.compute(*zip(*INTERACTIONS), top_k=5), "0")
+        rebuilt = {key: await redis.get(key) for key in await redis.keys(recommendations.model_key("*", "0"))}
+        return incremental, rebuilt, await recommendations.popular(2, redis)
+
+    incremental, rebuilt, popular = asyncio.run(scenario())
+
+    assert incremental.keys() == rebuilt.keys()
+    for key in rebuilt:
+        assert json.loads(incremental[key]) == json.loads(rebuilt[key])
+    assert popular == [{"car_model": "Civic", "score": 7.0}, {"car_model": "Golf", "score": 4.0}]
+
+def test_concurrent_interactions_of_one_user_match_a_full_rebuild():
+    interactions = [(1, car_model, weight) for _, car_model, weight in INTERACTIONS] * 3
+
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await asyncio.gather(*(
+            recommendations.record_interaction(user_id, car_model, weight, top_k=5, redis=redis)
+            for user_id, car_model, weight in interactions
+        ))
+        incremental = {key: await redis.hgetall(key) for key in await redis.keys(recommendations.cooc_key("*", "0"))}
+
+        await redis.flushall()
+        await recommendations.store(redis, recommendations.compute(*zip(*interactions), top_k=5), "0")
+        rebuilt = {key: await redis.hgetall(key) for key in await redis.keys(recommendations.cooc_key("*", "0"))}
+        return incremental, rebuilt
+
+    incremental, rebuilt = asyncio.run(scenario())
+
+    assert incremental.keys() == rebuilt.keys()
+    for key in rebuilt:
+        assert {model: float(count) for model, count in incremental[key].items()} == \
+            {model: float(count) for model, count in rebuilt[key].items()}
+
+def test_rebuild_replaces_the_live_version_and_keeps_interactions_made_meanwhile(monkeypatch):
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        monkeypatch.setattr(recommendations, "get_async_redis", lambda: redis)
+        monkeypatch.setattr(recommendations, "AsyncSessionLocal", contextlib.nullcontext)
+        for user_id, car_model, weight in INTERACTIONS:
+            await recommendations.record_interaction(user_id, car_model, weight, top_k=5, redis=redis)
+        # A user and a model whose posts have since been deleted.
+        await recommendations.record_interaction(9, "Deleted", 3.0, top_k=5, redis=redis)
+
+        # Another comment arrives while the database is being read.
+        async def load_interactions(db):
+            await recommendations.record_interaction(4, "Civic", 1.0, top_k=5, redis=redis)
+            return tuple(zip(*INTERACTIONS))
+
+        monkeypatch.setattr(recommendations, "load_interactions", load_interactions)
+        await recommendations.rebuild(top_k=5)
+
+        expected = fakeredis.FakeAsyncRedis(decode_responses=True)
+        for user_id, car_model, weight in INTERACTIONS + [(4, "Civic", 1.0)]:
+            await recommendations.record_interaction(user_id, car_model, weight, top_k=5, redis=expected)
+        version = await recommendations.live_version(redis)
+        return (
+            version,
+            sorted(await redis.keys("{rec}:*:*")),
+            await redis.hgetall(recommendations.cooc_key("Civic", version)),
+            await expected.hgetall(recommendations.cooc_key("Civic", "0")),
+            await recommendations.for_user(9),
+            await redis.exists(recommendations.BUILDING),
+        )
+
+    version, keys, cooc, expected_cooc, deleted_user, building = asyncio.run(scenario())
+
+    assert version == "1"
+    assert all(key.startswith("{rec}:1:") for key in keys)
+    assert not any("Deleted" in key or key.endswith(":9") for key in keys)
+    assert {model: float(count) for model, count in cooc.items()} == \
+        {model: float(count) for model, count in expected_cooc.items()}
+    assert "Deleted" not in deleted_user
+    assert not building
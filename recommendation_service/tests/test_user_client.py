@@ -0,0 +1,40 @@
+import asyncio
+import grpc
+import user_pb2
+import user_pb2_grpc
+from user_client import UserClient
+
+class RecordingServicer(user_pb2_grpc.UserServiceServicer):
+    def __init__(self):
+        self.batches = []
+
+    async def BatchGetUsers(self, request, context):
+        self.batches.append(sorted(request.user_ids))
+        return user_pb2.BatchGetUsersResponse(
+            users=[user_pb2.User(id=user_id, name=f"User {user_id}") for user_id in request.user_ids if user_id < 100],
+            missing_ids=[user_id for user_id in request.user_ids if user_id >= 100],
+        )
+
+def test_concurrent_lookups_share_one_batch():
+    async def scenario():
+        servicer = RecordingServicer()
+        server = grpc.aio.server()
+        user_pb2_grpc.add_UserServiceServicer_to_server(servicer, server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+
+        client = UserClient(target=f"127.0.0.1:{port}", channels=2, window=0.01)
+        try:
+            results = await asyncio.gather(
+                client.get_users([1, 2]), client.get_users([2, 3]), client.get_users([3, 100]),
+            )
+        finally:
+            await client.close()
+            await server.stop(None)
+        return servicer.batches, results
+
+    batches, results = asyncio.run(scenario())
+
+    assert batches == [[1, 2, 3, 100]]
+    assert [sorted(users) for users in results] == [[1, 2], [2, 3], [3]]
+    assert results[0][1].name == "User 1"
@@ -0,0 +1,121 @@
+import asyncio
+import pytest
+from websocket_manager import WebSocketManager
+
+class FakeSocket:
+    def __init__(self, blocked=False, broken=False):
+        self.sent = []
+        self.closed_with = None
+        self.broken = broken
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.broken:
+            raise RuntimeError("connection reset")
+        await self.unblocked.wait()
+        self.sent.append(message)
+
+    async def close(self, code: int):
+        self.closed_with = code
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+def test_slow_client_does_not_delay_others():
+    async def scenario():
+        manager = WebSocketManager(queue_size=10)
+        slow, fast = FakeSocket(blocked=True), FakeSocket()
+        await manager.connect(slow)
+        await manager.connect(fast)
+
+        manager.broadcast("a")
+        manager.broadcast("b")
+        await settle()
+        return slow.sent, fast.sent
+
+    slow_sent, fast_sent = run(scenario)
+
+    assert slow_sent == []
+    assert fast_sent == ["a", "b"]
+
+@pytest.mark.parametrize("policy, expected", [
+    ("drop_oldest", ["1", "3", "4"]),
+    ("coalesce", ["1", "2\n3\n4"]),
+])
+def test_full_queue_policy(policy, expected):
+    async def scenario():
+        manager = WebSocketManager(queue_size=2, policy=policy)
+        socket = FakeSocket(blocked=True)
+        await manager.connect(socket)
+
+        manager.broadcast("1")
+        await settle()  # the writer picks up "1" and blocks sending it
+        for message in ("2", "3", "4"):
+            manager.broadcast(message)
+        socket.unblocked.set()
+        await settle()
+        return socket.sent
+
+    assert run(scenario) == expected
+
+def test_disconnect_policy_closes_slow_client():
+    async def scenario():
+        manager = WebSocketManager(queue_size=1, policy="disconnect")
+        socket = FakeSocket(blocked=True)
+        await manager.connect(socket)
+
+        for message in ("1", "2", "3"):
+            manager.broadcast(message)
+        await settle()
+        return socket.closed_with, manager.active_connections[socket].closed
+
+    assert run(scenario) == (1008, True)
+
+def test_failed_send_drops_connection():
+    async def scenario():
+        manager = WebSocketManager()
+        broken, healthy = FakeSocket(broken=True), FakeSocket()
+        await manager.connect(broken)
+        await manager.connect(healthy)
+
+        manager.broadcast("hello")
+        await settle()
+        manager.broadcast("again")
+        await settle()
+        return manager.active_connections[broken], healthy.sent
+
+    broken_connection, healthy_sent = run(scenario)
+
+    assert broken_connection.closed
+    assert not broken_connection.pending
+    assert healthy_sent == ["hello", "again"]
+
+def test_broadcast_to_room_reaches_only_its_members():
+    async def scenario():
+        manager = WebSocketManager()
+        in_room, outside = FakeSocket(), FakeSocket()
+        await manager.connect(in_room)
+        await manager.connect(outside)
+        opened = manager.join(in_room, "post:1")
+
+        manager.broadcast("comment", room="post:1")
+        await settle()
+        closed = manager.disconnect(in_room)
+        return opened, in_room.sent, outside.sent, closed, manager.rooms
+
+    opened, in_room_sent, outside_sent, closed, rooms = run(scenario)
+
+    assert opened
+    assert in_room_sent == ["comment"]
+    assert outside_sent == []
+    assert closed == ["post:1"]
+    assert rooms == {}
@@ -0,0 +1,33 @@
+import asyncio
+import workers
+
+def test_only_one_worker_leads_and_another_takes_over_when_it_stops(tmp_path):
+    started = []
+
+    def leader(name):
+        leader = workers.Leader("recommendation-service", lock_dir=str(tmp_path), retry_interval=0.01)
+
+        async def job():
+            started.append(name)
+            await asyncio.Event().wait()
+
+        leader.run(job)
+        return leader
+
+    async def scenario():
+        first, second = leader("first"), leader("second")
+        first.start()
+        await asyncio.sleep(0.05)
+        second.start()
+        await asyncio.sleep(0.05)
+        both_running = (first.is_leader, second.is_leader, list(started))
+        await first.stop()
+        await asyncio.sleep(0.05)
+        after_handover = (first.is_leader, second.is_leader, list(started))
+        await second.stop()
+        return both_running, after_handover
+
+    both_running, after_handover = asyncio.run(scenario())
+
+    assert both_running == (True, False, ["first"])
+    assert after_handover == (False, True, ["first", "second"])
@@ -0,0 +1,129 @@
+import asyncio
+import itertools
+import os
+import grpc
+import user_pb2
+import user_pb2_grpc
+
+# Client for the user service's gRPC API. Lookups made at about the same time
+# (e.g. by concurrent requests enriching posts) are coalesced: IDs queue up
+# for USER_BATCH_WINDOW seconds, or until USER_MAX_BATCH are waiting, and go
+# out as one BatchGetUsers call. An ID already queued or in flight shares
+# that call's result. Calls are spread over a small pool of channels, each
+# balancing round robin over every address the target resolves to.
+USER_SERVICE_GRPC = os.environ.get("USER_SERVICE_GRPC", "dns:///user_service:50051")
+USER_GRPC_CHANNELS = int(os.environ.get("USER_GRPC_CHANNELS", "4"))
+USER_GRPC_TIMEOUT = float(os.environ.get("USER_GRPC_TIMEOUT", "1.0"))
+USER_BATCH_WINDOW = float(os.environ.get("USER_BATCH_WINDOW", "0.002"))
+USER_MAX_BATCH = int(os.environ.get("USER_MAX_BATCH", "500"))
+
+CHANNEL_OPTIONS = [
+    ("grpc.lb_policy_name", "round_robin"),
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_permit_without_calls", 1),
+]
+
+class UserClient:
+    def __init__(self, target: str = USER_SERVICE_GRPC, channels: int = USER_GRPC_CHANNELS,
+                 timeout: float = USER_GRPC_TIMEOUT, window: float = USER_BATCH_WINDOW,
+                 max_batch: int = USER_MAX_BATCH):
+        self.target = target
+        self.channel_count = channels
+        self.timeout = timeout
+        self.window = window
+        self.max_batch = max_batch
+        self._channels = []
+        self._stubs = None
+        # user_id -> future, for IDs queued or in flight
+        self._futures = {}
+        self._queued = []
+        self._flush_handle = None
+
+    # Channels are created on first use, on the loop that uses them.
+    def _stub(self):
+        if self._stubs is None:
+            self._channels = [
+                grpc.aio.insecure_channel(self.target, options=CHANNEL_OPTIONS)
+                for _ in range(self.channel_count)
+            ]
+            self._stubs = itertools.cycle([user_pb2_grpc.UserServiceStub(channel) for channel in self._channels])
+        return next(self._stubs)
+
+    # Returns {user_id: user_pb2.User} for the IDs that exist. Raises
+    # grpc.aio.AioRpcError if the user service can't be reached.
+    async def get_users(self, user_ids):
+        user_ids = set(user_ids)
+        if not user_ids:
+            return {}
+        futures = {user_id: self._future_for(user_id) for user_id in user_ids}
+        # shield: the futures are shared, a cancelled caller mustn't cancel
+        # them for the others
+        results = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return {user_id: user for user_id, user in zip(futures, results) if user is not None}
+
+    async def get_user(self, user_id: int):
+        return (await self.get_users([user_id])).get(user_id)
+
+    # Streams users for an unbounded number of IDs, without coalescing.
+    async def stream_users(self, user_ids):
+        request = user_pb2.BatchGetUsersRequest(user_ids=list(user_ids))
+        async for user in self._stub().StreamUsers(request):
+            yield user
+
+    def _future_for(self, user_id: int):
+        future = self._futures.get(user_id)
+        if future is not None:
+            return future
+        future = asyncio.get_running_loop().create_future()
+        self._futures[user_id] = future
+        self._queued.append(user_id)
+        if len(self._queued) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._queued = self._queued, []
+        if batch:
+            asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch):
+        try:
+            request = user_pb2.BatchGetUsersRequest(user_ids=batch)
+            response = await self._stub().BatchGetUsers(request, timeout=self.timeout)
+            found = {user.id: user for user in response.users}
+            for user_id in batch:
+                self._resolve(user_id, result=found.get(user_id))
+        except Exception as e:
+            for user_id in batch:
+                self._resolve(user_id, error=e)
+
+    def _resolve(self, user_id: int, result=None, error=None):
+        future = self._futures.pop(user_id, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    # One empty batch call, for health checks.
+    async def ping(self):
+        await self._stub().BatchGetUsers(user_pb2.BatchGetUsersRequest(), timeout=self.timeout)
+
+    async def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await asyncio.gather(*(channel.close() for channel in self._channels))
+        self._channels = []
+        self._stubs = None
+
+user_client = UserClient()
@@ -1,26 +1,163 @@
-import redis
+import asyncio
+import os
+import time
+import weakref
+from collections import deque
 from fastapi import WebSocket
-from typing import List
+from prometheus_client import Counter, Gauge, Histogram
+import instrumentation
 
-redis_client = redis.Redis(host="redis-cluster-init-node", port=6379, decode_responses=True)
+# Every connection gets its own bounded send queue and writer task, so a slow
+# or dead client only affects itself. When a client's queue is full the
+# policy decides what happens to the new message:
+#   drop_oldest - drop the oldest queued message
+#   coalesce    - merge everything queued plus the new message into one frame
+#   disconnect  - close the slow client
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "100"))
+WS_SLOW_CONSUMER_POLICY = os.environ.get("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+_managers = weakref.WeakSet()
+
+# Queue depth is summed periodically rather than tracked per message.
+send_queue_depth = Gauge("ws_send_queue_depth", "Messages waiting in WebSocket send queues", multiprocess_mode="livesum")
+instrumentation.sample_gauge(send_queue_depth, lambda: sum(manager.queue_depth() for manager in list(_managers)))
+dropped_messages = Counter("ws_dropped_messages", "Messages dropped or merged for slow WebSocket clients", ["policy"])
+fanout_latency = Histogram(
+    "ws_fanout_latency_seconds",
+    "Time from broadcast until a client's writer has sent everything queued at wake-up, oldest message first",
+)
+
+class Connection:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.pending = deque()
+        self.ready = asyncio.Event()
+        self.writer = None
+        self.rooms = set()
+        self.closed = False
 
 class WebSocketManager:
-    def __init__(self):
-        self.active_connections = []
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {policy!r}, expected one of {SLOW_CONSUMER_POLICIES}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.active_connections = {}
+        # room -> connections that joined it
+        self.rooms = {}
+        _managers.add(self)
+
+    def queue_depth(self):
+        return sum(len(connection.pending) for connection in self.active_connections.values())
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = Connection(websocket)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self.active_connections[websocket] = connection
+        instrumentation.ws_opened()
+
+    # Returns the rooms that no local connection listens to any more.
+    def disconnect(self, websocket: WebSocket):
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return []
+        instrumentation.ws_closed()
+        self._drop(connection)
+        return [room for room in list(connection.rooms) if self._leave(connection, room)]
+
+    # Both return True when the room gained its first or lost its last local
+    # listener, i.e. when the replica needs to (un)subscribe it.
+    def join(self, websocket: WebSocket, room: str):
+        connection = self.active_connections.get(websocket)
+        if connection is None or room in connection.rooms:
+            return False
+        connection.rooms.add(room)
+        listeners = self.rooms.setdefault(room, set())
+        listeners.add(connection)
+        return len(listeners) == 1
+
+    def leave(self, websocket: WebSocket, room: str):
+        connection = self.active_connections.get(websocket)
+        if connection is None or room not in connection.rooms:
+            return False
+        return self._leave(connection, room)
+
+    def _leave(self, connection: Connection, room: str):
+        connection.rooms.discard(room)
+        listeners = self.rooms.get(room)
+        if listeners is None:
+            return False
+        listeners.discard(connection)
+        if listeners:
+            return False
+        del self.rooms[room]
+        return True
+
+    # Queues the message for every client in the room (every client if no
+    # room is given), except those also in one of skip_rooms, and returns
+    # straight away; the writer tasks do the sending.
+    def broadcast(self, message: str, room: str = None, skip_rooms=()):
+        enqueued_at = time.perf_counter()
+        connections = self.active_connections.values() if room is None else self.rooms.get(room, ())
+        for connection in list(connections):
+            if connection.closed or (skip_rooms and not connection.rooms.isdisjoint(skip_rooms)):
+                continue
+            if len(connection.pending) < self.queue_size:
+                connection.pending.append((message, enqueued_at))
+            elif not self._handle_full(connection, message, enqueued_at):
+                continue
+            connection.ready.set()
 
-    async def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    # Returns False if the client was dropped.
+    def _handle_full(self, connection: Connection, message: str, enqueued_at: float):
+        dropped_messages.labels(self.policy).inc()
+        if self.policy == "drop_oldest":
+            connection.pending.popleft()
+            connection.pending.append((message, enqueued_at))
+            return True
+        if self.policy == "coalesce":
+            merged = "\n".join([queued for queued, _ in connection.pending] + [message])
+            oldest = connection.pending[0][1]
+            connection.pending.clear()
+            connection.pending.append((merged, oldest))
+            return True
+        asyncio.create_task(self._close(connection.websocket))
+        self._drop(connection)
+        return False
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    # Stops sending to a connection. It stays registered (and its rooms stay
+    # subscribed) until the endpoint sees the socket close and calls
+    # disconnect().
+    def _drop(self, connection: Connection):
+        connection.closed = True
+        connection.pending.clear()
+        if connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
 
+    async def _write(self, connection: Connection):
+        try:
+            while True:
+                await connection.ready.wait()
+                connection.ready.clear()
+                oldest = connection.pending[0][1] if connection.pending else None
+                while connection.pending:
+                    message, _ = connection.pending.popleft()
+                    await connection.websocket.send_text(message)
+                    instrumentation.ws_sent()
+                if oldest is not None:
+                    fanout_latency.observe(time.perf_counter() - oldest)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Dropping WebSocket connection after send failure: {e}")
+            self._drop(connection)
 
-    def publish_to_redis(self, channel: str, message: str):
-        redis_client.publish(channel, message)
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1008)
+        except Exception:
+            pass
 
 ws_manager = WebSocketManager()
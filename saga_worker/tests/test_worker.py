@@ -0,0 +1,74 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+import httpx
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+import worker
+from http_client import HttpClient
+
+def test_recover_compensates_stale_sagas_only():
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        await worker.ensure_schema(engine)
+        old = datetime.utcnow() - timedelta(minutes=5)
+        async with engine.begin() as conn:
+            await conn.execute(insert(worker.saga_transactions), [
+                # Gateway died after creating both.
+                {"saga_id": str(uuid.uuid4()), "status": "Started", "user_id": 1, "post_id": 10, "attempts": 0, "updated_at": old},
+                # Rollback failed half way; the post is already gone.
+                {"saga_id": str(uuid.uuid4()), "status": "Compensating", "user_id": 2, "post_id": 20, "attempts": 1, "updated_at": old},
+                # Still running.
+                {"saga_id": str(uuid.uuid4()), "status": "Started", "user_id": 3, "post_id": None, "attempts": 0, "updated_at": datetime.utcnow()},
+                {"saga_id": str(uuid.uuid4()), "status": "Completed", "user_id": 4, "post_id": 40, "attempts": 0, "updated_at": old},
+            ])
+
+        deleted = []
+
+        def handler(request):
+            deleted.append(request.url.path)
+            return httpx.Response(404 if request.url.path.endswith("/20") else 200, json={})
+
+        client = HttpClient(transport=httpx.MockTransport(handler))
+        recovered = await worker.recover(engine, client, stale_after=60, batch_size=1, concurrency=2)
+        await client.close()
+
+        async with engine.connect() as conn:
+            rows = (await conn.execute(
+                select(worker.saga_transactions.c.user_id, worker.saga_transactions.c.status, worker.saga_transactions.c.attempts)
+                .order_by(worker.saga_transactions.c.id)
+            )).all()
+        await engine.dispose()
+        return recovered, sorted(deleted), [tuple(row) for row in rows]
+
+    recovered, deleted, rows = asyncio.run(scenario())
+
+    assert recovered == 2
+    assert deleted == ["/api/posts/10", "/api/posts/20", "/api/users/1", "/api/users/2"]
+    assert rows == [(1, "Failed", 1), (2, "Failed", 2), (3, "Started", 0), (4, "Completed", 0)]
+
+def test_recover_leaves_saga_for_retry_when_a_service_is_down():
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        await worker.ensure_schema(engine)
+        async with engine.begin() as conn:
+            await conn.execute(insert(worker.saga_transactions), [{
+                "saga_id": str(uuid.uuid4()), "status": "Started", "user_id": 1, "post_id": None,
+                "attempts": 0, "updated_at": datetime.utcnow() - timedelta(minutes=5),
+            }])
+
+        def handler(request):
+            raise httpx.ConnectError("user service down")
+
+        client = HttpClient(retries=0, transport=httpx.MockTransport(handler))
+        recovered = await worker.recover(engine, client, stale_after=60)
+        # Just claimed, so not stale again yet.
+        again = await worker.recover(engine, client, stale_after=60)
+        await client.close()
+
+        async with engine.connect() as conn:
+            status = await conn.scalar(select(worker.saga_transactions.c.status))
+        await engine.dispose()
+        return recovered, again, status
+
+    assert asyncio.run(scenario()) == (0, 0, "Compensating")
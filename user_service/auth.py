@@ -1,12 +1,13 @@
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 import models
 from database import SessionLocal, engine
 import schemas
+import hashing
+import token_cache
 
 SECRET_KEY = "your-secret-key"
 ALGORITHM = "HS256"
@@ -14,8 +15,6 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/users/login")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -24,7 +23,7 @@ def create_access_token(data: dict):
 
 def authenticate_user(db: Session, email: str, password: str):
     user = models.get_user_by_email(db, email)
-    if not user or not pwd_context.verify(password, user.hashed_password):
+    if not user or not hashing.verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -36,6 +35,10 @@ def get_db():
         db.close()
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -48,7 +51,10 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    generation = token_cache.generation()
     user = models.get_user_by_email(db, email=email)
     if user is None:
         raise credentials_exception
+    user = schemas.User.model_validate(user)
+    token_cache.put(token, user, payload["exp"], generation)
     return user
\ No newline at end of file
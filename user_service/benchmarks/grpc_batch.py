@@ -0,0 +1,96 @@
+# Compares looking up a batch of users with one BatchGetUsers call against
+# one REST GET /api/users/{id} per user (sent concurrently). Both servers run
+# in this process on loopback, so the numbers cover HTTP/gRPC framing,
+# serialization and the database but not the network.
+#
+# Needs a reachable database (DATABASE_URL). Run from user_service/:
+#   python -m benchmarks.grpc_batch --users 1000 --batch-sizes 10,50,200
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import grpc
+import httpx
+import uvicorn
+
+import grpc_server, models, user_pb2, user_pb2_grpc
+from database import SessionLocal, engine
+from main import app
+
+REST_PORT = 18000
+GRPC_PORT = 15051
+
+
+def seed(count: int):
+    db = SessionLocal()
+    try:
+        existing = db.query(models.User).count()
+        db.add_all([
+            models.User(name=f"User {i}", email=f"bench{i}@example.com", hashed_password="x")
+            for i in range(existing, count)
+        ])
+        db.commit()
+        return [user_id for (user_id,) in db.query(models.User.id).limit(count)]
+    finally:
+        db.close()
+
+
+def percentiles(latencies):
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+async def measure(user_ids, batch_size: int, rounds: int, stub, http):
+    rest, batched = [], []
+    for _ in range(rounds):
+        batch = random.sample(user_ids, batch_size)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(http.get(f"/api/users/{user_id}") for user_id in batch))
+        rest.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await stub.BatchGetUsers(user_pb2.BatchGetUsersRequest(user_ids=batch))
+        batched.append(time.perf_counter() - start)
+    return percentiles(rest), percentiles(batched)
+
+
+async def compare(args):
+    user_ids = seed(args.users)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=REST_PORT, lifespan="off", log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    await grpc_server.start(GRPC_PORT)
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    limits = httpx.Limits(max_connections=args.connections)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{REST_PORT}", limits=limits) as http, \
+                grpc.aio.insecure_channel(f"127.0.0.1:{GRPC_PORT}") as channel:
+            stub = user_pb2_grpc.UserServiceStub(channel)
+            for batch_size in args.batch_sizes:
+                (rest_p50, rest_p99), (grpc_p50, grpc_p99) = await measure(user_ids, batch_size, args.rounds, stub, http)
+                print(f"{batch_size:>5} users: REST p50 {rest_p50 * 1000:.2f}ms p99 {rest_p99 * 1000:.2f}ms  "
+                      f"| gRPC batch p50 {grpc_p50 * 1000:.2f}ms p99 {grpc_p99 * 1000:.2f}ms")
+    finally:
+        await grpc_server.stop(0)
+        server.should_exit = True
+        await serving
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--batch-sizes", type=lambda value: [int(size) for size in value.split(",")], default=[10, 50, 200])
+    parser.add_argument("--connections", type=int, default=50)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    asyncio.run(compare(args))
+
+
+if __name__ == "__main__":
+    main()
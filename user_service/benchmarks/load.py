@@ -0,0 +1,101 @@
+# Load test for the user service: runs the app in this process (on SQLite
+# and fakeredis unless told otherwise) and drives a register/login/me mix
+# from --concurrency virtual users for --duration seconds. Rate limiting is
+# off unless RATE_LIMIT_ENABLED is set, since it would only measure the 429s.
+#
+# Run from user_service/:
+#   python -m benchmarks.load --scenario auth --concurrency 20 --duration 10 \
+#       --output results.json --baseline benchmarks/baselines/auth.json
+# With --postgres it starts a throwaway Postgres container (needs docker).
+# Exits with 1 if any metric regressed against the baseline by more than
+# --threshold.
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import uuid
+
+import httpx
+
+from benchmarks import loadgen
+
+PASSWORD = "benchmark-password"
+
+_emails = itertools.count()
+_run = uuid.uuid4().hex[:8]
+
+
+def new_user():
+    number = next(_emails)
+    return {"name": f"Load {number}", "email": f"load-{_run}-{number}@example.com", "password": PASSWORD}
+
+
+async def register(client, user):
+    response = await client.post("/api/users/register", json=user)
+    response.raise_for_status()
+    return response.json()
+
+
+async def login(client, user):
+    response = await client.post("/api/users/login", json={"email": user["email"], "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+def auth_scenario(client):
+    # Each virtual user signs up once and then mostly reads its profile,
+    # logging in again now and then; a few new signups keep arriving.
+    async def setup(index):
+        user = new_user()
+        await register(client, user)
+        return {"user": user, "headers": {"Authorization": f"Bearer {await login(client, user)}"}}
+
+    async def me(state):
+        response = await client.get("/api/users/me", headers=state["headers"])
+        response.raise_for_status()
+
+    async def relogin(state):
+        state["headers"] = {"Authorization": f"Bearer {await login(client, state['user'])}"}
+
+    async def signup(state):
+        await register(client, new_user())
+
+    return setup, [loadgen.Step("me", 6, me), loadgen.Step("login", 3, relogin), loadgen.Step("register", 1, signup)]
+
+
+SCENARIOS = {"auth": auth_scenario}
+
+
+async def run(args):
+    import hashing
+    from alembic import command
+    from alembic.config import Config
+    from main import app
+
+    command.upgrade(Config("alembic.ini"), "head")
+    if not args.redis_cluster:
+        loadgen.use_fakeredis()
+    try:
+        async with loadgen.serve(app) as url:
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+                setup, steps = SCENARIOS[args.scenario](client)
+                return await loadgen.drive(steps, setup, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        hashing.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    loadgen.add_arguments(parser, SCENARIOS)
+    args = parser.parse_args()
+
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    with loadgen.database(args, "userdb"):
+        results = asyncio.run(run(args))
+    sys.exit(loadgen.report(loadgen.describe("user_service", args, results), args))
+
+
+if __name__ == "__main__":
+    main()
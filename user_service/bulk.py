@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import json
+import sys
+from fastapi import HTTPException
+from sqlalchemy import Column, Integer, MetaData, String, Table, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+import hashing
+import models, schemas
+from bulk_io import FORMATS, MEDIA_TYPES, copy_records, export_rows, file_chunks, import_rows, parser_for, require_bulk_token, write_to_stdout
+from database import async_engine
+
+# Bulk import and export of users, on top of the shared parsing, validation
+# and COPY plumbing in bulk_io. Each chunk is copied into a staging table.
+USER_COLUMNS = ["name", "email", "hashed_password"]
+USER_EXPORT_COLUMNS = ["id", "name", "email"]
+
+# Imported users are copied here first and moved into users with ON CONFLICT
+# DO NOTHING, so an email registered while the chunk was being prepared
+# skips that row instead of failing the whole chunk.
+users_import = Table(
+    "users_import",
+    MetaData(),
+    Column("line", Integer),
+    Column("name", String),
+    Column("email", String),
+    Column("hashed_password", String),
+    prefixes=["TEMPORARY"],
+)
+
+# Rows with a plain password are hashed in the bcrypt pool, a few at a time
+# so interactive logins still get workers; rows that already carry a bcrypt
+# hash (e.g. from an export) go straight in.
+async def _hash_passwords(valid):
+    slots = asyncio.Semaphore(hashing.HASH_POOL_WORKERS)
+    errors = []
+
+    async def hash_one(line, user):
+        if user.hashed_password is not None:
+            return user.hashed_password
+        async with slots:
+            try:
+                return await hashing.hash_password_async(user.password)
+            except HTTPException as e:
+                errors.append((line, e.detail))
+
+    hashes = await asyncio.gather(*(hash_one(line, user) for line, user in valid))
+    return hashes, errors
+
+def _insert_staged_users(dialect):
+    staged = users_import.c
+    # SQLite needs a WHERE to tell the upsert's ON from a join's.
+    query = select(staged.name, staged.email, staged.hashed_password).where(true()).order_by(staged.line)
+    return (
+        dialect.insert(models.User)
+        .from_select(USER_COLUMNS, query)
+        .on_conflict_do_nothing(index_elements=["email"])
+        .returning(models.User.email)
+    )
+
+# Runs once per chunk. Later duplicates in the chunk and emails already
+# registered are reported instead of inserted; taken emails are left out
+# before hashing to save the work, and the insert still skips any that get
+# registered before it runs.
+async def _prepare_users(valid):
+    seen, unique, errors = set(), [], []
+    for line, user in valid:
+        if user.email in seen:
+            errors.append((line, "Duplicate email in import"))
+        else:
+            seen.add(user.email)
+            unique.append((line, user))
+    async with async_engine.connect() as conn:
+        existing = set(await conn.scalars(select(models.User.email).where(models.User.email.in_(seen))))
+    new = []
+    for line, user in unique:
+        if user.email in existing:
+            errors.append((line, "Email already registered"))
+        else:
+            new.append((line, user))
+    hashes, hash_errors = await _hash_passwords(new)
+    errors += hash_errors
+    prepared = [(line, (user.name, user.email, hashed)) for (line, user), hashed in zip(new, hashes) if hashed is not None]
+    return prepared, errors
+
+async def _write_users(prepared):
+    records = [(line, *user) for line, user in prepared]
+    async with async_engine.begin() as conn:
+        await conn.run_sync(users_import.drop, checkfirst=True)
+        await conn.run_sync(users_import.create)
+        await copy_records(conn, users_import, ["line"] + USER_COLUMNS, records)
+        dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+        inserted = set(await conn.scalars(_insert_staged_users(dialect)))
+        await conn.run_sync(users_import.drop)
+    errors = [(line, "Email already registered") for line, _, email, _ in records if email not in inserted]
+    return len(inserted), errors
+
+async def import_users(chunks, format: str = "ndjson"):
+    return await import_rows(parser_for(format)(chunks), schemas.UserImport, _write_users, prepare=_prepare_users)
+
+# Password hashes are only exported from the CLI, for moving users between
+# databases.
+def export_users(format: str = "ndjson", include_password_hashes: bool = False):
+    columns = USER_EXPORT_COLUMNS + (["hashed_password"] if include_password_hashes else [])
+    query = select(*(getattr(models.User, column) for column in columns)).order_by(models.User.id)
+    return export_rows(async_engine, query, columns, format)
+
+# CLI: python -m bulk import users.ndjson / python -m bulk export --format csv > users.csv
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import or export users.")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", nargs="?", default="-", help="file to import, - for stdin")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--include-password-hashes", action="store_true", help="export hashed_password too")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        asyncio.run(write_to_stdout(export_users(args.format, args.include_password_hashes)))
+        return
+    report = asyncio.run(import_users(file_chunks(args.path), args.format))
+    hashing.shutdown()
+    print(json.dumps(report, indent=2), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
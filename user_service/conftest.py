@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Modules shared by the services live in ../common, which the Dockerfiles copy
+# next to the service's own. Here the tests, and the processes they start,
+# find them on the path instead.
+COMMON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")
+sys.path.insert(1, COMMON_DIR)
+os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [COMMON_DIR, os.environ.get("PYTHONPATH")]))
@@ -3,7 +3,36 @@
 if [ "$RUN_TESTS" = "1" ]; then
     echo "Running tests..."
     pytest tests/
-else
-    echo "Starting user service..."
-    uvicorn main:app --host 0.0.0.0 --port 8000
+    exit $?
 fi
+
+# The schema comes from the migrations; replicas starting together wait on
+# an advisory lock (see migrations/env.py).
+alembic upgrade head || exit 1
+
+# One worker per CPU unless WEB_CONCURRENCY says otherwise. With more than
+# one, the gRPC server runs as its own group of processes (one per worker by
+# default) sharing port 50051, bcrypt gets one hashing process per worker,
+# and the workers share their Prometheus metrics through a directory.
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-$(nproc)}"
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    export GRPC_PROCESSES="${GRPC_PROCESSES:-$WEB_CONCURRENCY}"
+    export HASH_POOL_WORKERS="${HASH_POOL_WORKERS:-1}"
+    export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+fi
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+echo "Starting user service with $WEB_CONCURRENCY worker(s)..."
+if [ "${GRPC_PROCESSES:-0}" -gt 0 ]; then
+    python grpc_server.py &
+    grpc_pid=$!
+fi
+uvicorn main:app --host 0.0.0.0 --port 8000 --workers "$WEB_CONCURRENCY" &
+web_pid=$!
+
+trap 'kill -TERM $web_pid $grpc_pid 2>/dev/null' TERM INT
+wait $web_pid
+kill -TERM $grpc_pid 2>/dev/null
+wait
@@ -0,0 +1,120 @@
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import grpc
+import models
+import user_pb2
+import user_pb2_grpc
+from database import AsyncSessionLocal
+
+GRPC_PORT = int(os.environ.get("GRPC_PORT", "50051"))
+# Larger requests are rejected; StreamUsers takes any number of IDs.
+GRPC_MAX_BATCH = int(os.environ.get("GRPC_MAX_BATCH", "1000"))
+GRPC_STREAM_BATCH_SIZE = int(os.environ.get("GRPC_STREAM_BATCH_SIZE", "1000"))
+# 0 runs the server on the app's event loop, in its one worker. Otherwise
+# `python grpc_server.py` runs this many server processes sharing the port
+# through SO_REUSEPORT, and the app's workers don't start one; see
+# entrypoint.sh.
+GRPC_PROCESSES = int(os.environ.get("GRPC_PROCESSES", "0"))
+
+def to_message(user: models.User):
+    return user_pb2.User(id=user.id, name=user.name or "", email=user.email or "")
+
+# Served by grpc.aio on the app's event loop, reading through the async
+# session, so lookups don't tie up threads.
+class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
+    async def GetUserStatus(self, request, context):
+        if not request.user_id.isdigit():
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "user_id must be numeric")
+        async with AsyncSessionLocal() as db:
+            user = await models.get_user_by_id_async(db, int(request.user_id))
+        return user_pb2.UserResponse(status="active" if user else "inactive")
+
+    async def BatchGetUsers(self, request, context):
+        user_ids = set(request.user_ids)
+        if len(user_ids) > GRPC_MAX_BATCH:
+            await context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT,
+                f"At most {GRPC_MAX_BATCH} IDs per batch, use StreamUsers for more",
+            )
+        if not user_ids:
+            return user_pb2.BatchGetUsersResponse()
+        async with AsyncSessionLocal() as db:
+            users = await models.get_users_by_ids_async(db, user_ids)
+        found = {user.id for user in users}
+        return user_pb2.BatchGetUsersResponse(
+            users=[to_message(user) for user in users],
+            missing_ids=sorted(user_ids - found),
+        )
+
+    async def StreamUsers(self, request, context):
+        user_ids = set(request.user_ids)
+        if not user_ids:
+            return
+        async with AsyncSessionLocal() as db:
+            async for user in models.stream_users_by_ids_async(db, user_ids, batch_size=GRPC_STREAM_BATCH_SIZE):
+                yield to_message(user)
+
+server = None
+
+# Without reuse_port a second server on the same port fails to bind instead
+# of silently sharing it.
+async def start(port: int = GRPC_PORT, reuse_port: bool = False):
+    global server
+    server = grpc.aio.server(options=[("grpc.so_reuseport", int(reuse_port))])
+    user_pb2_grpc.add_UserServiceServicer_to_server(UserServiceServicer(), server)
+    server.add_insecure_port(f"[::]:{port}")
+    await server.start()
+    print(f"gRPC server for User Service is running on port {port}")
+
+async def stop(grace: float = 5):
+    global server
+    if server is not None:
+        await server.stop(grace)
+        server = None
+
+async def serve(port: int = GRPC_PORT):
+    await start(port, reuse_port=True)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    await stopping.wait()
+    await stop()
+
+def _serve_process(port: int):
+    asyncio.run(serve(port))
+
+# Runs the server in GRPC_PROCESSES processes (at least one) and restarts any
+# that die. SIGTERM or SIGINT stops them all gracefully.
+def main(processes: int = GRPC_PROCESSES, port: int = GRPC_PORT):
+    context = multiprocessing.get_context("spawn")
+    stopping = False
+
+    def spawn():
+        process = context.Process(target=_serve_process, args=(port,))
+        process.start()
+        return process
+
+    running = [spawn() for _ in range(max(processes, 1))]
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in running:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    while running:
+        multiprocessing.connection.wait([process.sentinel for process in running])
+        for process in [process for process in running if not process.is_alive()]:
+            running.remove(process)
+            if not stopping:
+                print(f"gRPC server process {process.pid} exited with {process.exitcode}, restarting")
+                running.append(spawn())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from prometheus_client import Histogram
+
+# bcrypt is CPU-bound on purpose, so hashing and verification run in a pool of
+# worker processes instead of on the request thread. At most HASH_QUEUE_SIZE
+# jobs may be running or waiting at once; past that callers get a 503.
+HASH_POOL_WORKERS = int(os.environ.get("HASH_POOL_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE_SIZE = int(os.environ.get("HASH_QUEUE_SIZE", "64"))
+HASH_RETRY_AFTER = int(os.environ.get("HASH_RETRY_AFTER", "1"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+hash_duration = Histogram(
+    "password_hash_duration_seconds",
+    "Time spent hashing or verifying a password in a worker process",
+    ["operation"],
+)
+hash_queue_wait = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Time a hashing job waited for a free worker process",
+    ["operation"],
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_SIZE)
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn rather than fork: the parent runs gRPC and other threads.
+            _executor = ProcessPoolExecutor(
+                max_workers=HASH_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def _run(operation, *args):
+    started = time.time()
+    if operation == "hash":
+        result = pwd_context.hash(*args)
+    else:
+        result = pwd_context.verify(*args)
+    return result, started, time.time()
+
+def _acquire_slot():
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503,
+            detail="Too many password operations in progress, try again later",
+            headers={"Retry-After": str(HASH_RETRY_AFTER)},
+        )
+
+def _observe(operation, submitted, started, finished):
+    hash_queue_wait.labels(operation).observe(max(started - submitted, 0))
+    hash_duration.labels(operation).observe(finished - started)
+
+def _submit(operation, *args):
+    _acquire_slot()
+    try:
+        submitted = time.time()
+        result, started, finished = _get_executor().submit(_run, operation, *args).result()
+    finally:
+        _slots.release()
+    _observe(operation, submitted, started, finished)
+    return result
+
+async def _submit_async(operation, *args):
+    _acquire_slot()
+    try:
+        submitted = time.time()
+        future = _get_executor().submit(_run, operation, *args)
+        result, started, finished = await asyncio.wrap_future(future)
+    finally:
+        _slots.release()
+    _observe(operation, submitted, started, finished)
+    return result
+
+def hash_password(password: str) -> str:
+    return _submit("hash", password)
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return _submit("verify", password, hashed_password)
+
+async def hash_password_async(password: str) -> str:
+    return await _submit_async("hash", password)
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await _submit_async("verify", password, hashed_password)
@@ -0,0 +1,33 @@
+import grpc
+import user_pb2
+import user_pb2_grpc
+from database import async_engine, engine
+from health_check import HealthCheck, Probe, database_check, redis_check
+from instrumentation import lag_monitor
+from grpc_server import GRPC_PORT
+from redis_client import get_async_redis
+
+# This service's readiness probes; the checking itself is in health_check.py.
+
+_grpc_channel = None
+
+# A real call into our own gRPC server, not just a TCP connect.
+async def check_grpc():
+    global _grpc_channel
+    if _grpc_channel is None:
+        _grpc_channel = grpc.aio.insecure_channel(f"localhost:{GRPC_PORT}")
+    await user_pb2_grpc.UserServiceStub(_grpc_channel).BatchGetUsers(user_pb2.BatchGetUsersRequest())
+
+checker = HealthCheck(
+    # Redis only carries token cache invalidations here, so losing it
+    # doesn't make the replica unable to serve.
+    [Probe("postgres", database_check(async_engine)), Probe("redis", redis_check(get_async_redis), critical=False), Probe("grpc", check_grpc)],
+    {"db": engine.pool, "db_async": async_engine.pool},
+    lag_monitor,
+)
+
+async def stop():
+    global _grpc_channel
+    if _grpc_channel is not None:
+        await _grpc_channel.close()
+        _grpc_channel = None
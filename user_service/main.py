@@ -1,66 +1,60 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from typing import Optional
 import models, schemas
-from database import SessionLocal, engine
+from database import SessionLocal
 import auth
-import requests 
-import asyncio
-import consul
+import hashing
+import token_cache
+import bulk
+import etag
+import idempotency
 import os
-import grpc
-import time
-from concurrent import futures
-import user_pb2
-import user_pb2_grpc
-import threading
-import uuid
+from contextlib import asynccontextmanager
+import grpc_server
+from http_client import http_client
+from discovery import CONSUL_WATCH, Discovery
+import health
+import instrumentation
+import rate_limit
+import workers
 from prometheus_fastapi_instrumentator import Instrumentator
 
-REQUEST_LIMIT = 10
-request_count = 0
-request_window = 1
-
 INSTANCE_ID = os.environ.get('INSTANCE_ID', '1')
-models.Base.metadata.create_all(bind=engine)
-app = FastAPI()
-
-instrumentator = Instrumentator()
-instrumentator.instrument(app).expose(app)
-
-def register_with_consul():
-    c = consul.Consul(host='consul', port=8500)
-    for _ in range(1, 4):
-        instance_uuid = f"user-service-{uuid.uuid4()}"
-        instance_address = f"user-service"
-
-    c.agent.service.register(
-        name='user-service',
-        service_id=instance_uuid,
-        address=instance_address,
-        port=8000,
-        tags=["users"]
-    )
-    print(f"Registered user-service with Consul as {instance_uuid}")
-
-@app.on_event("startup")
-async def startup_event():
-    register_with_consul()
-
-def monitor_requests():
-    global request_count
-    while True:
-        time.sleep(request_window)
-        if request_count > REQUEST_LIMIT:
-            print(f"ALERT: High request load detected! ({request_count} requests per second)")
-        request_count = 0
-
-monitor_thread = threading.Thread(target=monitor_requests)
-monitor_thread.daemon = True
-monitor_thread.start()
-
-def increase_request_count():
-    global request_count
-    request_count += 1
+
+discovery = Discovery("user-service", 8000, tags=["users"], watch=CONSUL_WATCH)
+
+# Everything else runs in every worker; see workers.py.
+leader = workers.Leader("user-service")
+leader.run(discovery.register_until_done)
+leader.run(idempotency.purge_loop)
+
+# Importing this module connects to nothing and starts nothing: threads,
+# servers and clients start here, when the app starts. The schema comes from
+# `alembic upgrade head`, run before the app (see entrypoint.sh).
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    token_cache.start_invalidation_listener()
+    # With GRPC_PROCESSES set the gRPC server runs in processes of its own.
+    if not grpc_server.GRPC_PROCESSES:
+        await grpc_server.start()
+    await http_client.start()
+    instrumentation.start()
+    discovery.start()
+    leader.start()
+    yield
+    # Leave Consul first so no new traffic is routed here.
+    await leader.stop()
+    await discovery.stop()
+    await grpc_server.stop()
+    await health.stop()
+    await instrumentation.stop()
+    await http_client.close()
+    hashing.shutdown()
+
+router = APIRouter()
 
 def get_db():
     db = SessionLocal()
@@ -69,77 +63,134 @@ def get_db():
     finally:
         db.close()
 
-@app.post("/api/users/register", response_model=schemas.UserResponse)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    increase_request_count()
+# With an Idempotency-Key header, a retried registration returns the user
+# the first attempt created instead of "Email already registered".
+@router.post("/api/users/register", response_model=schemas.UserResponse)
+def register_user(
+    user: schemas.UserCreate,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=idempotency.IDEMPOTENCY_KEY_MAX_LENGTH),
+):
+    hashed_password = hashing.hash_password(user.password)
+    if idempotency_key is not None:
+        # The password stays out of the fingerprint so it isn't stored in any form.
+        request_hash = idempotency.fingerprint("register_user", user.model_dump(exclude={"password"}))
+        replay = idempotency.lookup(db, idempotency_key, request_hash)
+        if replay is not None:
+            return replay
     user_in_db = models.get_user_by_email(db, user.email)
     if user_in_db:
         raise HTTPException(status_code=400, detail="Email already registered")
-    new_user = models.create_user(db=db, user=user)
-    return new_user
+    try:
+        if idempotency_key is None:
+            return models.create_user(db=db, user=user, hashed_password=hashed_password)
+        new_user = models.create_user(db=db, user=user, hashed_password=hashed_password, commit=False)
+    except IntegrityError:
+        # The email was registered since the check above, possibly by a
+        # concurrent retry of this same request.
+        db.rollback()
+        if idempotency_key is not None:
+            replay = idempotency.lookup(db, idempotency_key, request_hash)
+            if replay is not None:
+                return replay
+        raise HTTPException(status_code=400, detail="Email already registered")
+    response = schemas.UserResponse.model_validate(new_user).model_dump()
+    return idempotency.remember(db, idempotency_key, request_hash, response)
 
-@app.post("/api/users/login")
+@router.post("/api/users/login")
 def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
-    increase_request_count()
     user_in_db = auth.authenticate_user(db, user.email, user.password)
     if not user_in_db:
         raise HTTPException(status_code=400, detail="Invalid credentials")
     token = auth.create_access_token(data={"sub": user.email})
     return {"token": token}
 
-@app.get("/api/users/me", response_model=schemas.UserResponse)
-def get_profile(current_user: schemas.User = Depends(auth.get_current_user)):
-    increase_request_count()
+@router.get("/api/users/me", response_model=schemas.UserProfile)
+def get_profile(response: Response, current_user: schemas.User = Depends(auth.get_current_user), if_none_match: Optional[str] = Header(None)):
+    tag = etag.for_version("user", current_user.id, current_user.version)
+    if etag.matches(if_none_match, tag):
+        return etag.not_modified(tag)
+    response.headers["ETag"] = tag
     return current_user
 
-@app.put("/api/users/me", response_model=dict)
+@router.put("/api/users/me", response_model=dict)
 def update_profile(updated_user: schemas.UserUpdate, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    increase_request_count()
     updated_user_data = models.update_user_profile(db, user_id=current_user.id, updated_user=updated_user)
     if not updated_user_data:
         raise HTTPException(status_code=400, detail="Failed to update profile")
+    token_cache.invalidate_user(current_user.id)
     return {"message": "Profile updated successfully"}
 
-@app.get("/api/users/{user_id}", response_model=schemas.UserResponse)
-def get_user_by_id(user_id: int, db: Session = Depends(get_db)):
-    increase_request_count()
+# Changes only the fields in the body and returns the updated profile.
+@router.patch("/api/users/me", response_model=schemas.UserProfile)
+def patch_profile(changes: schemas.UserPatch, response: Response, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    user = current_user
+    if changes.model_fields_set:
+        user = models.update_user_profile(db, user_id=current_user.id, updated_user=changes)
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        token_cache.invalidate_user(current_user.id)
+    response.headers["ETag"] = etag.for_version("user", user.id, user.version)
+    return user
+
+# Bulk import: the body is NDJSON (one user per line) or CSV with a header
+# row, each row with a password or a bcrypt hashed_password. Rows that fail
+# validation or whose email is taken are reported by line number and skipped.
+@router.post("/api/users/bulk", dependencies=[Depends(bulk.require_bulk_token)])
+async def import_users(request: Request, format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    return await bulk.import_users(request.stream(), format)
+
+# Bulk export of every user's id, name and email, ordered by ID.
+@router.get("/api/users/bulk", dependencies=[Depends(bulk.require_bulk_token)])
+async def export_users(format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    return StreamingResponse(bulk.export_users(format), media_type=bulk.MEDIA_TYPES[format])
+
+@router.get("/api/users/{user_id}", response_model=schemas.UserProfile)
+def get_user_by_id(user_id: int, response: Response, db: Session = Depends(get_db), if_none_match: Optional[str] = Header(None)):
     user = models.get_user_by_id(db, user_id=user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    tag = etag.for_version("user", user.id, user.version)
+    if etag.matches(if_none_match, tag):
+        return etag.not_modified(tag)
+    response.headers["ETag"] = tag
     return user
 
-@app.delete("/api/users/{user_id}")
+@router.delete("/api/users/{user_id}")
 def delete_user(user_id: int, db: Session = Depends(get_db)):
     user = models.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     models.delete_user(db, user_id)
+    token_cache.invalidate_user(user_id)
     return {"message": "User deleted successfully"}
 
-@app.get("/status")
+@router.get("/status")
 def status():
     return {"status": f"User service instance {INSTANCE_ID} is running"}
 
-class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
-    def GetUserStatus(self, request, context):
-        user_id = request.user_id
-        if user_id == '1':
-            return user_pb2.UserResponse(status='active')
-        else:
-            return user_pb2.UserResponse(status='inactive')
-
-def serve_grpc():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    user_pb2_grpc.add_UserServiceServicer_to_server(UserServiceServicer(), server)
-    server.add_insecure_port('[::]:50051')
-    server.start()
-    print("gRPC server for User Service is running on port 50051")
-    try:
-        while True:
-            time.sleep(86400)
-    except KeyboardInterrupt:
-        server.stop(0)
-
-grpc_thread = threading.Thread(target=serve_grpc)
-grpc_thread.daemon = True
-grpc_thread.start()
+@router.get("/health/live")
+async def health_live():
+    return health.checker.live()
+
+# 200 while this replica can serve requests, 503 otherwise; see health.py.
+@router.get("/health/ready")
+async def health_ready():
+    ready, report = await health.checker.ready()
+    return JSONResponse(report, status_code=200 if ready else 503)
+
+def create_app():
+    app = FastAPI(lifespan=lifespan)
+    # Pool, query, loop lag and WebSocket metrics come from
+    # instrumentation.py and are served on the same /metrics.
+    Instrumentator().instrument(app).expose(app)
+    # Login and registration get their own, much smaller budget per client
+    # to slow down password guessing and signup floods.
+    app.add_middleware(rate_limit.RateLimitMiddleware, rules={
+        "POST /api/users/login": rate_limit.Limit(rate=1, burst=10),
+        "POST /api/users/register": rate_limit.Limit(rate=1, burst=10),
+    })
+    app.include_router(router)
+    return app
+
+app = create_app()
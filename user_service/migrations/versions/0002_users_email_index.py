@@ -0,0 +1,38 @@
+"""Unique index on users.email
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _drop_if_invalid(name):
+    # A concurrent build that failed, e.g. on duplicate emails, leaves an
+    # invalid index behind, which IF NOT EXISTS would then skip.
+    query = sa.text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)")
+    if op.get_bind().execute(query, {"name": name}).scalar():
+        op.execute(f"DROP INDEX CONCURRENTLY {name}")
+
+
+def upgrade():
+    # Every login and every authenticated request looks a user up by email.
+    # Tables made by db-init have no index on it at all.
+    if op.get_bind().dialect.name != "postgresql":
+        op.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)")
+        return
+    # Built without blocking writes to users.
+    with op.get_context().autocommit_block():
+        _drop_if_invalid("ix_users_email")
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_users_email ON users (email)")
+
+
+def downgrade():
+    # ix_users_email is part of the schema 0001 creates, so it stays.
+    pass
@@ -0,0 +1,26 @@
+"""Profile fields and a row version on users
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # With a constant default, Postgres adds version without rewriting users.
+    op.add_column("users", sa.Column("bio", sa.Text()))
+    op.add_column("users", sa.Column("avatar_url", sa.String()))
+    op.add_column("users", sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade():
+    op.drop_column("users", "version")
+    op.drop_column("users", "avatar_url")
+    op.drop_column("users", "bio")
@@ -1,12 +1,11 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, DateTime, Integer, String, Text, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import Base
-from passlib.context import CryptContext
 import schemas 
 import models 
+import hashing
 from sqlalchemy.orm import Session
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 class User(Base):
     __tablename__ = "users"
 
@@ -14,11 +13,30 @@ class User(Base):
     name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
+    bio = Column(Text)
+    avatar_url = Column(String)
+    # Bumped by every profile update; GETs of the user use it as their ETag.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+# The stored response of a request sent with an Idempotency-Key header, kept
+# until expires_at so a retry gets the same answer instead of a second write.
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    response = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
 
-def create_user(db, user):
-    hashed_password = pwd_context.hash(user.password)
+# The password is hashed by the caller, before the transaction starts, so no
+# connection is held through bcrypt. With commit=False the user is only
+# flushed, so the caller can add more to the same transaction.
+def create_user(db, user, hashed_password: str, commit: bool = True):
     db_user = User(name=user.name, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
+    if not commit:
+        db.flush()
+        return db_user
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -29,19 +47,60 @@ def get_user_by_email(db, email: str):
 def get_user_by_id(db: Session, user_id: int):
     return db.query(User).filter(User.id == user_id).first()
 
-def update_user_profile(db: Session, user_id: int, updated_user: schemas.UserUpdate):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        return None
-    user.name = updated_user.name
-    user.bio = updated_user.bio
-    user.avatar_url = updated_user.avatar_url
+# Writes the fields set on updated_user (every field of a UserUpdate, the
+# ones sent for a UserPatch) and bumps version in one UPDATE ... RETURNING.
+# Returns the updated user as a schemas.User, or None if there is none.
+def _profile_update(user_id: int, updated_user):
+    values = updated_user.model_dump(exclude_unset=True)
+    return (
+        update(User).where(User.id == user_id).values(**values, version=User.version + 1)
+        .returning(*User.__table__.columns)
+    )
+
+def update_user_profile(db: Session, user_id: int, updated_user):
+    row = db.execute(_profile_update(user_id, updated_user)).mappings().first()
     db.commit()
-    db.refresh(user)
-    return user
+    return None if row is None else schemas.User.model_validate(dict(row))
 
 def delete_user(db: Session, user_id: int):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if user:
         db.delete(user)
-        db.commit()
\ No newline at end of file
+        db.commit()
+
+# Async versions of the above, for code running on the event loop.
+
+async def create_user_async(db: AsyncSession, user):
+    hashed_password = await hashing.hash_password_async(user.password)
+    db_user = User(name=user.name, email=user.email, hashed_password=hashed_password)
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    return (await db.scalars(select(User).where(User.email == email))).first()
+
+async def get_user_by_id_async(db: AsyncSession, user_id: int):
+    return await db.get(User, user_id)
+
+async def update_user_profile_async(db: AsyncSession, user_id: int, updated_user):
+    row = (await db.execute(_profile_update(user_id, updated_user))).mappings().first()
+    await db.commit()
+    return None if row is None else schemas.User.model_validate(dict(row))
+
+async def delete_user_async(db: AsyncSession, user_id: int):
+    user = await db.get(User, user_id)
+    if user:
+        await db.delete(user)
+        await db.commit()
+
+async def get_users_by_ids_async(db: AsyncSession, user_ids):
+    return (await db.scalars(select(User).where(User.id.in_(user_ids)))).all()
+
+# Looks the users up batch_size IDs at a time, so any number of IDs stays
+# under the driver's bound-parameter limit.
+async def stream_users_by_ids_async(db: AsyncSession, user_ids, batch_size: int = 1000):
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), batch_size):
+        for user in await get_users_by_ids_async(db, user_ids[start:start + batch_size]):
+            yield user
@@ -0,0 +1,35 @@
+import threading
+from redis.cluster import RedisCluster, ClusterNode
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster, ClusterNode as AsyncClusterNode
+
+startup_nodes = [
+    ClusterNode("redis-node-1", 6379),
+    ClusterNode("redis-node-2", 6379),
+    ClusterNode("redis-node-3", 6379),
+    ClusterNode("redis-node-4", 6379),
+    ClusterNode("redis-node-5", 6379),
+    ClusterNode("redis-node-6", 6379),
+]
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+# The cluster client connects on construction, so it's only built the first
+# time something needs Redis.
+def get_redis():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = RedisCluster(startup_nodes=startup_nodes, decode_responses=True)
+        return _client
+
+def get_async_redis():
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = AsyncRedisCluster(
+                startup_nodes=[AsyncClusterNode(node.host, node.port) for node in startup_nodes],
+                decode_responses=True,
+            )
+        return _async_client
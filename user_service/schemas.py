@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from typing import Optional
+from pydantic import BaseModel, field_validator, model_validator
 
 class UserBase(BaseModel):
     name: str
@@ -8,10 +9,37 @@ class User(BaseModel):
     id: int
     name: str
     email: str
+    bio: Optional[str] = None
+    avatar_url: Optional[str] = None
+    version: Optional[int] = None
+
+    class Config:
+        from_attributes = True
 
 class UserCreate(UserBase):
     password: str
 
+# A row of a bulk user import: either a plain password or a bcrypt hash
+# carried over from an export. Empty CSV fields count as missing.
+class UserImport(UserBase):
+    password: Optional[str] = None
+    hashed_password: Optional[str] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def blank_is_missing(cls, data):
+        if isinstance(data, dict):
+            return {key: value for key, value in data.items() if value != ""}
+        return data
+
+    @model_validator(mode="after")
+    def one_password(self):
+        if (self.password is None) == (self.hashed_password is None):
+            raise ValueError("Exactly one of password and hashed_password is required")
+        if self.hashed_password is not None and not self.hashed_password.startswith("$2"):
+            raise ValueError("hashed_password must be a bcrypt hash")
+        return self
+
 class UserLogin(BaseModel):
     email: str
     password: str
@@ -22,11 +50,28 @@ class UserResponse(UserBase):
     class Config:
         from_attributes = True
 
+class UserProfile(UserResponse):
+    bio: Optional[str] = None
+    avatar_url: Optional[str] = None
+
 class UserUpdate(BaseModel):
     name: str
     bio: str
     avatar_url: str
 
+# A partial profile update: only the fields sent are changed.
+class UserPatch(BaseModel):
+    name: Optional[str] = None
+    bio: Optional[str] = None
+    avatar_url: Optional[str] = None
+
+    @field_validator("name")
+    @classmethod
+    def name_not_null(cls, value):
+        if value is None:
+            raise ValueError("name can't be null")
+        return value
+
 class PostCreate(BaseModel):
     title: str
     content: str
@@ -1,9 +1,25 @@
+import asyncio
+import os
 import pytest
+import subprocess
+import sys
+import threading
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
+import main
 from main import app
+import auth
+import hashing
+import token_cache
+import bulk
+import grpc_server
+import user_pb2
+from database import Base
 from models import User
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 client = TestClient(app)
 
@@ -57,6 +73,7 @@ def test_login_valid_credentials(mock_create_access_token, mock_authenticate_use
 
     assert response.status_code == 200
     assert response.json() == {"token": "mocktoken"}
+    assert response.headers["ratelimit-limit"] == "10"
 
 @patch("main.get_db")
 @patch("auth.authenticate_user")
@@ -72,3 +89,330 @@ def test_login_invalid_credentials(mock_authenticate_user, mock_get_db, mock_db_
     assert response.status_code == 400
     assert response.json() == {"detail": "Invalid credentials"}
 
+@patch("models.get_user_by_email")
+@patch("hashing._slots", threading.BoundedSemaphore(1))
+def test_register_user_hashing_pool_full(mock_get_user_by_email):
+    mock_get_user_by_email.return_value = None
+    hashing._slots.acquire()
+
+    response = client.post(
+        "/api/users/register",
+        json={"name": "Test User", "email": "newuser@example.com", "password": "testpassword"},
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(hashing.HASH_RETRY_AFTER)
+
+def test_hash_and_verify_password_in_pool():
+    hashed_password = hashing.hash_password("testpassword")
+
+    assert hashing.verify_password("testpassword", hashed_password)
+    assert not hashing.verify_password("wrongpassword", hashed_password)
+
+@patch("redis_client.get_redis")
+@patch("models.get_user_by_email")
+def test_get_profile_uses_token_cache(mock_get_user_by_email, mock_get_redis):
+    token_cache.clear()
+    mock_get_user_by_email.return_value = User(id=1, name="Test User", email="testuser@example.com")
+    headers = {"Authorization": f"Bearer {auth.create_access_token(data={'sub': 'testuser@example.com'})}"}
+
+    first = client.get("/api/users/me", headers=headers)
+    second = client.get("/api/users/me", headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == {"id": 1, "name": "Test User", "email": "testuser@example.com", "bio": None, "avatar_url": None}
+    assert mock_get_user_by_email.call_count == 1
+
+    token_cache.invalidate_user(1)
+    client.get("/api/users/me", headers=headers)
+
+    assert mock_get_user_by_email.call_count == 2
+    mock_get_redis.return_value.publish.assert_called_once_with(token_cache.INVALIDATION_CHANNEL, "1")
+
+@patch("redis_client.get_redis")
+@patch("models.get_user_by_email")
+def test_user_read_before_an_invalidation_is_not_cached(mock_get_user_by_email, mock_get_redis):
+    token_cache.clear()
+    headers = {"Authorization": f"Bearer {auth.create_access_token(data={'sub': 'testuser@example.com'})}"}
+
+    # The profile changes, and is invalidated, after the row was read.
+    def read_then_invalidate(db, email):
+        user = User(id=1, name="Old name", email=email)
+        token_cache.invalidate_user(1)
+        return user
+
+    mock_get_user_by_email.side_effect = read_then_invalidate
+    client.get("/api/users/me", headers=headers)
+    mock_get_user_by_email.side_effect = None
+    mock_get_user_by_email.return_value = User(id=1, name="New name", email="testuser@example.com")
+    response = client.get("/api/users/me", headers=headers)
+
+    assert response.json()["name"] == "New name"
+    assert mock_get_user_by_email.call_count == 2
+
+def test_batch_get_users_returns_rows_and_missing_ids(monkeypatch):
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        monkeypatch.setattr(grpc_server, "AsyncSessionLocal", session_factory)
+        async with session_factory() as db:
+            db.add_all([User(id=i, name=f"User {i}", email=f"user{i}@example.com") for i in (1, 2, 3)])
+            await db.commit()
+
+        servicer = grpc_server.UserServiceServicer()
+        request = user_pb2.BatchGetUsersRequest(user_ids=[3, 1, 7])
+        response = await servicer.BatchGetUsers(request, None)
+        streamed = [user async for user in servicer.StreamUsers(request, None)]
+        await engine.dispose()
+        return response, streamed
+
+    response, streamed = asyncio.run(scenario())
+
+    assert sorted((user.id, user.name) for user in response.users) == [(1, "User 1"), (3, "User 3")]
+    assert list(response.missing_ids) == [7]
+    assert [user.id for user in streamed] == [1, 3]
+
+def test_bulk_import_skips_taken_and_duplicate_emails(monkeypatch):
+    hashed = hashing.pwd_context.hash("secret", rounds=4)
+    ndjson = "\n".join([
+        f'{{"name": "A", "email": "a@example.com", "hashed_password": "{hashed}"}}',
+        f'{{"name": "Taken", "email": "taken@example.com", "hashed_password": "{hashed}"}}',
+        f'{{"name": "A again", "email": "a@example.com", "hashed_password": "{hashed}"}}',
+        '{"name": "No password", "email": "b@example.com"}',
+    ]).encode()
+
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        monkeypatch.setattr(bulk, "async_engine", engine)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add(User(name="Taken", email="taken@example.com", hashed_password=hashed))
+            await db.commit()
+
+        async def chunks():
+            yield ndjson
+
+        report = await bulk.import_users(chunks())
+        exported = "".join([chunk async for chunk in bulk.export_users("csv")])
+        await engine.dispose()
+        return report, exported
+
+    report, exported = asyncio.run(scenario())
+
+    assert report["imported"] == 1
+    assert sorted((error["line"], error["error"]) for error in report["errors"]) == [
+        (2, "Email already registered"),
+        (3, "Duplicate email in import"),
+        (4, "Value error, Exactly one of password and hashed_password is required"),
+    ]
+    assert exported == "id,name,email\n1,Taken,taken@example.com\n2,A,a@example.com\n"
+
+def test_bulk_import_skips_emails_registered_while_hashing(monkeypatch):
+    ndjson = "\n".join([
+        '{"name": "Racer", "email": "racer@example.com", "password": "secret"}',
+        '{"name": "C", "email": "c@example.com", "password": "secret"}',
+    ]).encode()
+
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        monkeypatch.setattr(bulk, "async_engine", engine)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        hash_passwords = bulk._hash_passwords
+
+        # A registration lands after the import checked which emails are taken.
+        async def register_then_hash(valid):
+            async with session_factory() as db:
+                db.add(User(name="Registered", email="racer@example.com", hashed_password="x"))
+                await db.commit()
+            return await hash_passwords(valid)
+
+        async def hash_password_async(password):
+            return hashing.pwd_context.hash(password, rounds=4)
+
+        async def chunks():
+            yield ndjson
+
+        monkeypatch.setattr(bulk, "_hash_passwords", register_then_hash)
+        monkeypatch.setattr(hashing, "hash_password_async", hash_password_async)
+        report = await bulk.import_users(chunks())
+        async with session_factory() as db:
+            names = sorted((await db.scalars(select(User.name))).all())
+        await engine.dispose()
+        return report, names
+
+    report, names = asyncio.run(scenario())
+
+    assert report["imported"] == 1
+    assert report["errors"] == [{"line": 1, "error": "Email already registered"}]
+    assert names == ["C", "Registered"]
+
+def test_register_user_with_idempotency_key_replays_first_response():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[main.get_db] = override_get_db
+    try:
+        body = {"name": "Saga User", "email": "saga@example.com", "password": "testpassword"}
+        headers = {"Idempotency-Key": "saga-1:user"}
+        first = client.post("/api/users/register", json=body, headers=headers)
+        retry = client.post("/api/users/register", json=body, headers=headers)
+        reused = client.post("/api/users/register", json={**body, "name": "Other"}, headers=headers)
+        without_key = client.post("/api/users/register", json=body)
+    finally:
+        app.dependency_overrides.clear()
+
+    with session_factory() as db:
+        users = db.query(User).count()
+
+    assert first.status_code == 200
+    assert retry.json() == first.json()
+    assert reused.status_code == 422
+    assert without_key.status_code == 400
+    assert users == 1
+
+def test_register_user_replays_a_concurrent_retry_that_took_the_email(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[main.get_db] = override_get_db
+    try:
+        body = {"name": "Saga User", "email": "saga@example.com", "password": "testpassword"}
+        headers = {"Idempotency-Key": "saga-1:user"}
+        first = client.post("/api/users/register", json=body, headers=headers)
+        # The retry checks the key and the email before the first attempt
+        # commits, so it only finds out at the insert.
+        lookup = main.idempotency.lookup
+        lookups = []
+
+        def lookup_before_the_commit(db, key, request_hash):
+            lookups.append(key)
+            return None if len(lookups) == 1 else lookup(db, key, request_hash)
+
+        monkeypatch.setattr(main.idempotency, "lookup", lookup_before_the_commit)
+        monkeypatch.setattr(main.models, "get_user_by_email", lambda db, email: None)
+        retry = client.post("/api/users/register", json=body, headers=headers)
+        other = client.post("/api/users/register", json=body, headers={"Idempotency-Key": "saga-2:user"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert first.status_code == 200
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert other.status_code == 400
+
+def test_health_live():
+    response = client.get("/health/live")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "alive"
+
+def test_migrations_index_email_on_a_table_made_by_db_init(tmp_path):
+    # The users table as the old db-init/userdb-init.sql made it, without indexes.
+    url = f"sqlite:///{tmp_path}/userdb.db"
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR, email VARCHAR, hashed_password VARCHAR)"))
+    engine.dispose()
+
+    result = subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=os.path.dirname(os.path.dirname(__file__)),
+                            env={**os.environ, "DATABASE_URL": url}, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+
+    # The lookup behind every login and authenticated request.
+    query = select(User).where(User.email == "user@example.com")
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        sql = str(query.compile(conn, compile_kwargs={"literal_binds": True}))
+        steps = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+    engine.dispose()
+
+    assert any(step.startswith("SEARCH users USING INDEX ix_users_email ") for step in steps), steps
+
+def with_user_db(check):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        db.add(User(id=1, name="Profile User", email="profile@example.com", hashed_password="hash"))
+        db.commit()
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    app.dependency_overrides[main.get_db] = override_get_db
+    app.dependency_overrides[auth.get_db] = override_get_db
+    token_cache.clear()
+    try:
+        return check(statements), session_factory
+    finally:
+        app.dependency_overrides.clear()
+        token_cache.clear()
+
+@patch("redis_client.get_redis")
+def test_patch_profile_changes_sent_fields_in_one_update(mock_get_redis):
+    headers = {"Authorization": f"Bearer {auth.create_access_token(data={'sub': 'profile@example.com'})}"}
+
+    def check(statements):
+        client.get("/api/users/me", headers=headers)
+        statements.clear()
+        return client.patch("/api/users/me", json={"bio": "Drives a Civic"}, headers=headers), list(statements)
+
+    (response, statements), session_factory = with_user_db(check)
+    with session_factory() as db:
+        user = db.get(User, 1)
+
+    assert response.status_code == 200
+    assert response.json() == {"id": 1, "name": "Profile User", "email": "profile@example.com",
+                               "bio": "Drives a Civic", "avatar_url": None}
+    assert response.headers["ETag"] == '"user-1-v2"'
+    assert len(statements) == 1 and statements[0].startswith("UPDATE users SET")
+    assert (user.name, user.bio, user.version) == ("Profile User", "Drives a Civic", 2)
+    mock_get_redis.return_value.publish.assert_called_once_with(token_cache.INVALIDATION_CHANNEL, "1")
+
+def test_patch_profile_rejects_a_null_name():
+    headers = {"Authorization": f"Bearer {auth.create_access_token(data={'sub': 'profile@example.com'})}"}
+
+    response, _ = with_user_db(lambda statements: client.patch("/api/users/me", json={"name": None}, headers=headers))
+
+    assert response.status_code == 422
+
+def test_get_user_answers_if_none_match_with_304():
+    def check(statements):
+        first = client.get("/api/users/1")
+        return first, client.get("/api/users/1", headers={"If-None-Match": first.headers["ETag"]})
+
+    (first, second), _ = with_user_db(check)
+
+    assert first.status_code == 200
+    assert first.headers["ETag"] == '"user-1-v1"'
+    assert second.status_code == 304
+    assert second.headers["ETag"] == '"user-1-v1"'
+    assert second.content == b""
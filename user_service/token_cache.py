@@ -0,0 +1,122 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from prometheus_client import Counter
+import redis_client
+
+# Decoded tokens and their user rows, keyed by a hash of the token. An entry
+# lives for at most TOKEN_CACHE_TTL seconds and never past the token's exp.
+#
+# Invalidations are numbered. A load takes generation() before it reads the
+# user, and put() skips the entry if that user was invalidated since, so a
+# read that raced an invalidation can't cache the old row. Only the last
+# TOKEN_CACHE_SIZE invalidations are remembered; a load that started before
+# a forgotten one isn't cached at all.
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", "60"))
+INVALIDATION_CHANNEL = "user_cache_invalidation"
+
+cache_hits = Counter("token_cache_hits", "Authenticated requests served from the token cache")
+cache_misses = Counter("token_cache_misses", "Authenticated requests that had to decode the token and load the user")
+
+_entries = OrderedDict()
+_keys_by_user = {}
+_invalidated = OrderedDict()
+_generation = 0
+_forgotten = 0
+_lock = threading.Lock()
+
+def _key(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _remove(key):
+    _, user = _entries.pop(key)
+    keys = _keys_by_user.get(user.id)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del _keys_by_user[user.id]
+
+# Called with _lock held; user_id None stands for every user.
+def _invalidate(user_id):
+    global _generation, _forgotten
+    _generation += 1
+    if user_id is None:
+        _invalidated.clear()
+        _forgotten = _generation
+        return
+    _invalidated.pop(user_id, None)
+    _invalidated[user_id] = _generation
+    while len(_invalidated) > TOKEN_CACHE_SIZE:
+        _, _forgotten = _invalidated.popitem(last=False)
+
+def generation():
+    with _lock:
+        return _generation
+
+def get(token: str):
+    key = _key(token)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                _entries.move_to_end(key)
+                cache_hits.inc()
+                return entry[1]
+            _remove(key)
+    cache_misses.inc()
+    return None
+
+def put(token: str, user, token_exp: float, generation: int):
+    key = _key(token)
+    expires_at = min(time.time() + TOKEN_CACHE_TTL, token_exp)
+    with _lock:
+        if max(_forgotten, _invalidated.get(user.id, 0)) > generation:
+            return
+        if key in _entries:
+            _remove(key)
+        _entries[key] = (expires_at, user)
+        _keys_by_user.setdefault(user.id, set()).add(key)
+        while len(_entries) > TOKEN_CACHE_SIZE:
+            _remove(next(iter(_entries)))
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _keys_by_user.clear()
+        _invalidate(None)
+
+def evict_user(user_id: int):
+    with _lock:
+        _invalidate(user_id)
+        for key in list(_keys_by_user.get(user_id, ())):
+            _remove(key)
+
+# Drops the user's entries here and tells the other replicas to do the same.
+def invalidate_user(user_id: int):
+    evict_user(user_id)
+    try:
+        redis_client.get_redis().publish(INVALIDATION_CHANNEL, str(user_id))
+    except Exception as e:
+        print(f"Failed to publish cache invalidation for user {user_id}: {e}")
+
+def listen_for_invalidations():
+    while True:
+        try:
+            pubsub = redis_client.get_redis().pubsub()
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                if message and message['type'] == 'message':
+                    evict_user(int(message['data']))
+        except Exception as e:
+            print(f"Cache invalidation listener error: {e}, retrying")
+            # Anything could have changed while we weren't listening.
+            clear()
+            time.sleep(1)
+
+def start_invalidation_listener():
+    listener_thread = threading.Thread(target=listen_for_invalidations)
+    listener_thread.daemon = True
+    listener_thread.start()
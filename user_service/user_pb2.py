@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nuser.proto\x12\x04user\"\x1e\n\x0bUserRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"\x1e\n\x0cUserResponse\x12\x0e\n\x06status\x18\x01 \x01(\t2E\n\x0bUserService\x12\x36\n\rGetUserStatus\x12\x11.user.UserRequest\x1a\x12.user.UserResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nuser.proto\x12\x04user\"\x1e\n\x0bUserRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\"\x1e\n\x0cUserResponse\x12\x0e\n\x06status\x18\x01 \x01(\t\"/\n\x04User\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\r\n\x05\x65mail\x18\x03 \x01(\t\"(\n\x14\x42\x61tchGetUsersRequest\x12\x10\n\x08user_ids\x18\x01 \x03(\x03\"G\n\x15\x42\x61tchGetUsersResponse\x12\x19\n\x05users\x18\x01 \x03(\x0b\x32\n.user.User\x12\x13\n\x0bmissing_ids\x18\x02 \x03(\x03\x32\xc8\x01\n\x0bUserService\x12\x36\n\rGetUserStatus\x12\x11.user.UserRequest\x1a\x12.user.UserResponse\x12H\n\rBatchGetUsers\x12\x1a.user.BatchGetUsersRequest\x1a\x1b.user.BatchGetUsersResponse\x12\x37\n\x0bStreamUsers\x12\x1a.user.BatchGetUsersRequest\x1a\n.user.User0\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -35,6 +35,12 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_USERREQUEST']._serialized_end=50
   _globals['_USERRESPONSE']._serialized_start=52
   _globals['_USERRESPONSE']._serialized_end=82
-  _globals['_USERSERVICE']._serialized_start=84
-  _globals['_USERSERVICE']._serialized_end=153
+  _globals['_USER']._serialized_start=84
+  _globals['_USER']._serialized_end=131
+  _globals['_BATCHGETUSERSREQUEST']._serialized_start=133
+  _globals['_BATCHGETUSERSREQUEST']._serialized_end=173
+  _globals['_BATCHGETUSERSRESPONSE']._serialized_start=175
+  _globals['_BATCHGETUSERSRESPONSE']._serialized_end=246
+  _globals['_USERSERVICE']._serialized_start=249
+  _globals['_USERSERVICE']._serialized_end=449
 # @@protoc_insertion_point(module_scope)